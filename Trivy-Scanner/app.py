@@ -1,10 +1,107 @@
-from flask import Flask, request, jsonify
-from scanner import run_combined_scan
-from models import save_scan_results, get_all_scans, get_scan_details, get_dashboard_summary, delete_scan, get_db_connection
+from flask import Flask, Response, request, jsonify
+from jobs import submit_scan_job, get_job, submit_scan_batch, submit_rescan_batch, get_batch, get_queue_stats, SCAN_BATCH_LIMIT
+from models import get_scan_details, get_dashboard_summary, clear_scan_data, migrate_database, DATABASE_PATH
+from models import list_scans, list_scan_vulnerabilities, SEVERITY_TOTAL_COLUMNS, get_latest_scan_ids, diff_scans, get_cve_affected
+from models import get_dashboard_generation, get_scan_revision, iter_export_findings, EXPORT_COLUMNS, search_findings, get_trends
+from scan_cache import clear_scan_cache
+from response_cache import get_cached_response, store_cached_response, clear_response_cache
+from retention import start_retention_worker
+from scheduler import start_rescan_scheduler
+from events import publish_event, iter_event_stream
+from metrics import render_metrics
+import csv
+import functools
+import hashlib
+import io
+import json
 import os
+from datetime import datetime
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 
+# Upgrade databases created by older versions of setup/create_database.py
+if os.path.exists(DATABASE_PATH):
+    migrate_database()
+
+@app.before_request
+def start_background_workers():
+    # Started on first request so the threads live in the serving process
+    start_retention_worker()
+    start_rescan_scheduler()
+
+def _etag(*parts):
+    """ETag for data identified by parts in the current database file (recreating it changes every tag)"""
+    try:
+        database_id = os.stat(DATABASE_PATH).st_ino
+    except OSError:
+        database_id = 0
+    return hashlib.sha1(repr((database_id,) + parts).encode()).hexdigest()[:20]
+
+def _conditional_response(etag, build_response):
+    """Answer 304 if the client already has etag, otherwise build the response and tag it"""
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(build_response())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    # Clients may keep the response but must check the ETag before reusing it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def generation_etag(view):
+    """Serve conditional GETs for a view whose output only changes when scans are saved or deleted
+    
+    The dashboard generation is bumped by triggers on every write to scans,
+    so save, delete, retention and clear-data all invalidate these tags.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = _etag('generation', get_dashboard_generation())
+        return _conditional_response(etag, lambda: view(*args, **kwargs))
+    return wrapper
+
+# Catalog revision the cached scan responses were built against
+_response_cache_state = {'catalog_revision': None}
+
+def scan_etag(view):
+    """Serve conditional GETs for a view of one saved scan, and cache its responses
+    
+    A saved scan's response changes when its findings are rebuilt from its
+    archived report, or when reprocessing any scan rewrites CVE text in the
+    shared catalog. Both are part of the tag and the cache key. A new catalog
+    revision also empties the cache, since every entry is stale by then.
+    """
+    @functools.wraps(view)
+    def wrapper(scan_id, **kwargs):
+        revision = get_scan_revision(scan_id)
+        if revision is None:
+            return jsonify({
+                'success': False,
+                'error': 'Scan not found'
+            }), 404
+        
+        catalog_revision = revision[2]
+        if _response_cache_state['catalog_revision'] != catalog_revision:
+            clear_response_cache()
+            _response_cache_state['catalog_revision'] = catalog_revision
+        
+        etag = _etag('scan', scan_id, *revision)
+        cache_key = (etag, request.full_path)
+        
+        def build_response():
+            body = get_cached_response(cache_key)
+            if body is not None:
+                return app.response_class(body, mimetype='application/json')
+            response = app.make_response(view(scan_id, **kwargs))
+            if response.status_code == 200:
+                store_cached_response(cache_key, response.get_data())
+            return response
+        
+        return _conditional_response(etag, build_response)
+    return wrapper
+
 # Web Routes
 @app.route('/')
 def dashboard():
@@ -14,7 +111,7 @@ def dashboard():
 # API Routes
 @app.route('/api/scan', methods=['POST'])
 def scan_container():
-    """Scan a container using JSON POST data"""
+    """Queue a container scan using JSON POST data"""
     try:
         data = request.get_json()
         if not data or 'container_name' not in data:
@@ -24,47 +121,118 @@ def scan_container():
             }), 400
         
         container_name = data['container_name']
-        print(f"Starting combined scan for: {container_name}")
+        print(f"Queueing combined scan for: {container_name}")
+        
+        # Hand the scan to the worker pool and return straight away
+        job = submit_scan_job(container_name, force=bool(data.get('force', False)))
+        
+        if not job:
+            return jsonify({
+                'success': False,
+                'error': 'Scan queue is full, try again later'
+            }), 503
+        
+        return jsonify({
+            'success': True,
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'container_name': container_name,
+            'coalesced': job.get('coalesced', False)
+        }), 202
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Unexpected error: {str(e)}'
+        }), 500
+
+@app.route('/api/scan/batch', methods=['POST'])
+def scan_batch():
+    """Queue scans for a list of containers using JSON POST data"""
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('container_names'), list) or not data['container_names']:
+            return jsonify({
+                'success': False,
+                'error': 'Missing container_names list in JSON body'
+            }), 400
+        
+        # Drop blanks and repeats, keeping the submitted order
+        container_names = []
+        for name in data['container_names']:
+            if isinstance(name, str) and name.strip() and name.strip() not in container_names:
+                container_names.append(name.strip())
         
-        # Run the combined scan (Trivy + Docker Bench)
-        scan_result = run_combined_scan(container_name)
+        if not container_names:
+            return jsonify({
+                'success': False,
+                'error': 'No valid container names in container_names'
+            }), 400
+        
+        if len(container_names) > SCAN_BATCH_LIMIT:
+            return jsonify({
+                'success': False,
+                'error': f'Too many containers in one batch (limit is {SCAN_BATCH_LIMIT})'
+            }), 400
         
-        if not scan_result['success']:
+        max_parallel = data.get('max_parallel')
+        if max_parallel is not None and (not isinstance(max_parallel, int) or max_parallel < 1):
             return jsonify({
                 'success': False,
-                'error': scan_result['error']
+                'error': 'max_parallel must be a positive integer'
             }), 400
         
-        # Save to database
-        scan_id = save_scan_results(scan_result)
+        print(f"Queueing batch scan for {len(container_names)} containers")
+        batch = submit_scan_batch(container_names, force=bool(data.get('force', False)),
+                                  max_parallel=max_parallel)
         
-        if not scan_id:
+        return jsonify({
+            'success': True,
+            'batch_id': batch['batch_id'],
+            'max_parallel': batch['max_parallel'],
+            'jobs': [
+                {'container_name': job['container_name'], 'job_id': job['job_id']}
+                for job in batch['jobs']
+            ]
+        }), 202
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Unexpected error: {str(e)}'
+        }), 500
+
+@app.route('/api/rescan', methods=['POST'])
+def rescan_all():
+    """Queue a rescan of the newest image of every known container (for nightly re-evaluation)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        max_parallel = data.get('max_parallel')
+        if max_parallel is not None and (not isinstance(max_parallel, int) or max_parallel < 1):
+            return jsonify({
+                'success': False,
+                'error': 'max_parallel must be a positive integer'
+            }), 400
+        
+        batch = submit_rescan_batch(force=bool(data.get('force', False)), max_parallel=max_parallel)
+        if batch is None:
             return jsonify({
                 'success': False,
-                'error': 'Failed to save scan results to database'
-            }), 500
+                'error': 'No scanned containers to rescan'
+            }), 404
         
-        # Prepare response with both vulnerability and bench data
-        response_data = {
+        print(f"Queueing rescan of {len(batch['jobs'])} containers")
+        return jsonify({
             'success': True,
-            'scan_id': scan_id,
-            'container_name': container_name,
-            'vulnerability_counts': scan_result['vulnerability_counts'],
-            'total_vulnerabilities': scan_result['total_vulnerabilities']
-        }
-        
-        # Add bench results if available
-        if scan_result.get('bench_results'):
-            bench_summary = scan_result['bench_results']['summary']
-            response_data['bench_summary'] = {
-                'total_checks': bench_summary['total_checks'],
-                'fail_count': bench_summary['fail_count'],
-                'warn_count': bench_summary['warn_count'],
-                'pass_count': bench_summary['pass_count'],
-                'score': bench_summary['score']
-            }
-        
-        return jsonify(response_data)
+            'batch_id': batch['batch_id'],
+            'max_parallel': batch['max_parallel'],
+            'jobs': [
+                {'container_name': job['container_name'], 'job_id': job['job_id'],
+                 'from_sbom': job['image_digest'] is not None}
+                for job in batch['jobs']
+            ]
+        }), 202
     
     except Exception as e:
         return jsonify({
@@ -72,7 +240,297 @@ def scan_container():
             'error': f'Unexpected error: {str(e)}'
         }), 500
 
+@app.route('/api/scan/batch/<batch_id>', methods=['GET'])
+def scan_batch_status(batch_id):
+    """Get the status of every scan in a batch"""
+    batch = get_batch(batch_id)
+    
+    if not batch:
+        return jsonify({
+            'success': False,
+            'error': 'Scan batch not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': batch
+    })
+
+@app.route('/api/scan/<job_id>', methods=['GET'])
+def scan_status(job_id):
+    """Get the status of a queued scan job"""
+    job = get_job(job_id)
+    
+    if not job:
+        return jsonify({
+            'success': False,
+            'error': 'Scan job not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': job
+    })
+
+# Page size limits for the paginated listings
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def parse_date_args():
+    """Validate the since/until query parameters, raising ValueError with a message"""
+    args = {}
+    for name in ['since', 'until']:
+        value = request.args.get(name)
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f'{name} must be an ISO 8601 date')
+        args[name] = value
+    return args
+
+def parse_severity_arg(allowed_severities):
+    """Validate the severity query parameter, raising ValueError with a message"""
+    severity = request.args.get('severity')
+    if severity:
+        severity = severity.upper()
+        if severity not in allowed_severities:
+            raise ValueError(f"severity must be one of: {', '.join(allowed_severities)}")
+    return severity
+
+def parse_list_args(allowed_severities):
+    """Validate the shared listing query parameters, raising ValueError with a message"""
+    args = {}
+    
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        args['limit'] = int(limit)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= args['limit'] <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    
+    args['severity'] = parse_severity_arg(allowed_severities)
+    args.update(parse_date_args())
+    args['cursor'] = request.args.get('cursor') or None
+    args['container_name'] = request.args.get('container_name') or None
+    return args
+
+@app.route('/api/scans', methods=['GET'])
+@generation_etag
+def scans_list():
+    """List scans newest first, filtered and paginated with a cursor"""
+    try:
+        args = parse_list_args(list(SEVERITY_TOTAL_COLUMNS))
+        scans, next_cursor = list_scans(args['container_name'], args['severity'], args['since'],
+                                        args['until'], args['cursor'], args['limit'])
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    return jsonify({
+        'success': True,
+        'data': scans,
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/scans/<int:scan_id>', methods=['GET'])
+@scan_etag
+def scan_details(scan_id):
+    """Get a scan with all its vulnerabilities and secrets"""
+    details = get_scan_details(scan_id)
+    
+    if not details:
+        return jsonify({
+            'success': False,
+            'error': 'Scan not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': details
+    })
+
+@app.route('/api/scans/<int:scan_id>/vulnerabilities', methods=['GET'])
+@scan_etag
+def scan_vulnerabilities_list(scan_id):
+    """List a scan's vulnerabilities, filtered by severity and paginated with a cursor"""
+    try:
+        args = parse_list_args(list(SEVERITY_TOTAL_COLUMNS) + ['UNKNOWN'])
+        page = list_scan_vulnerabilities(scan_id, args['severity'], args['cursor'], args['limit'])
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    if page is None:
+        return jsonify({
+            'success': False,
+            'error': 'Scan not found'
+        }), 404
+    
+    vulnerabilities, next_cursor = page
+    return jsonify({
+        'success': True,
+        'data': vulnerabilities,
+        'next_cursor': next_cursor
+    })
+
+# Export formats and their content types
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+def _export_ndjson(columns, batches):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+def _export_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@app.route('/api/export/<kind>', methods=['GET'])
+def export_findings(kind):
+    """Stream every matching vulnerability or secret across scans as NDJSON or CSV"""
+    if kind not in EXPORT_COLUMNS:
+        return jsonify({
+            'success': False,
+            'error': f"Unknown export, use one of: {', '.join(EXPORT_COLUMNS)}"
+        }), 404
+    
+    export_format = request.args.get('format', 'ndjson').lower()
+    try:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+        # Exports are not paginated, so limit and cursor are not read
+        severity = parse_severity_arg(list(SEVERITY_TOTAL_COLUMNS) + ['UNKNOWN'])
+        if severity and kind != 'vulnerabilities':
+            raise ValueError('severity can only filter vulnerabilities')
+        dates = parse_date_args()
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    columns = EXPORT_COLUMNS[kind]
+    batches = iter_export_findings(kind, request.args.get('container_name') or None, severity,
+                                   dates['since'], dates['until'])
+    encode = _export_csv if export_format == 'csv' else _export_ndjson
+    
+    filename = f"{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return app.response_class(encode(columns, batches), mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Finding kinds /api/search can look through
+SEARCH_KINDS = ['vulnerabilities', 'secrets']
+
+@app.route('/api/search', methods=['GET'])
+@generation_etag
+def search():
+    """Full-text search over the findings of each container's newest scan, best matches first"""
+    kind = request.args.get('kind', 'vulnerabilities')
+    try:
+        if kind not in SEARCH_KINDS:
+            raise ValueError(f"kind must be one of: {', '.join(SEARCH_KINDS)}")
+        args = parse_list_args(list(SEVERITY_TOTAL_COLUMNS) + ['UNKNOWN'])
+        if args['severity'] and kind != 'vulnerabilities':
+            raise ValueError('severity can only filter vulnerabilities')
+        findings, next_cursor = search_findings(kind, request.args.get('q', ''), args['container_name'],
+                                                args['severity'], args['cursor'], args['limit'])
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    return jsonify({
+        'success': True,
+        'data': findings,
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/diff', methods=['GET'])
+@generation_etag
+def scan_diff():
+    """Compare two scans, or the latest two scans of a container"""
+    container_name = request.args.get('container_name')
+    
+    if container_name:
+        scan_ids = get_latest_scan_ids(container_name, 2)
+        if len(scan_ids) < 2:
+            return jsonify({
+                'success': False,
+                'error': f'Need at least two scans of {container_name} to compare'
+            }), 404
+        scan_id, base_scan_id = scan_ids
+    else:
+        base_scan_id = request.args.get('base_scan_id', type=int)
+        scan_id = request.args.get('scan_id', type=int)
+        if base_scan_id is None or scan_id is None:
+            return jsonify({
+                'success': False,
+                'error': 'Provide container_name, or base_scan_id and scan_id'
+            }), 400
+    
+    diff = diff_scans(base_scan_id, scan_id)
+    
+    if not diff:
+        return jsonify({
+            'success': False,
+            'error': 'Scan not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': diff
+    })
+
+@app.route('/api/cves/<cve_id>/affected', methods=['GET'])
+@generation_etag
+def cve_affected(cve_id):
+    """List containers whose latest scan reports a CVE"""
+    affected = get_cve_affected(cve_id, request.args.get('package_name') or None)
+    return jsonify({
+        'success': True,
+        'data': affected
+    })
+
+@app.route('/api/trends', methods=['GET'])
+@generation_etag
+def trends():
+    """Daily severity and secret counts for one container, or summed across all containers"""
+    try:
+        args = parse_date_args()
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    points = get_trends(request.args.get('container_name') or None, args['since'], args['until'])
+    return jsonify({
+        'success': True,
+        'data': points
+    })
+
 @app.route('/api/dashboard', methods=['GET'])
+@generation_etag
 def dashboard_summary():
     """Get dashboard summary statistics"""
     summary = get_dashboard_summary()
@@ -81,21 +539,44 @@ def dashboard_summary():
         'data': summary
     })
 
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    """Stream scan progress and dashboard updates as Server-Sent Events"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    return Response(iter_event_stream(last_event_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Scan phase timings, finding counters, queue state and DB latency for Prometheus"""
+    queue_stats = get_queue_stats()
+    gauges = {
+        'scan_queue_depth': ('Scans waiting for a worker', queue_stats['queued']),
+        'scans_active': ('Scans currently running', queue_stats['running']),
+        'scan_workers': ('Configured scan workers', queue_stats['workers']),
+        'scan_queue_limit': ('Most scans allowed to wait for a worker', queue_stats['queue_limit'])
+    }
+    if os.path.exists(DATABASE_PATH):
+        gauges['database_size_bytes'] = ('Size of the SQLite database file', os.path.getsize(DATABASE_PATH))
+    
+    return Response(render_metrics(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/clear-data', methods=['POST'])
 def clear_all_data():
     """Clear all scan data from the database"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM bench_checks')
-        cursor.execute('DELETE FROM bench_scans')
-        cursor.execute('DELETE FROM vulnerabilities')
-        cursor.execute('DELETE FROM scans')
-        cursor.execute('DELETE FROM sqlite_sequence WHERE name IN ("scans", "vulnerabilities", "bench_scans", "bench_checks")')
-        
-        conn.commit()
-        conn.close()
+        clear_scan_data()
+        clear_scan_cache()
+        clear_response_cache()
+        publish_event('resync', {})
         
         return jsonify({
             'success': True,
@@ -0,0 +1,198 @@
+"""Stand-in for the trivy binary that prints synthetic reports without touching the network
+
+Supports the commands scanner.py runs: `trivy version --format json`,
+`trivy image --format json|template|cyclonedx ... <image>` and
+`trivy sbom --format json|template ... <sbom file>`. Report size comes from the
+environment:
+
+    TRIVY_BENCH_VULNS     vulnerabilities per report (default 1000)
+    TRIVY_BENCH_SECRETS   exposed secrets per report (default 20)
+    TRIVY_BENCH_SEED      seed for the generated findings (default 0)
+    TRIVY_BENCH_CACHE     directory to keep generated reports in, so repeated
+                          runs measure reading the report rather than building it
+"""
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+
+DB_UPDATED_AT = '2026-01-01T00:00:00Z'
+
+SEVERITIES = ['CRITICAL', 'HIGH', 'MEDIUM', 'LOW', 'UNKNOWN']
+SEVERITY_WEIGHTS = [3, 15, 45, 30, 7]
+
+# Distinct CVEs the findings are drawn from, so big reports share CVEs across packages like real ones
+CVE_POOL_SIZE = 25000
+
+TARGETS = [
+    ('bench (debian 12.5)', 'debian'),
+    ('usr/local/lib/python3.11/site-packages', 'python-pkg'),
+    ('app/package-lock.json', 'npm'),
+    ('app/go.sum', 'gomod'),
+]
+
+WORDS = ('buffer overflow heap use after free out of bounds read write denial of service '
+         'crafted input remote attacker memory corruption integer overflow null pointer '
+         'dereference certificate validation bypass privilege escalation injection').split()
+
+SECRET_RULES = [
+    ('aws-access-key-id', 'CRITICAL', 'AWS Access Key ID'),
+    ('github-pat', 'CRITICAL', 'GitHub Personal Access Token'),
+    ('private-key', 'HIGH', 'Asymmetric Private Key'),
+    ('slack-web-hook', 'MEDIUM', 'Slack Webhook'),
+    ('jwt-token', 'MEDIUM', 'JWT token'),
+    ('generic-password', 'LOW', 'Password in config'),
+]
+
+def _text(rng, min_words, max_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+def _vulnerability(rng):
+    cve_number = rng.randrange(CVE_POOL_SIZE)
+    package = f'pkg-{rng.randrange(2000)}'
+    installed = f'{rng.randint(0, 9)}.{rng.randint(0, 30)}.{rng.randint(0, 99)}'
+    fixed = '' if rng.random() < 0.3 else f'{installed}-r{rng.randint(1, 9)}'
+    vuln_id = f'CVE-{2015 + cve_number % 11}-{10000 + cve_number}'
+    return {
+        'VulnerabilityID': vuln_id,
+        'PkgID': f'{package}@{installed}',
+        'PkgName': package,
+        'InstalledVersion': installed,
+        'FixedVersion': fixed,
+        'Status': 'fixed' if fixed else 'affected',
+        'SeveritySource': 'nvd',
+        'PrimaryURL': f'https://avd.aquasec.com/nvd/{vuln_id.lower()}',
+        'Title': _text(rng, 4, 12),
+        'Description': _text(rng, 20, 200),
+        'Severity': rng.choices(SEVERITIES, SEVERITY_WEIGHTS)[0],
+        'CVSS': {'nvd': {'V3Score': round(rng.uniform(1, 10), 1)}},
+        'References': [f'https://example.org/advisories/{vuln_id}/{i}' for i in range(rng.randint(1, 6))],
+    }
+
+def _secret(rng):
+    rule_id, severity, title = rng.choice(SECRET_RULES)
+    line = rng.randint(1, 400)
+    return {
+        'RuleID': rule_id,
+        'Category': rule_id.split('-')[0],
+        'Severity': severity,
+        'Title': title,
+        'StartLine': line,
+        'EndLine': line,
+        'Match': f'{rule_id.upper()}=' + '*' * rng.randint(10, 200),
+    }
+
+def build_report(image, vuln_count, secret_count, seed=0):
+    """Build a Trivy JSON report (as a dict) for image"""
+    rng = random.Random(f'{seed}:{vuln_count}:{secret_count}')
+    results = [{'Target': target, 'Class': 'os-pkgs' if kind == 'debian' else 'lang-pkgs',
+                'Type': kind, 'Vulnerabilities': []} for target, kind in TARGETS]
+    for i in range(vuln_count):
+        results[i % len(results)]['Vulnerabilities'].append(_vulnerability(rng))
+
+    secret_targets = [f'app/config/settings-{i}.env' for i in range(max(1, secret_count // 3))]
+    secret_results = {}
+    for _ in range(secret_count):
+        target = rng.choice(secret_targets)
+        secret_results.setdefault(target, []).append(_secret(rng))
+    for target, secrets in secret_results.items():
+        results.append({'Target': target, 'Class': 'secret', 'Secrets': secrets})
+
+    digest = 'sha256:' + hashlib.sha256(image.encode()).hexdigest()
+    return {
+        'SchemaVersion': 2,
+        'ArtifactName': image,
+        'ArtifactType': 'container_image',
+        'Metadata': {
+            'RepoTags': [image],
+            'RepoDigests': [f"{image.split(':')[0]}@{digest}"],
+        },
+        'Results': results,
+    }
+
+def write_stream_lines(report, out):
+    """Write a report the way scanner.STREAM_TEMPLATE renders it: one JSON object per finding"""
+    for result in report['Results']:
+        target = result['Target']
+        for vuln in result.get('Vulnerabilities') or []:
+            out.write('\n' + json.dumps({'Kind': 'vulnerability', 'Target': target, 'Finding': vuln}))
+        for secret in result.get('Secrets') or []:
+            out.write('\n' + json.dumps({'Kind': 'secret', 'Target': target, 'Finding': secret}))
+    out.write('\n')
+
+def build_sbom(image):
+    """Build a minimal CycloneDX SBOM (as a dict) naming image"""
+    return {
+        'bomFormat': 'CycloneDX',
+        'specVersion': '1.5',
+        'metadata': {'component': {'type': 'container', 'name': image}},
+        'components': [],
+    }
+
+def _write_report(image, output_format, out, secret_scan=True):
+    vuln_count = int(os.environ.get('TRIVY_BENCH_VULNS', '1000'))
+    secret_count = int(os.environ.get('TRIVY_BENCH_SECRETS', '20')) if secret_scan else 0
+    seed = int(os.environ.get('TRIVY_BENCH_SEED', '0'))
+    if output_format == 'cyclonedx':
+        json.dump(build_sbom(image), out)
+        return
+    report = build_report(image, vuln_count, secret_count, seed)
+    if output_format == 'template':
+        write_stream_lines(report, out)
+    else:
+        json.dump(report, out, indent=2)
+
+def _image_command(args):
+    output_format = 'table'
+    if '--format' in args:
+        output_format = args[args.index('--format') + 1]
+    if output_format not in ('json', 'template', 'cyclonedx'):
+        sys.stderr.write(f'fake trivy: unsupported format {output_format}\n')
+        return 1
+    image = args[-1]
+
+    cache_dir = os.environ.get('TRIVY_BENCH_CACHE')
+    if not cache_dir:
+        _write_report(image, output_format, sys.stdout)
+        return 0
+
+    key = '-'.join([output_format, image, os.environ.get('TRIVY_BENCH_VULNS', '1000'),
+                    os.environ.get('TRIVY_BENCH_SECRETS', '20'), os.environ.get('TRIVY_BENCH_SEED', '0')])
+    path = os.path.join(cache_dir, hashlib.sha256(key.encode()).hexdigest()[:16] + '.out')
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            _write_report(image, output_format, f)
+        os.replace(path + '.tmp', path)
+    with open(path, 'rb') as f:
+        shutil.copyfileobj(f, sys.stdout.buffer)
+    return 0
+
+def _sbom_command(args):
+    output_format = 'table'
+    if '--format' in args:
+        output_format = args[args.index('--format') + 1]
+    if output_format not in ('json', 'template'):
+        sys.stderr.write(f'fake trivy: unsupported format {output_format}\n')
+        return 1
+    with open(args[-1]) as f:
+        image = json.load(f)['metadata']['component']['name']
+    # SBOMs have no file contents, so there are never secrets
+    _write_report(image, output_format, sys.stdout, secret_scan=False)
+    return 0
+
+def main(args):
+    if args[:1] == ['version']:
+        print(json.dumps({'Version': '0.0.0-bench', 'VulnerabilityDB': {'Version': 2, 'UpdatedAt': DB_UPDATED_AT}}))
+        return 0
+    if args[:1] == ['image']:
+        return _image_command(args[1:])
+    if args[:1] == ['sbom']:
+        return _sbom_command(args[1:])
+    sys.stderr.write(f"fake trivy: unsupported command {' '.join(args)}\n")
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
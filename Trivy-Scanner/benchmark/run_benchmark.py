@@ -0,0 +1,249 @@
+"""Offline benchmark of the scan hot paths: Trivy output parsing, ingestion and dashboard queries
+
+Runs against the fake trivy in this directory, so no network, registry or
+Trivy install is needed. Every run uses a fresh database in a temporary
+directory, pre-populated with a history of scans.
+
+    python benchmark/run_benchmark.py --sizes 1000,10000,100000 --output report.json
+    python benchmark/run_benchmark.py --compare report.json
+
+With --compare, metrics more than --threshold slower than the baseline
+report are flagged and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+# The fake trivy must win over any real one, before scanner.py is imported
+os.environ['PATH'] = BENCH_DIR + os.pathsep + os.environ.get('PATH', '')
+os.environ['TRIVY_SERVER_MODE'] = 'false'
+os.environ['SCAN_CACHE_TTL'] = '0'
+
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.join(APP_DIR, 'setup'))
+
+import models
+from scanner import run_trivy_combined_scan, run_combined_scan, stream_trivy_combined_scan
+from create_database import create_database
+
+# Differences smaller than this many seconds are treated as noise when comparing reports
+NOISE_FLOOR = 0.005
+
+def _set_report_size(vulns, secrets, seed=0):
+    os.environ['TRIVY_BENCH_VULNS'] = str(vulns)
+    os.environ['TRIVY_BENCH_SECRETS'] = str(secrets)
+    os.environ['TRIVY_BENCH_SEED'] = str(seed)
+
+def _time(func, rounds):
+    """Run func rounds times, returning (median seconds, last return value)"""
+    timings = []
+    value = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        value = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), value
+
+def _percentile(timings, pct):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * pct / 100))]
+
+def _time_query(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {'p50': statistics.median(timings), 'p95': _percentile(timings, 95)}
+
+def _consume_stream(scan_stream):
+    for _ in scan_stream['findings']:
+        pass
+    return scan_stream
+
+def populate_history(scans, vulns_per_scan, containers):
+    """Save a history of scans through the normal scan and save path"""
+    for i in range(scans):
+        _set_report_size(vulns_per_scan, 5, seed=i)
+        result = run_combined_scan(f'bench/service-{i % containers}:{i // containers}')
+        if not result['success'] or not models.save_scan_results(result):
+            raise RuntimeError(f"Could not populate history: {result.get('error')}")
+
+def benchmark_size(vulns, secrets, rounds, query_repeat):
+    """Time parsing, ingestion and queries for reports with vulns findings"""
+    _set_report_size(vulns, secrets)
+    image = f'bench/large:{vulns}'
+    results = {}
+
+    # Generate (and cache) the report once so parsing is not timed together with generation
+    run_trivy_combined_scan(image)
+
+    results['parse_buffered'], scan_result = _time(lambda: run_trivy_combined_scan(image), rounds)
+    if not scan_result['success']:
+        raise RuntimeError(scan_result['error'])
+    results['parse_streaming'], _ = _time(lambda: _consume_stream(stream_trivy_combined_scan(image)), rounds)
+
+    report_bytes = len(subprocess.run(['trivy', 'image', '--format', 'json', image],
+                                      capture_output=True).stdout)
+
+    buffered = run_combined_scan(image)
+    results['ingest_buffered'], scan_id = _time(lambda: models.save_scan_results(buffered), rounds)
+    results['ingest_streaming'], _ = _time(lambda: models.save_scan_stream(stream_trivy_combined_scan(image)), rounds)
+
+    details = _time_query(lambda: models.get_scan_details(scan_id), query_repeat)
+    results['scan_details_p50'] = details['p50']
+    results['scan_details_p95'] = details['p95']
+
+    page = _time_query(lambda: models.list_scan_vulnerabilities(scan_id, limit=50), query_repeat)
+    results['vulnerability_page_p50'] = page['p50']
+
+    return results, {
+        'report_bytes': report_bytes,
+        'rows_per_second': round(vulns / results['ingest_buffered']) if results['ingest_buffered'] else None
+    }
+
+def benchmark_dashboard(query_repeat):
+    def cold_summary():
+        # Drop the generation-keyed cache so the summary is rebuilt from the tables
+        with models._summary_cache_lock:
+            models._summary_cache['generation'] = None
+        models.get_dashboard_summary()
+
+    cold = _time_query(cold_summary, query_repeat)
+    warm = _time_query(models.get_dashboard_summary, query_repeat)
+    scans = _time_query(lambda: models.list_scans(limit=50), query_repeat)
+    return {
+        'dashboard_cold_p50': cold['p50'],
+        'dashboard_cold_p95': cold['p95'],
+        'dashboard_warm_p50': warm['p50'],
+        'scan_list_p50': scans['p50']
+    }
+
+def _git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                                capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+def run(args):
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    work_dir = tempfile.mkdtemp(prefix='trivy-bench-')
+    os.environ['TRIVY_BENCH_CACHE'] = os.path.join(work_dir, 'reports')
+    os.chdir(work_dir)
+
+    print(f"Building database with {args.history} history scans in {work_dir}")
+    create_database()
+    start = time.perf_counter()
+    populate_history(args.history, args.history_vulns, args.containers)
+    print(f"History ready in {time.perf_counter() - start:.1f}s")
+
+    metrics = {}
+    details = {}
+    for vulns in sizes:
+        print(f"Benchmarking {vulns} vulnerabilities...")
+        results, info = benchmark_size(vulns, args.secrets, args.rounds, args.query_repeat)
+        for name, seconds in results.items():
+            metrics[f'{name}[{vulns}]'] = seconds
+        details[str(vulns)] = info
+
+    metrics.update(benchmark_dashboard(args.query_repeat))
+
+    os.chdir(APP_DIR)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'config': {
+            'sizes': sizes,
+            'secrets': args.secrets,
+            'history': args.history,
+            'history_vulns': args.history_vulns,
+            'containers': args.containers,
+            'rounds': args.rounds,
+            'query_repeat': args.query_repeat
+        },
+        'details': details,
+        'metrics': metrics
+    }
+
+def print_report(report, baseline=None, threshold=0.2):
+    """Print the metrics, compared with baseline when given, and return the regressed metric names"""
+    regressions = []
+    print()
+    print(f"{'metric':<36} {'seconds':>10} {'baseline':>10} {'change':>8}")
+    for name, seconds in report['metrics'].items():
+        line = f'{name:<36} {seconds:>10.4f}'
+        previous = (baseline or {}).get('metrics', {}).get(name)
+        if previous:
+            change = (seconds - previous) / previous
+            line += f' {previous:>10.4f} {change:>+7.0%}'
+            if change > threshold and seconds - previous > NOISE_FLOOR:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+
+    for size, info in report['details'].items():
+        print(f"{size} vulnerabilities: {info['report_bytes'] / 1e6:.1f} MB report, "
+              f"{info['rows_per_second']} rows/s ingested")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma-separated vulnerabilities per report (up to 500000)')
+    parser.add_argument('--secrets', type=int, default=50, help='exposed secrets per report')
+    parser.add_argument('--history', type=int, default=200, help='scans saved before measuring')
+    parser.add_argument('--history-vulns', type=int, default=500, help='vulnerabilities per history scan')
+    parser.add_argument('--containers', type=int, default=50, help='distinct containers in the history')
+    parser.add_argument('--rounds', type=int, default=3, help='runs of each parse and ingest measurement')
+    parser.add_argument('--query-repeat', type=int, default=20, help='runs of each query measurement')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--compare', help='baseline report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown (fraction) counted as a regression')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        # Same workload as the baseline unless overridden on the command line
+        for key, value in baseline.get('config', {}).items():
+            if key == 'sizes' and args.sizes == parser.get_default('sizes'):
+                args.sizes = ','.join(str(size) for size in value)
+            elif key != 'sizes' and getattr(args, key) == parser.get_default(key):
+                setattr(args, key, value)
+
+    output = os.path.abspath(args.output) if args.output else None
+    report = run(args)
+    regressions = print_report(report, baseline, args.threshold)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {output}")
+
+    if regressions:
+        print(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import itertools
+import json
+import os
+import threading
+from collections import deque
+
+# Number of recent events kept so reconnecting dashboards can catch up via Last-Event-ID
+EVENT_HISTORY = int(os.environ.get('EVENT_HISTORY', '1000'))
+
+# Seconds between keep-alive comments on an idle event stream
+EVENT_KEEPALIVE = 15
+
+# Milliseconds browsers wait before reconnecting a dropped stream
+EVENT_RETRY_MS = 3000
+
+# (event_id, encoded SSE message) - each event is encoded once and shared by every stream
+_events = deque(maxlen=max(1, EVENT_HISTORY))
+_event_ids = itertools.count(1)
+_events_cond = threading.Condition()
+
+def _encode_event(event_id, event_type, data):
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n'
+
+def publish_event(event_type, data):
+    """Send an event to every open event stream"""
+    with _events_cond:
+        event_id = next(_event_ids)
+        _events.append((event_id, _encode_event(event_id, event_type, data)))
+        _events_cond.notify_all()
+
+def _events_after(last_event_id):
+    """Get events newer than last_event_id, or None if some were already dropped (caller holds the lock)"""
+    if not _events:
+        return []
+    first_id = _events[0][0]
+    newest_id = _events[-1][0]
+    if last_event_id >= newest_id:
+        return []
+    if last_event_id < first_id - 1:
+        return None
+    return list(itertools.islice(_events, last_event_id - first_id + 1, None))
+
+def iter_event_stream(last_event_id=None):
+    """Yield Server-Sent Events messages for one client until it disconnects
+
+    Clients reconnecting with Last-Event-ID get the events they missed, or a
+    resync event if those have already left the history (or the server restarted).
+    """
+    with _events_cond:
+        newest_id = _events[-1][0] if _events else 0
+
+    yield f'retry: {EVENT_RETRY_MS}\n\n'
+
+    if last_event_id is None:
+        last_event_id = newest_id
+    elif last_event_id > newest_id:
+        # Event ids restart with the process
+        yield _encode_event(newest_id, 'resync', {})
+        last_event_id = newest_id
+
+    while True:
+        with _events_cond:
+            pending = _events_after(last_event_id)
+            if pending == []:
+                _events_cond.wait(EVENT_KEEPALIVE)
+                pending = _events_after(last_event_id)
+
+        if pending is None:
+            with _events_cond:
+                last_event_id = _events[-1][0]
+            yield _encode_event(last_event_id, 'resync', {})
+            continue
+
+        if not pending:
+            yield ': keep-alive\n\n'
+            continue
+
+        for event_id, message in pending:
+            yield message
+            last_event_id = event_id
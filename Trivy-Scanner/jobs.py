@@ -0,0 +1,553 @@
+import itertools
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from scanner import (run_combined_scan, stream_trivy_combined_scan, resolve_image_digest,
+                     get_trivy_db_version, generate_sbom, TRIVY_STREAMING)
+from models import (save_scan_results, save_scan_stream, copy_scan, get_dashboard_delta, get_sbom, store_sbom,
+                    get_digest_secret_results, get_rescan_targets)
+from events import publish_event
+from metrics import inc, phase_span, record_phase
+from scan_cache import lookup_cached_scan, store_cached_scan
+from trivy_server import get_scan_server
+
+# Number of scans allowed to run at the same time (one Trivy process each)
+SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', '2'))
+
+# Maximum number of scans waiting for a worker before new submissions are rejected
+SCAN_QUEUE_SIZE = int(os.environ.get('SCAN_QUEUE_SIZE', '50'))
+
+# Most images accepted in one /api/scan/batch request
+SCAN_BATCH_LIMIT = int(os.environ.get('SCAN_BATCH_LIMIT', '500'))
+
+# Default number of images from one batch scanned at the same time
+SCAN_BATCH_PARALLEL = int(os.environ.get('SCAN_BATCH_PARALLEL', str(SCAN_WORKERS)))
+
+# Keep a CycloneDX SBOM of every scanned digest and rescan known digests from it instead of the image
+TRIVY_SBOM = os.environ.get('TRIVY_SBOM', 'true').lower() not in ('0', 'false', 'no')
+
+# SBOMs of newly scanned digests waiting to be generated; more are skipped and
+# generated on the digest's next image scan instead
+SBOM_QUEUE_SIZE = 100
+
+# Number of finished jobs kept in memory for status lookups
+JOB_HISTORY_LIMIT = 500
+
+# Number of batches kept in memory for status lookups
+BATCH_HISTORY_LIMIT = 50
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Progress of a job within its status, pushed to dashboards as 'scan' events:
+# queued -> pulling -> scanning -> parsing -> saved, or cached / failed.
+# A job for an image another job is already scanning goes pulling -> waiting -> coalesced.
+PHASE_QUEUED = 'queued'
+PHASE_PULLING = 'pulling'
+PHASE_WAITING = 'waiting'
+PHASE_SAVED = 'saved'
+PHASE_CACHED = 'cached'
+PHASE_COALESCED = 'coalesced'
+PHASE_FAILED = 'failed'
+
+TERMINAL_PHASES = (PHASE_SAVED, PHASE_CACHED, PHASE_COALESCED, PHASE_FAILED)
+
+_job_queue = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+# (container_name, image_digest, timings) of digests whose SBOM is still to be stored
+_sbom_queue = queue.Queue(maxsize=SBOM_QUEUE_SIZE)
+_jobs = OrderedDict()
+_batches = OrderedDict()
+_jobs_lock = threading.Lock()
+_workers = []
+
+# container_name -> job_id of its unfinished /api/scan job, which repeat submissions join
+_active_by_name = {}
+
+# image digest (or container_name when unresolved) -> job_id of the job running Trivy for it
+_scans_in_flight = {}
+
+def build_scan_response(scan_id, scan_result):
+    """Build the API summary for a saved scan (vulnerability and secret counts)"""
+    response_data = {
+        'scan_id': scan_id,
+        'container_name': scan_result['container_name'],
+        'vulnerability_counts': scan_result['vulnerability_counts'],
+        'total_vulnerabilities': scan_result['total_vulnerabilities']
+    }
+
+    # Add bench results if available
+    if scan_result.get('bench_results'):
+        bench_summary = scan_result['bench_results']['summary']
+        response_data['bench_summary'] = {
+            'total_checks': bench_summary['total_checks'],
+            'fail_count': bench_summary['fail_count'],
+            'warn_count': bench_summary['warn_count'],
+            'pass_count': bench_summary['pass_count'],
+            'score': bench_summary['score']
+        }
+
+    return response_data
+
+def _start_workers():
+    """Start the scan worker threads on first use"""
+    with _jobs_lock:
+        if _workers:
+            return
+        for i in range(max(1, SCAN_WORKERS)):
+            worker = threading.Thread(target=_worker_loop, name=f'scan-worker-{i}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+        if TRIVY_SBOM:
+            worker = threading.Thread(target=_sbom_loop, name='sbom-worker', daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+def _worker_loop():
+    """Take jobs off the queue and run them until the process exits"""
+    while True:
+        job_id = _job_queue.get()
+        parked = False
+        try:
+            parked = _run_job(job_id)
+        finally:
+            _job_queue.task_done()
+            # A parked job keeps its batch slot until its leader completes it
+            if not parked:
+                _finish_batch_job(job_id)
+
+def _sbom_loop():
+    """Generate and store the SBOMs of newly scanned digests, one at a time, off the scan workers"""
+    while True:
+        container_name, image_digest, timings = _sbom_queue.get()
+        try:
+            if get_sbom(image_digest) is not None:
+                continue
+            with phase_span('sbom', timings):
+                sbom = generate_sbom(container_name, image_digest, get_scan_server())
+            if sbom:
+                store_sbom(image_digest, container_name, sbom)
+        except Exception as e:
+            print(f"SBOM generation failed for {container_name}: {e}")
+        finally:
+            _sbom_queue.task_done()
+
+def _publish_job(job):
+    """Publish a job's current phase (caller holds the lock, which keeps a job's events in order)"""
+    event = {
+        'job_id': job['job_id'],
+        'batch_id': job['batch_id'],
+        'container_name': job['container_name'],
+        'status': job['status'],
+        'phase': job['phase']
+    }
+    if job['result']:
+        event['scan_id'] = job['result']['scan_id']
+    if job['error']:
+        event['error'] = job['error']
+    publish_event('scan', event)
+
+def _set_phase(job_id, phase, **fields):
+    """Update a job and publish its new phase, completing any jobs parked on it once it finishes"""
+    followers = []
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        job['phase'] = phase
+        _publish_job(job)
+        if phase in TERMINAL_PHASES:
+            if _active_by_name.get(job['container_name']) == job_id:
+                del _active_by_name[job['container_name']]
+            followers, job['followers'] = job['followers'], []
+            leader = dict(job)
+    if phase in TERMINAL_PHASES:
+        inc('scan_jobs_total', outcome=phase)
+    for follower_id in followers:
+        _complete_follower(follower_id, leader)
+        _finish_batch_job(follower_id)
+
+def _follow_job(job_id, leader_id):
+    """Park a job on the job already scanning the same image, to share its outcome
+    
+    A parked job holds no worker; the leader completes it when it reaches a
+    terminal phase. Returns False if the leader had already finished, in
+    which case the job is completed straight away.
+    """
+    _set_phase(job_id, PHASE_WAITING, coalesced_with=leader_id)
+    with _jobs_lock:
+        leader = _jobs.get(leader_id)
+        if leader is not None and leader['phase'] not in TERMINAL_PHASES:
+            leader['followers'].append(job_id)
+            return True
+        leader = dict(leader) if leader is not None else None
+    _complete_follower(job_id, leader)
+    return False
+
+def _complete_follower(job_id, leader):
+    """Finish a coalesced job with a snapshot of its leader (None if the leader was lost)"""
+    if leader is None or leader['status'] != JOB_DONE:
+        error = leader['error'] if leader is not None else 'Scan of the same image was lost'
+        _set_phase(job_id, PHASE_FAILED, status=JOB_FAILED, error=error,
+                   finished_at=datetime.now().isoformat())
+        return
+
+    response_data = dict(leader['result'])
+    response_data['coalesced'] = True
+    _set_phase(job_id, PHASE_COALESCED, status=JOB_DONE, result=response_data,
+               finished_at=datetime.now().isoformat())
+
+def _carry_over_secrets(scan_result, secret_results):
+    """Add the secrets found by the digest's last image scan to a scan of its SBOM"""
+    if 'findings' in scan_result:
+        scan_result['bench_results']['summary'].update(secret_results['summary'])
+        scan_result['findings'] = itertools.chain(
+            scan_result['findings'], (('secret', check) for check in secret_results['checks']))
+    else:
+        scan_result['bench_results'] = secret_results
+
+def _scan_and_save(job_id, container_name, image_digest, server_url, timings, on_phase,
+                   sbom_path=None, secret_results=None):
+    """Run Trivy for a job and save the results, returning (scan_id, scan_result)
+    
+    scan_id is None if the job failed, with the job already marked failed.
+    With sbom_path the stored SBOM is scanned instead of the image and
+    secret_results stand in for the secret scan.
+    """
+    if TRIVY_STREAMING:
+        # Findings go straight from Trivy's output into the database
+        scan_result = stream_trivy_combined_scan(container_name, image_digest, server_url, on_phase, sbom_path)
+    else:
+        scan_result = run_combined_scan(container_name, server_url, on_phase, sbom_path)
+
+    if not scan_result['success']:
+        _set_phase(job_id, PHASE_FAILED, status=JOB_FAILED, error=scan_result['error'],
+                   finished_at=datetime.now().isoformat())
+        return None, scan_result
+
+    if sbom_path:
+        scan_result['image_digest'] = image_digest
+        _carry_over_secrets(scan_result, secret_results)
+
+    save_start = time.perf_counter()
+    if TRIVY_STREAMING:
+        scan_id = save_scan_stream(scan_result)
+    else:
+        scan_id = save_scan_results(scan_result)
+    # Streamed findings are read from Trivy while they are saved, that time is already counted
+    record_phase('save', time.perf_counter() - save_start - scan_result.get('stream_seconds', 0), timings)
+    timings.update(scan_result.get('timings') or {})
+    print(f"Scan timings for {container_name}: "
+          + ', '.join(f'{phase}={seconds:.2f}s' for phase, seconds in timings.items()))
+
+    if not scan_id:
+        error = scan_result.get('error') or 'Failed to save scan results to database'
+        _set_phase(job_id, PHASE_FAILED, status=JOB_FAILED, error=error,
+                   finished_at=datetime.now().isoformat())
+        return None, scan_result
+
+    return scan_id, scan_result
+
+def _run_job(job_id):
+    """Run the scan for a job and save the results, returning True if the job was parked on another"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        container_name = job['container_name']
+        force = job['force']
+        image_digest = job['image_digest']
+
+    # Seconds per phase, filled in as the job runs and readable through get_job
+    timings = {}
+    _set_phase(job_id, PHASE_PULLING, status=JOB_RUNNING, started_at=datetime.now().isoformat(),
+               timings=timings)
+
+    def on_phase(phase):
+        _set_phase(job_id, phase)
+
+    flight_key = None
+    try:
+        # A rescan's stored SBOM is only valid while the tag still points at its digest
+        with phase_span('resolve_digest', timings):
+            resolved_digest = resolve_image_digest(container_name)
+        if image_digest and resolved_digest != image_digest:
+            print(f"{container_name} no longer resolves to {image_digest}, scanning the image")
+        image_digest = resolved_digest
+        
+        # One Trivy run per image at a time, later jobs for it share its scan_id
+        with _jobs_lock:
+            leader_id = _scans_in_flight.setdefault(image_digest or container_name, job_id)
+        if leader_id != job_id:
+            print(f"Joining scan job {leader_id} for the same image: {container_name}")
+            return _follow_job(job_id, leader_id)
+        flight_key = image_digest or container_name
+        
+        # Reuse the stored scan if this digest was already scanned with the current DB
+        if not force:
+            with phase_span('cache_lookup', timings):
+                db_version = get_trivy_db_version()
+                cached_result = lookup_cached_scan(container_name, image_digest, db_version)
+            # A scan of the same digest under another name is copied, so this name gets its own scan
+            if cached_result and cached_result['container_name'] != container_name:
+                with phase_span('save', timings):
+                    copied_scan_id = copy_scan(cached_result['scan_id'], container_name)
+                if copied_scan_id is None:
+                    cached_result = None
+                else:
+                    cached_result.update(scan_id=copied_scan_id, container_name=container_name)
+                    dashboard_delta = get_dashboard_delta(copied_scan_id)
+                    if dashboard_delta:
+                        publish_event('summary', dashboard_delta)
+            if cached_result:
+                print(f"Using cached scan {cached_result['scan_id']} for: {container_name}")
+                store_cached_scan(container_name, image_digest, db_version, cached_result['scan_id'])
+                response_data = build_scan_response(cached_result['scan_id'], cached_result)
+                response_data['cached'] = True
+                _set_phase(job_id, PHASE_CACHED, status=JOB_DONE, result=response_data,
+                           finished_at=datetime.now().isoformat())
+                return
+
+        server_url = get_scan_server()
+
+        # A digest scanned before only needs its stored SBOM checked against the current DB
+        sbom = get_sbom(image_digest) if TRIVY_SBOM else None
+        secret_results = get_digest_secret_results(image_digest) if sbom else None
+        if secret_results is not None:
+            print(f"Rescanning {container_name} from its stored SBOM")
+            with tempfile.NamedTemporaryFile(suffix='.cdx.json') as sbom_file:
+                sbom_file.write(sbom)
+                sbom_file.flush()
+                scan_id, scan_result = _scan_and_save(job_id, container_name, image_digest, server_url,
+                                                      timings, on_phase, sbom_file.name, secret_results)
+        else:
+            scan_id, scan_result = _scan_and_save(job_id, container_name, image_digest, server_url,
+                                                  timings, on_phase)
+        if scan_id is None:
+            return
+
+        store_cached_scan(container_name, scan_result.get('image_digest'), scan_result.get('db_version'), scan_id)
+
+        # One summary delta per saved scan, shared by every open dashboard
+        dashboard_delta = get_dashboard_delta(scan_id)
+        if dashboard_delta:
+            publish_event('summary', dashboard_delta)
+
+        response_data = build_scan_response(scan_id, scan_result)
+        response_data['cached'] = False
+        _set_phase(job_id, PHASE_SAVED, status=JOB_DONE, result=response_data,
+                   finished_at=datetime.now().isoformat())
+
+        # First scan of this digest: keep its SBOM for later rescans, generated in the background
+        image_digest = scan_result.get('image_digest')
+        if TRIVY_SBOM and image_digest and sbom is None:
+            try:
+                _sbom_queue.put_nowait((container_name, image_digest, timings))
+            except queue.Full:
+                print(f"SBOM queue is full, skipping the SBOM of {container_name}")
+
+    except Exception as e:
+        print(f"Scan job {job_id} failed: {e}")
+        _set_phase(job_id, PHASE_FAILED, status=JOB_FAILED, error=f'Unexpected error: {str(e)}',
+                   finished_at=datetime.now().isoformat())
+    finally:
+        if flight_key is not None:
+            with _jobs_lock:
+                del _scans_in_flight[flight_key]
+
+def _prune_jobs():
+    """Drop the oldest finished jobs and batches once the history limits are reached (caller holds the lock)"""
+    for batch_id in list(_batches.keys()):
+        if len(_batches) <= BATCH_HISTORY_LIMIT:
+            break
+        if _batch_finished(_batches[batch_id]):
+            del _batches[batch_id]
+
+    if len(_jobs) <= JOB_HISTORY_LIMIT:
+        return
+    for job_id in list(_jobs.keys()):
+        if len(_jobs) <= JOB_HISTORY_LIMIT:
+            break
+        job = _jobs[job_id]
+        # Jobs of a batch that is still running stay visible in its status
+        if job.get('batch_id') in _batches and not _batch_finished(_batches[job['batch_id']]):
+            continue
+        if job['status'] in (JOB_DONE, JOB_FAILED):
+            del _jobs[job_id]
+
+def _new_job(container_name, force, batch_id=None, image_digest=None):
+    return {
+        'job_id': uuid.uuid4().hex,
+        'container_name': container_name,
+        'force': bool(force),
+        'image_digest': image_digest,
+        'batch_id': batch_id,
+        'status': JOB_QUEUED,
+        'phase': PHASE_QUEUED,
+        'submitted_at': datetime.now().isoformat(),
+        'started_at': None,
+        'finished_at': None,
+        'result': None,
+        'error': None,
+        'timings': {},
+        # job_ids of jobs for the same image waiting on this one's outcome
+        'followers': []
+    }
+
+def submit_scan_job(container_name, force=False, image_digest=None):
+    """Queue a scan and return the new job, or None if the queue is full
+
+    force skips the scan cache and always runs Trivy. image_digest is the
+    digest whose stored SBOM a rescan expects to use; the job still resolves
+    container_name and scans the image if it has moved. While a scan of the same
+    container_name is unfinished, that job is returned (with coalesced set)
+    instead of queueing another.
+    """
+    _start_workers()
+
+    job = _new_job(container_name, force, image_digest=image_digest)
+
+    with _jobs_lock:
+        active_id = _active_by_name.get(container_name)
+        if active_id is not None:
+            active_job = _jobs[active_id]
+            # Not started yet, so it can still honor force
+            if force and active_job['status'] == JOB_QUEUED:
+                active_job['force'] = True
+            return dict(active_job, coalesced=True)
+
+        try:
+            _job_queue.put_nowait(job['job_id'])
+        except queue.Full:
+            return None
+
+        # A worker cannot start the job before the lock is released
+        _jobs[job['job_id']] = job
+        _active_by_name[container_name] = job['job_id']
+        _publish_job(job)
+        _prune_jobs()
+        return dict(job)
+
+def _batch_finished(batch):
+    return not batch['pending'] and batch['in_flight'] == 0
+
+def _dispatch_batches():
+    """Move waiting batch jobs onto the scan queue, up to each batch's parallel limit"""
+    with _jobs_lock:
+        for batch in _batches.values():
+            while batch['pending'] and batch['in_flight'] < batch['max_parallel']:
+                try:
+                    _job_queue.put_nowait(batch['pending'][0])
+                except queue.Full:
+                    # Retried when the next job finishes and frees a queue slot
+                    return
+                batch['pending'].popleft()
+                batch['in_flight'] += 1
+
+def _finish_batch_job(job_id):
+    """Free the batch slot held by a finished job and dispatch the next images"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        batch = _batches.get(job['batch_id']) if job and job.get('batch_id') else None
+        if batch is not None:
+            batch['in_flight'] -= 1
+    _dispatch_batches()
+
+def submit_scan_batch(container_names, force=False, max_parallel=None, image_digests=None):
+    """Queue scans for a list of images and return the new batch
+
+    At most max_parallel of the batch's images are on the scan queue or running
+    at once; the rest wait in the batch and are queued as earlier scans finish.
+    image_digests maps container names to the digest of their stored SBOM,
+    used only if the name still resolves to it.
+    """
+    _start_workers()
+
+    image_digests = image_digests or {}
+    batch_id = uuid.uuid4().hex
+    jobs = [_new_job(container_name, force, batch_id, image_digests.get(container_name))
+            for container_name in container_names]
+    batch = {
+        'batch_id': batch_id,
+        'job_ids': [job['job_id'] for job in jobs],
+        'pending': deque(job['job_id'] for job in jobs),
+        'in_flight': 0,
+        'max_parallel': max(1, max_parallel or SCAN_BATCH_PARALLEL),
+        'submitted_at': datetime.now().isoformat()
+    }
+
+    with _jobs_lock:
+        for job in jobs:
+            _jobs[job['job_id']] = job
+        _batches[batch_id] = batch
+        _prune_jobs()
+        for job in jobs:
+            _publish_job(job)
+
+    _dispatch_batches()
+    return get_batch(batch_id)
+
+def submit_rescan_batch(force=False, max_parallel=None):
+    """Queue a rescan of every known container's newest image and return the new batch, or None if there are none
+
+    Digests with a stored SBOM are rescanned from it against the current
+    vulnerability DB, unless the tag has moved to another digest since; the scan
+    cache still skips digests already scanned with it.
+    """
+    targets = get_rescan_targets()
+    if not targets:
+        return None
+    image_digests = {container_name: image_digest for container_name, image_digest in targets if image_digest}
+    return submit_scan_batch([container_name for container_name, _ in targets], force, max_parallel,
+                             image_digests)
+
+def get_batch(batch_id):
+    """Get a batch with the current state of each of its jobs, or None if unknown"""
+    with _jobs_lock:
+        batch = _batches.get(batch_id)
+        if batch is None:
+            return None
+
+        jobs = [dict(_jobs[job_id]) for job_id in batch['job_ids'] if job_id in _jobs]
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+        for job in jobs:
+            counts[job['status']] += 1
+
+        return {
+            'batch_id': batch_id,
+            'submitted_at': batch['submitted_at'],
+            'max_parallel': batch['max_parallel'],
+            'finished': _batch_finished(batch),
+            'counts': counts,
+            'jobs': jobs
+        }
+
+def get_job(job_id):
+    """Get a copy of a job's current state, or None if unknown"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+def get_active_container_names():
+    """Get the names of containers with a queued or running scan"""
+    with _jobs_lock:
+        return {job['container_name'] for job in _jobs.values() if job['status'] in (JOB_QUEUED, JOB_RUNNING)}
+
+def get_queue_stats():
+    """Get current queue depth and worker counts"""
+    with _jobs_lock:
+        running = sum(1 for job in _jobs.values() if job['status'] == JOB_RUNNING)
+    return {
+        'queued': _job_queue.qsize(),
+        'running': running,
+        'workers': max(1, SCAN_WORKERS),
+        'queue_limit': SCAN_QUEUE_SIZE
+    }
@@ -0,0 +1,114 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets in seconds
+PHASE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+DB_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'trivy_scan_phase_seconds': ('histogram', 'Time spent in each scan phase', PHASE_BUCKETS),
+    'db_operation_seconds': ('histogram', 'Latency of SQLite operations', DB_BUCKETS),
+    'scan_findings_total': ('counter', 'Findings read from Trivy reports', None),
+    'trivy_output_bytes_total': ('counter', 'Bytes of Trivy report output read', None),
+    'scan_jobs_total': ('counter', 'Finished scan jobs by outcome', None),
+    'scheduled_rescans_total': ('counter', 'Rescans queued by the rescan scheduler', None),
+    'db_write_transactions_total': ('counter', 'Transactions committed by the database writer thread', None),
+    'db_write_requests_total': ('counter', 'Write requests run by the database writer thread', None),
+}
+
+# (name, sorted label items) -> value for counters, [bucket counts..., sum, count] for histograms
+_values = {}
+_values_lock = threading.Lock()
+
+def inc(name, value=1, **labels):
+    """Add value to a counter"""
+    key = (name, tuple(sorted(labels.items())))
+    with _values_lock:
+        _values[key] = _values.get(key, 0) + value
+
+def observe(name, value, **labels):
+    """Record one histogram observation"""
+    buckets = METRICS[name][2]
+    key = (name, tuple(sorted(labels.items())))
+    with _values_lock:
+        series = _values.get(key)
+        if series is None:
+            series = _values[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+@contextmanager
+def phase_span(phase, timings=None):
+    """Time a scan phase into trivy_scan_phase_seconds, and into timings[phase] when given"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start, timings)
+
+def record_phase(phase, seconds, timings=None):
+    observe('trivy_scan_phase_seconds', seconds, phase=phase)
+    if timings is not None:
+        timings[phase] = round(timings.get(phase, 0) + seconds, 4)
+
+def timed_db(operation):
+    """Decorator recording a database function's latency in db_operation_seconds"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe('db_operation_seconds', time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_metrics(gauges=None):
+    """Render every metric in the Prometheus text exposition format
+
+    gauges maps extra gauge names to (help, value), for values read at scrape time.
+    """
+    with _values_lock:
+        snapshot = {key: list(value) if isinstance(value, list) else value for key, value in _values.items()}
+
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for (series_name, labels), value in sorted(snapshot.items()):
+            if series_name != name:
+                continue
+            if metric_type == 'counter':
+                lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+                continue
+            for bound, count in zip(buckets + (float('inf'),), value[:-2] + [value[-1]]):
+                bucket_labels = labels + (('le', _format_number(bound)),)
+                lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(value[-2])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+
+    for name, (help_text, value) in (gauges or {}).items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {_format_number(value)}')
+
+    return '\n'.join(lines) + '\n'
@@ -1,103 +1,1373 @@
+import base64
+import json
+import os
+import pickle
+import queue
 import sqlite3
-from datetime import datetime
+import tempfile
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from metrics import inc, timed_db
 
 DATABASE_PATH = 'security_dashboard.db'
 
-def get_db_connection():
-    """Get database connection with row factory"""
-    conn = sqlite3.connect(DATABASE_PATH)
+# SQLite page cache per connection, in KiB (negative values are KiB in PRAGMA cache_size)
+DB_CACHE_SIZE_KB = 20000
+
+# Prepared statements kept per connection so repeated queries skip re-parsing
+DB_STATEMENT_CACHE = 256
+
+# Rows per executemany call when inserting findings
+INSERT_BATCH_SIZE = 1000
+
+# Memory for a streamed scan's findings before they are spooled to a temp file, in bytes
+STREAM_SPOOL_BYTES = 8 * 1024 * 1024
+
+# Scans, their findings and their secrets. A new database gets them in their
+# current shape; older databases are brought up to it by MIGRATION_STEPS.
+CORE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        container_name TEXT NOT NULL,
+        scan_date TEXT NOT NULL,
+        total_critical INTEGER DEFAULT 0,
+        total_high INTEGER DEFAULT 0,
+        total_medium INTEGER DEFAULT 0,
+        total_low INTEGER DEFAULT 0,
+        total_negligible INTEGER DEFAULT 0,
+        scan_status TEXT DEFAULT 'completed',
+        image_digest TEXT,
+        db_version TEXT,
+        reprocessed_at TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS cve_catalog (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cve_id TEXT NOT NULL UNIQUE,
+        title TEXT,
+        description TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS vulnerabilities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scan_id INTEGER NOT NULL,
+        catalog_id INTEGER NOT NULL,
+        severity TEXT,
+        package_name TEXT,
+        installed_version TEXT,
+        fixed_version TEXT,
+        FOREIGN KEY (scan_id) REFERENCES scans (id) ON DELETE CASCADE,
+        FOREIGN KEY (catalog_id) REFERENCES cve_catalog (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS bench_scans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scan_id INTEGER NOT NULL,
+        total_checks INTEGER DEFAULT 0,
+        pass_count INTEGER DEFAULT 0,
+        warn_count INTEGER DEFAULT 0,
+        fail_count INTEGER DEFAULT 0,
+        info_count INTEGER DEFAULT 0,
+        note_count INTEGER DEFAULT 0,
+        score INTEGER DEFAULT 0,
+        FOREIGN KEY (scan_id) REFERENCES scans (id) ON DELETE CASCADE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS bench_checks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bench_scan_id INTEGER NOT NULL,
+        check_id TEXT,
+        status TEXT,
+        title TEXT,
+        description TEXT,
+        FOREIGN KEY (bench_scan_id) REFERENCES bench_scans (id) ON DELETE CASCADE
+    )
+    '''
+]
+
+CORE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_scans_date ON scans(scan_date)',
+    'CREATE INDEX IF NOT EXISTS idx_vulns_severity ON vulnerabilities(severity)',
+    'CREATE INDEX IF NOT EXISTS idx_vulns_catalog_id ON vulnerabilities(catalog_id)',
+    'CREATE INDEX IF NOT EXISTS idx_bench_scans_scan_id ON bench_scans(scan_id)',
+    'CREATE INDEX IF NOT EXISTS idx_bench_checks_bench_scan_id ON bench_checks(bench_scan_id)'
+]
+
+# CVE text is stored once in cve_catalog and shared by every scan that reports it
+CVE_CATALOG_INSERT_SQL = '''
+    INSERT OR IGNORE INTO cve_catalog (cve_id, title, description)
+    VALUES (?, ?, ?)
+'''
+
+# Reprocessed reports replace the catalog text, in case its extraction changed
+CVE_CATALOG_UPSERT_SQL = '''
+    INSERT INTO cve_catalog (cve_id, title, description)
+    VALUES (?, ?, ?)
+    ON CONFLICT (cve_id) DO UPDATE SET title = excluded.title, description = excluded.description
+    WHERE title IS NOT excluded.title OR description IS NOT excluded.description
+'''
+
+VULNERABILITY_INSERT_SQL = '''
+    INSERT INTO vulnerabilities (scan_id, catalog_id, severity, package_name,
+                               installed_version, fixed_version)
+    VALUES (?, (SELECT id FROM cve_catalog WHERE cve_id = ?), ?, ?, ?, ?)
+'''
+
+# Vulnerability rows joined back to their catalog text, in the original column order
+VULNERABILITY_SELECT_SQL = '''
+    SELECT v.id, v.scan_id, c.cve_id, v.severity, v.package_name,
+           v.installed_version, v.fixed_version, c.title, c.description
+    FROM vulnerabilities v
+    JOIN cve_catalog c ON c.id = v.catalog_id
+'''
+
+BENCH_CHECK_INSERT_SQL = '''
+    INSERT INTO bench_checks (bench_scan_id, check_id, status, title, description)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+# Inverted index from CVE to the latest scan of every container that reports it
+CVE_EXPOSURE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS cve_exposure (
+        catalog_id INTEGER NOT NULL,
+        container_name TEXT NOT NULL,
+        scan_id INTEGER NOT NULL,
+        PRIMARY KEY (catalog_id, container_name)
+    ) WITHOUT ROWID
+'''
+
+# Distinct package names of all findings, the package side of the search index
+PACKAGE_NAME_INSERT_SQL = 'INSERT OR IGNORE INTO package_names (name) VALUES (?)'
+
+# Full-text search indexes, kept current by triggers. They index the deduplicated
+# CVE catalog and package names instead of every finding row, so ingest speed is
+# unaffected; secrets are few enough to index row by row.
+SEARCH_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS package_names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)',
+    """CREATE VIRTUAL TABLE IF NOT EXISTS cve_catalog_fts USING fts5(
+        cve_id, title, description, content='cve_catalog', content_rowid='id')""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS package_names_fts USING fts5(
+        name, content='package_names', content_rowid='id')""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS bench_checks_fts USING fts5(
+        title, description, content='bench_checks', content_rowid='id')""",
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_cve_catalog_fts_insert AFTER INSERT ON cve_catalog
+    BEGIN
+        INSERT INTO cve_catalog_fts (rowid, cve_id, title, description)
+        VALUES (NEW.id, NEW.cve_id, NEW.title, NEW.description);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_cve_catalog_fts_delete AFTER DELETE ON cve_catalog
+    BEGIN
+        INSERT INTO cve_catalog_fts (cve_catalog_fts, rowid, cve_id, title, description)
+        VALUES ('delete', OLD.id, OLD.cve_id, OLD.title, OLD.description);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_package_names_fts_insert AFTER INSERT ON package_names
+    BEGIN
+        INSERT INTO package_names_fts (rowid, name) VALUES (NEW.id, NEW.name);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_package_names_fts_delete AFTER DELETE ON package_names
+    BEGIN
+        INSERT INTO package_names_fts (package_names_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_bench_checks_fts_insert AFTER INSERT ON bench_checks
+    BEGIN
+        INSERT INTO bench_checks_fts (rowid, title, description)
+        VALUES (NEW.id, NEW.title, NEW.description);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_bench_checks_fts_delete AFTER DELETE ON bench_checks
+    BEGIN
+        INSERT INTO bench_checks_fts (bench_checks_fts, rowid, title, description)
+        VALUES ('delete', OLD.id, OLD.title, OLD.description);
+    END
+    '''
+]
+
+# CycloneDX SBOM of every scanned image digest, zlib-compressed, so later
+# rescans can run `trivy sbom` instead of pulling and unpacking the image again
+SBOM_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sboms (
+        image_digest TEXT PRIMARY KEY,
+        container_name TEXT NOT NULL,
+        sbom BLOB NOT NULL,
+        raw_size INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    )
+'''
+
+# Keeps the CVE search index in step when reprocessing rewrites catalog text
+CVE_CATALOG_FTS_UPDATE_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS trg_cve_catalog_fts_update AFTER UPDATE ON cve_catalog
+    BEGIN
+        INSERT INTO cve_catalog_fts (cve_catalog_fts, rowid, cve_id, title, description)
+        VALUES ('delete', OLD.id, OLD.cve_id, OLD.title, OLD.description);
+        INSERT INTO cve_catalog_fts (rowid, cve_id, title, description)
+        VALUES (NEW.id, NEW.cve_id, NEW.title, NEW.description);
+    END
+'''
+
+# Reprocessing rewrites CVE text shared by every scan that reports the CVE, so
+# each rewrite bumps a revision that saved scans' cached responses depend on
+CATALOG_REVISION_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS trg_cve_catalog_revision AFTER UPDATE ON cve_catalog
+    BEGIN
+        UPDATE dashboard_stats SET catalog_revision = catalog_revision + 1 WHERE id = 1;
+    END
+'''
+
+# Trivy output of every scan, compressed by the scanner, so findings can be
+# extracted again (new fields, other truncation) without running Trivy
+REPORT_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS scan_reports (
+        scan_id INTEGER PRIMARY KEY,
+        format TEXT NOT NULL,
+        source TEXT NOT NULL,
+        report BLOB NOT NULL,
+        raw_size INTEGER NOT NULL,
+        FOREIGN KEY (scan_id) REFERENCES scans (id) ON DELETE CASCADE
+    )
+'''
+
+# Per container per day severity counts for trend charts, taken from that day's
+# newest scan and kept current by triggers on every write and delete, so a year
+# of history is at most 365 rows per container
+TRENDS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS scan_trends (
+        container_name TEXT NOT NULL,
+        day TEXT NOT NULL,
+        scan_id INTEGER NOT NULL,
+        scan_date TEXT NOT NULL,
+        critical INTEGER NOT NULL DEFAULT 0,
+        high INTEGER NOT NULL DEFAULT 0,
+        medium INTEGER NOT NULL DEFAULT 0,
+        low INTEGER NOT NULL DEFAULT 0,
+        secrets INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (container_name, day)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_scan_trends_scan_id ON scan_trends(scan_id)',
+    'CREATE INDEX IF NOT EXISTS idx_scan_trends_day ON scan_trends(day)',
+    # A scan replaces its day's row unless a newer scan of that day is already there
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_scans_trends_insert AFTER INSERT ON scans
+    BEGIN
+        INSERT INTO scan_trends (container_name, day, scan_id, scan_date, critical, high, medium, low)
+        VALUES (NEW.container_name, substr(NEW.scan_date, 1, 10), NEW.id, NEW.scan_date,
+                COALESCE(NEW.total_critical, 0), COALESCE(NEW.total_high, 0),
+                COALESCE(NEW.total_medium, 0), COALESCE(NEW.total_low, 0))
+        ON CONFLICT (container_name, day) DO UPDATE SET
+            scan_id = excluded.scan_id,
+            scan_date = excluded.scan_date,
+            critical = excluded.critical,
+            high = excluded.high,
+            medium = excluded.medium,
+            low = excluded.low,
+            secrets = 0
+        WHERE excluded.scan_date >= scan_trends.scan_date;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_scans_trends_update AFTER UPDATE ON scans
+    BEGIN
+        UPDATE scan_trends SET
+            critical = COALESCE(NEW.total_critical, 0),
+            high = COALESCE(NEW.total_high, 0),
+            medium = COALESCE(NEW.total_medium, 0),
+            low = COALESCE(NEW.total_low, 0)
+        WHERE scan_id = NEW.id;
+    END
+    ''',
+    # Deleting a day's newest scan falls back to the next newest scan of that day, if any
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_scans_trends_delete AFTER DELETE ON scans
+    WHEN EXISTS (SELECT 1 FROM scan_trends WHERE scan_id = OLD.id)
+    BEGIN
+        DELETE FROM scan_trends WHERE scan_id = OLD.id;
+        INSERT INTO scan_trends (container_name, day, scan_id, scan_date, critical, high, medium, low, secrets)
+        SELECT s.container_name, substr(s.scan_date, 1, 10), s.id, s.scan_date,
+               COALESCE(s.total_critical, 0), COALESCE(s.total_high, 0),
+               COALESCE(s.total_medium, 0), COALESCE(s.total_low, 0),
+               COALESCE((SELECT b.total_checks FROM bench_scans b WHERE b.scan_id = s.id), 0)
+        FROM scans s
+        WHERE s.container_name = OLD.container_name
+        AND s.scan_date >= substr(OLD.scan_date, 1, 10)
+        AND s.scan_date < date(substr(OLD.scan_date, 1, 10), '+1 day')
+        ORDER BY s.scan_date DESC, s.id DESC
+        LIMIT 1;
+    END
+    ''',
+    # Secrets are saved just after their scan row
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_bench_scans_trends_insert AFTER INSERT ON bench_scans
+    BEGIN
+        UPDATE scan_trends SET secrets = COALESCE(NEW.total_checks, 0) WHERE scan_id = NEW.scan_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_bench_scans_trends_update AFTER UPDATE ON bench_scans
+    BEGIN
+        UPDATE scan_trends SET secrets = COALESCE(NEW.total_checks, 0) WHERE scan_id = NEW.scan_id;
+    END
+    '''
+]
+
+# Days of history /api/trends returns when no since date is given
+TRENDS_DEFAULT_DAYS = 90
+
+# zlib level for stored SBOMs (SBOM JSON compresses roughly 10:1)
+SBOM_COMPRESSION_LEVEL = 6
+
+# Idle connections kept for reuse in each process
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_pool_pid = os.getpid()
+_pool_lock = threading.Lock()
+
+def _open_db_connection():
+    """Open a new connection with the PRAGMAs applied"""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30, cached_statements=DB_STATEMENT_CACHE,
+                           check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    
+    # WAL lets dashboard reads continue while a scan is being written;
+    # NORMAL sync is safe under WAL and avoids an fsync per commit
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    # SQLite leaves foreign keys off by default, which silently disables ON DELETE CASCADE
+    conn.execute('PRAGMA foreign_keys = ON')
     return conn
 
+def _check_pool_owner():
+    """Drop pooled connections inherited from a parent process after a fork"""
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+                _pool_pid = os.getpid()
+
+# Single-row running totals for the dashboard, kept current by triggers on every
+# write path. generation changes whenever the dashboard data may have changed.
+DASHBOARD_STATS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS dashboard_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_scans INTEGER NOT NULL DEFAULT 0,
+        scans_with_issues INTEGER NOT NULL DEFAULT 0,
+        generation INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_scans_stats_insert AFTER INSERT ON scans
+    BEGIN
+        UPDATE dashboard_stats SET
+            total_scans = total_scans + 1,
+            scans_with_issues = scans_with_issues + (NEW.total_critical > 0 OR NEW.total_high > 0),
+            generation = generation + 1
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_scans_stats_update AFTER UPDATE ON scans
+    BEGIN
+        UPDATE dashboard_stats SET
+            scans_with_issues = scans_with_issues
+                - (OLD.total_critical > 0 OR OLD.total_high > 0)
+                + (NEW.total_critical > 0 OR NEW.total_high > 0),
+            generation = generation + 1
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_scans_stats_delete AFTER DELETE ON scans
+    BEGIN
+        UPDATE dashboard_stats SET
+            total_scans = total_scans - 1,
+            scans_with_issues = scans_with_issues - (OLD.total_critical > 0 OR OLD.total_high > 0),
+            generation = generation + 1
+        WHERE id = 1;
+    END
+    ''',
+    # Secret counts are shown next to each recent scan
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_bench_scans_stats_insert AFTER INSERT ON bench_scans
+    BEGIN
+        UPDATE dashboard_stats SET generation = generation + 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_bench_scans_stats_update AFTER UPDATE ON bench_scans
+    BEGIN
+        UPDATE dashboard_stats SET generation = generation + 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_bench_scans_stats_delete AFTER DELETE ON bench_scans
+    BEGIN
+        UPDATE dashboard_stats SET generation = generation + 1 WHERE id = 1;
+    END
+    '''
+]
+
+# Number of most recent scans shown on the dashboard
+DASHBOARD_RECENT_LIMIT = 20
+
+_summary_cache = {'generation': None, 'summary': None}
+_summary_cache_lock = threading.Lock()
+
+def get_db_connection():
+    """Get database connection with row factory
+    
+    Connections come from a per-process pool so the page cache and prepared
+    statements stay warm between requests. Hand them back with
+    release_db_connection() instead of closing them.
+    """
+    _check_pool_owner()
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _open_db_connection()
+
+def release_db_connection(conn):
+    """Return a connection to the pool, closing it if the pool is full"""
+    _check_pool_owner()
+    try:
+        # Never hand an open transaction to the next caller
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.close()
+
+# Most write requests committed together in one transaction by the writer thread
+DB_WRITE_GROUP_SIZE = int(os.environ.get('DB_WRITE_GROUP_SIZE', '16'))
+
+# Write requests allowed to wait for the writer before callers block
+DB_WRITE_QUEUE_SIZE = 256
+
+# Seconds a caller waits for its write to be committed before giving up
+DB_WRITE_TIMEOUT = int(os.environ.get('DB_WRITE_TIMEOUT', '300'))
+
+class _WriteRequest:
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+        self.abandoned = False
+        self.result = None
+        self.error = None
+
+_write_queue = queue.Queue(maxsize=DB_WRITE_QUEUE_SIZE)
+_writer = {'pid': None, 'thread': None}
+_writer_lock = threading.Lock()
+
+def _run_write_group(conn, requests):
+    """Run a group of write requests in one transaction
+    
+    A savepoint per request slows down every insert, so the group runs
+    without one. If a request raises, the whole transaction is rolled back and
+    the group runs again without that request, so its changes are undone
+    without affecting the rest of its group.
+    """
+    pending = list(requests)
+    while pending:
+        failed = None
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for request in pending:
+                failed = request
+                request.result = request.func(conn.cursor(), *request.args)
+            failed = None
+            conn.execute('COMMIT')
+            pending = []
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            if failed is None:
+                # BEGIN or COMMIT failed, so nothing in the group was written
+                for request in pending:
+                    request.result = None
+                    request.error = e
+                pending = []
+            else:
+                failed.result = None
+                failed.error = e
+                pending.remove(failed)
+        inc('db_write_transactions_total')
+    inc('db_write_requests_total', len(requests))
+
+def _writer_loop(write_queue, conn):
+    while True:
+        requests = [write_queue.get()]
+        # Group commit: whatever queued up during the last commit goes in this transaction
+        while len(requests) < max(1, DB_WRITE_GROUP_SIZE):
+            try:
+                requests.append(write_queue.get_nowait())
+            except queue.Empty:
+                break
+        # Callers that timed out have already been told their write failed
+        live = [request for request in requests if not request.abandoned]
+        try:
+            if live:
+                _run_write_group(conn, live)
+        except Exception as e:
+            for request in live:
+                request.error = request.error or e
+        finally:
+            for request in requests:
+                request.done.set()
+
+def _start_writer():
+    """Start this process's writer thread on first use (again in a forked child or if it died)
+    
+    The writer's connection is opened here, so a database that cannot be
+    opened fails the caller instead of leaving a writer that never answers.
+    """
+    global _write_queue
+    if _writer['pid'] == os.getpid() and _writer['thread'].is_alive():
+        return
+    with _writer_lock:
+        if _writer['pid'] == os.getpid() and _writer['thread'].is_alive():
+            return
+        conn = _open_db_connection()
+        # Transactions are managed explicitly so a group can share one commit
+        conn.isolation_level = None
+        _write_queue = queue.Queue(maxsize=DB_WRITE_QUEUE_SIZE)
+        thread = threading.Thread(target=_writer_loop, args=(_write_queue, conn), name='db-writer', daemon=True)
+        thread.start()
+        _writer['thread'] = thread
+        _writer['pid'] = os.getpid()
+
+def run_write(func, *args):
+    """Run func(cursor, *args) on the single writer thread and return its result once committed
+    
+    Every write goes through one connection, so concurrent saves queue up
+    instead of fighting over the SQLite write lock, and requests that arrive
+    together share a transaction. func must not commit and may be run more
+    than once, since a failing request makes the rest of its group run again.
+    If func raises, its changes are rolled back and the exception is raised
+    here. TimeoutError is raised if the writer has not answered within
+    DB_WRITE_TIMEOUT seconds. Reads keep using pooled connections.
+    """
+    _start_writer()
+    request = _WriteRequest(func, args)
+    try:
+        _write_queue.put(request, timeout=DB_WRITE_TIMEOUT)
+    except queue.Full:
+        raise TimeoutError(f'Database writer queue stayed full for {DB_WRITE_TIMEOUT}s')
+    if not request.done.wait(DB_WRITE_TIMEOUT):
+        # Skipped if the writer has not started it yet; one already running still commits
+        request.abandoned = True
+        raise TimeoutError(f'Database writer did not answer within {DB_WRITE_TIMEOUT}s')
+    if request.error is not None:
+        raise request.error
+    return request.result
+
+# PRAGMA auto_vacuum value for INCREMENTAL mode
+AUTO_VACUUM_INCREMENTAL = 2
+
+def enable_wal(conn):
+    """Switch a database to WAL journaling (persists in the database file)"""
+    mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+    return mode.lower() == 'wal'
+
+def migrate_database():
+    """Bring an existing database up to the current schema (safe to run repeatedly)
+    
+    Each step in MIGRATION_STEPS commits on its own together with the
+    user_version that records it, so an interrupted migration leaves no
+    half-built table behind and resumes at the first step not yet applied.
+    """
+    # Table rebuilds below must not fire cascades, so use a private connection
+    conn = _open_db_connection()
+    conn.isolation_level = None
+    conn.execute('PRAGMA foreign_keys = OFF')
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+        for number, step in enumerate(MIGRATION_STEPS, 1):
+            if number <= version:
+                continue
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                step(cursor)
+                cursor.execute(f'PRAGMA user_version = {number}')
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+        
+        # Databases created before WAL was the default
+        enable_wal(conn)
+        
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            print("Database file cannot shrink after purges. Run 'python retention.py --enable-incremental-vacuum' once to fix.")
+        return True
+    except Exception as e:
+        print(f"Database migration error: {e}")
+        return False
+    finally:
+        conn.close()
+
+def _migrate_scans(cursor):
+    """Create the core tables and add the scan cache and reprocessing columns"""
+    for statement in CORE_SCHEMA:
+        cursor.execute(statement)
+    
+    cursor.execute('PRAGMA table_info(scans)')
+    scan_columns = [row['name'] for row in cursor.fetchall()]
+    
+    # Image digest and Trivy DB version used as the scan cache key
+    if 'image_digest' not in scan_columns:
+        cursor.execute('ALTER TABLE scans ADD COLUMN image_digest TEXT')
+    if 'db_version' not in scan_columns:
+        cursor.execute('ALTER TABLE scans ADD COLUMN db_version TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_digest ON scans(image_digest, db_version)')
+    
+    # When a scan's findings were last rebuilt from its archived report
+    if 'reprocessed_at' not in scan_columns:
+        cursor.execute('ALTER TABLE scans ADD COLUMN reprocessed_at TEXT')
+
+def _migrate_vulnerabilities(cursor):
+    """Move per-scan CVE title/description copies into the shared catalog"""
+    cursor.execute('PRAGMA table_info(vulnerabilities)')
+    vuln_columns = [row['name'] for row in cursor.fetchall()]
+    if 'catalog_id' not in vuln_columns:
+        _migrate_cve_catalog(cursor)
+
+def _migrate_indexes(cursor):
+    """Composite indexes for the paginated listings (they cover the old single-column ones)"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_container_date ON scans(container_name, scan_date)')
+    cursor.execute('DROP INDEX IF EXISTS idx_scans_container')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vulns_scan_severity ON vulnerabilities(scan_id, severity)')
+    cursor.execute('DROP INDEX IF EXISTS idx_vulns_scan_id')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vulns_scan_finding ON vulnerabilities(scan_id, catalog_id, package_name)')
+    for statement in CORE_INDEXES:
+        cursor.execute(statement)
+
+def _migrate_cve_exposure(cursor):
+    """CVE to affected containers lookup, seeded from each container's latest scan"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cve_exposure'")
+    if not cursor.fetchone():
+        cursor.execute(CVE_EXPOSURE_SCHEMA)
+        cursor.execute('''
+            INSERT OR IGNORE INTO cve_exposure (catalog_id, container_name, scan_id)
+            SELECT v.catalog_id, s.container_name, s.id
+            FROM scans s
+            JOIN vulnerabilities v ON v.scan_id = s.id
+            WHERE s.id = (
+                SELECT s2.id FROM scans s2
+                WHERE s2.container_name = s.container_name
+                ORDER BY s2.scan_date DESC, s2.id DESC
+                LIMIT 1
+            )
+        ''')
+
+def _migrate_scan_trends(cursor):
+    """Daily severity rollup for trends, seeded with each day's newest scan"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scan_trends'")
+    if not cursor.fetchone():
+        for statement in TRENDS_SCHEMA:
+            cursor.execute(statement)
+        cursor.execute('''
+            INSERT INTO scan_trends (container_name, day, scan_id, scan_date, critical, high, medium, low, secrets)
+            SELECT s.container_name, s.day, s.id, s.scan_date,
+                   COALESCE(s.total_critical, 0), COALESCE(s.total_high, 0),
+                   COALESCE(s.total_medium, 0), COALESCE(s.total_low, 0),
+                   COALESCE((SELECT b.total_checks FROM bench_scans b WHERE b.scan_id = s.id), 0)
+            FROM (
+                SELECT container_name, substr(scan_date, 1, 10) AS day, id, scan_date,
+                       total_critical, total_high, total_medium, total_low, MAX(scan_date)
+                FROM scans
+                GROUP BY container_name, day
+            ) s
+        ''')
+
+def _migrate_search(cursor):
+    """Full-text search indexes, built from the existing findings"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cve_catalog_fts'")
+    if not cursor.fetchone():
+        print("Building the full-text search index...")
+        for statement in SEARCH_SCHEMA:
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO cve_catalog_fts (cve_catalog_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO bench_checks_fts (bench_checks_fts) VALUES ('rebuild')")
+        cursor.execute('''
+            INSERT OR IGNORE INTO package_names (name)
+            SELECT DISTINCT package_name FROM vulnerabilities WHERE package_name IS NOT NULL
+        ''')
+
+def _migrate_archives(cursor):
+    """Stored SBOMs for rescans and archived Trivy reports for reprocessing"""
+    cursor.execute(SBOM_SCHEMA)
+    cursor.execute(REPORT_SCHEMA)
+    cursor.execute(CVE_CATALOG_FTS_UPDATE_TRIGGER)
+
+def _migrate_catalog_revision(cursor):
+    """Counter of CVE catalog text rewrites, part of every saved scan's ETag"""
+    cursor.execute('PRAGMA table_info(dashboard_stats)')
+    stats_columns = [row['name'] for row in cursor.fetchall()]
+    if 'catalog_revision' not in stats_columns:
+        cursor.execute('ALTER TABLE dashboard_stats ADD COLUMN catalog_revision INTEGER NOT NULL DEFAULT 0')
+    cursor.execute(CATALOG_REVISION_TRIGGER)
+
+def _migrate_cve_exposure_index(cursor):
+    """Index for replacing one container's exposure rows without a full table scan"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cve_exposure_container ON cve_exposure(container_name, catalog_id)')
+
+def _migrate_dashboard_stats(cursor):
+    """Running dashboard totals, seeded from the existing scans"""
+    for statement in DASHBOARD_STATS_SCHEMA:
+        cursor.execute(statement)
+    cursor.execute('''
+        INSERT OR IGNORE INTO dashboard_stats (id, total_scans, scans_with_issues)
+        SELECT 1, COUNT(*), COALESCE(SUM(total_critical > 0 OR total_high > 0), 0) FROM scans
+    ''')
+
+# Schema changes in order; PRAGMA user_version is the number of steps applied.
+# Append new steps at the end, since applied ones are never run again.
+MIGRATION_STEPS = [
+    _migrate_scans,
+    _migrate_vulnerabilities,
+    _migrate_indexes,
+    _migrate_cve_exposure,
+    _migrate_scan_trends,
+    _migrate_search,
+    _migrate_archives,
+    _migrate_dashboard_stats,
+    _migrate_cve_exposure_index,
+    _migrate_catalog_revision
+]
+
+def _migrate_cve_catalog(cursor):
+    """Rebuild the vulnerabilities table on top of cve_catalog (inside the caller's transaction)"""
+    print("Migrating vulnerabilities to the shared CVE catalog...")
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cve_catalog (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cve_id TEXT NOT NULL UNIQUE,
+            title TEXT,
+            description TEXT
+        )
+    ''')
+    
+    # Keep the text from the most recent finding of each CVE
+    cursor.execute('''
+        INSERT OR IGNORE INTO cve_catalog (cve_id, title, description)
+        SELECT COALESCE(cve_id, 'N/A'), title, description FROM vulnerabilities
+        ORDER BY id DESC
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE vulnerabilities_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scan_id INTEGER NOT NULL,
+            catalog_id INTEGER NOT NULL,
+            severity TEXT,
+            package_name TEXT,
+            installed_version TEXT,
+            fixed_version TEXT,
+            FOREIGN KEY (scan_id) REFERENCES scans (id) ON DELETE CASCADE,
+            FOREIGN KEY (catalog_id) REFERENCES cve_catalog (id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO vulnerabilities_new (id, scan_id, catalog_id, severity, package_name,
+                                         installed_version, fixed_version)
+        SELECT v.id, v.scan_id, c.id, v.severity, v.package_name, v.installed_version, v.fixed_version
+        FROM vulnerabilities v
+        JOIN cve_catalog c ON c.cve_id = COALESCE(v.cve_id, 'N/A')
+    ''')
+    cursor.execute('DROP TABLE vulnerabilities')
+    cursor.execute('ALTER TABLE vulnerabilities_new RENAME TO vulnerabilities')
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vulns_scan_severity ON vulnerabilities(scan_id, severity)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vulns_severity ON vulnerabilities(severity)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vulns_catalog_id ON vulnerabilities(catalog_id)')
+    
+    print("CVE catalog migration done. Run VACUUM to return the freed space to the filesystem.")
+
+@timed_db('save_scan_results')
 def save_scan_results(scan_result):
     """Save scan results to database (Trivy + Docker Bench)"""
     if not scan_result['success']:
         return False
     
+    try:
+        return run_write(_write_scan_results, scan_result)
+    except Exception as e:
+        print(f"Database error: {e}")
+        return False
+
+def _write_scan_results(cursor, scan_result):
+    # Insert scan summary
+    cursor.execute('''
+        INSERT INTO scans (container_name, scan_date, total_critical, total_high, 
+                         total_medium, total_low, total_negligible, scan_status,
+                         image_digest, db_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        scan_result['container_name'],
+        scan_result['scan_date'],
+        scan_result['vulnerability_counts']['critical'],
+        scan_result['vulnerability_counts']['high'],
+        scan_result['vulnerability_counts']['medium'],
+        scan_result['vulnerability_counts']['low'],
+        scan_result['vulnerability_counts']['negligible'],
+        'completed',
+        scan_result.get('image_digest'),
+        scan_result.get('db_version')
+    ))
+    
+    scan_id = cursor.lastrowid
+    
+    # Insert individual vulnerabilities in batches
+    seen = (set(), set())
+    for batch in _batched(scan_result['vulnerabilities']):
+        _insert_vulnerability_batch(cursor, scan_id, batch, seen)
+    
+    # Insert Docker Bench results if available
+    if 'bench_results' in scan_result and scan_result['bench_results']:
+        bench_data = scan_result['bench_results']
+        _insert_bench_scan(cursor, scan_id, bench_data['summary'])
+        bench_scan_id = cursor.lastrowid
+        
+        # Insert individual bench checks in batches
+        for batch in _batched(bench_data['checks']):
+            _insert_bench_check_batch(cursor, bench_scan_id, batch)
+    
+    if scan_result.get('report'):
+        _insert_scan_report(cursor, scan_id, scan_result['report'])
+    
+    _refresh_cve_exposure(cursor, scan_result['container_name'])
+    
+    return scan_id
+
+@timed_db('save_scan_stream')
+def save_scan_stream(scan_stream):
+    """Save a streamed scan, inserting findings in batches as Trivy produces them
+    
+    Findings are spooled in batches while Trivy runs, then written with the
+    scan row in one write request, so the writer thread is never held up
+    waiting on Trivy. On failure the error is stored in scan_stream['error']
+    and False is returned.
+    """
+    if not scan_stream['success']:
+        return False
+    
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_BYTES) as spool:
+            batch_count = _spool_findings(scan_stream['findings'], spool)
+            return run_write(_write_scan_stream, scan_stream, spool, batch_count)
+        
+    except Exception as e:
+        print(f"Error saving streamed scan: {e}")
+        scan_stream['error'] = str(e)
+        return False
+
+def _spool_findings(findings, spool):
+    """Pickle (kind, records) batches of streamed findings into spool, returning how many"""
+    batches = {'vulnerability': [], 'bench_check': []}
+    batch_count = 0
+    for kind, record in findings:
+        batch = batches['vulnerability' if kind == 'vulnerability' else 'bench_check']
+        batch.append(record)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            pickle.dump((kind, batch), spool, pickle.HIGHEST_PROTOCOL)
+            batch_count += 1
+            batch.clear()
+    
+    for kind, batch in batches.items():
+        if batch:
+            pickle.dump((kind, batch), spool, pickle.HIGHEST_PROTOCOL)
+            batch_count += 1
+    return batch_count
+
+def _write_scan_stream(cursor, scan_stream, spool, batch_count):
+    # From the start, also when the writer runs the request a second time
+    spool.seek(0)
+    
+    # Totals are only known once the whole report has been read
+    counts = scan_stream['vulnerability_counts']
+    cursor.execute('''
+        INSERT INTO scans (container_name, scan_date, total_critical, total_high,
+                         total_medium, total_low, total_negligible, scan_status,
+                         image_digest, db_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        scan_stream['container_name'],
+        scan_stream['scan_date'],
+        counts['critical'],
+        counts['high'],
+        counts['medium'],
+        counts['low'],
+        counts['negligible'],
+        'completed',
+        scan_stream.get('image_digest'),
+        scan_stream.get('db_version')
+    ))
+    scan_id = cursor.lastrowid
+    
+    _insert_bench_scan(cursor, scan_id, scan_stream['bench_results']['summary'])
+    bench_scan_id = cursor.lastrowid
+    
+    seen = (set(), set())
+    for _ in range(batch_count):
+        kind, batch = pickle.load(spool)
+        if kind == 'vulnerability':
+            _insert_vulnerability_batch(cursor, scan_id, batch, seen)
+        else:
+            _insert_bench_check_batch(cursor, bench_scan_id, batch)
+    
+    if scan_stream.get('report'):
+        _insert_scan_report(cursor, scan_id, scan_stream['report'])
+    
+    _refresh_cve_exposure(cursor, scan_stream['container_name'])
+    
+    return scan_id
+
+def _batched(records):
+    """Split records into lists of INSERT_BATCH_SIZE"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _insert_vulnerability_batch(cursor, scan_id, vulns, seen, catalog_sql=CVE_CATALOG_INSERT_SQL):
+    """Insert vulnerabilities, adding any CVEs and package names not yet in the catalog
+    
+    seen is a (cve_ids, package_names) pair of sets shared by all batches of
+    one scan. A report lists the same CVE for many packages and targets, so
+    each CVE and package name is only offered to the catalog once per scan.
+    """
+    seen_cves, seen_packages = seen
+    new_cves = {}
+    new_packages = set()
+    for vuln in vulns:
+        if vuln['cve_id'] not in seen_cves:
+            new_cves.setdefault(vuln['cve_id'], vuln)
+        if vuln['package_name'] not in seen_packages:
+            new_packages.add(vuln['package_name'])
+    seen_cves.update(new_cves)
+    seen_packages.update(new_packages)
+    
+    cursor.executemany(catalog_sql, (
+        (vuln['cve_id'], vuln['title'], vuln['description'])
+        for vuln in new_cves.values()
+    ))
+    cursor.executemany(PACKAGE_NAME_INSERT_SQL, ((name,) for name in new_packages))
+    cursor.executemany(VULNERABILITY_INSERT_SQL, (
+        (
+            scan_id,
+            vuln['cve_id'],
+            vuln['severity'],
+            vuln['package_name'],
+            vuln['installed_version'],
+            vuln['fixed_version']
+        )
+        for vuln in vulns
+    ))
+
+def _insert_bench_scan(cursor, scan_id, summary):
+    cursor.execute('''
+        INSERT INTO bench_scans (scan_id, total_checks, pass_count, warn_count,
+                               fail_count, info_count, note_count, score)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        scan_id,
+        summary['total_checks'],
+        summary['pass_count'],
+        summary['warn_count'],
+        summary['fail_count'],
+        summary['info_count'],
+        summary['note_count'],
+        summary['score']
+    ))
+
+def _insert_scan_report(cursor, scan_id, report):
+    cursor.execute('''
+        INSERT INTO scan_reports (scan_id, format, source, report, raw_size)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (scan_id, report['format'], report['source'], report['data'], report['raw_size']))
+
+def _insert_bench_check_batch(cursor, bench_scan_id, checks):
+    cursor.executemany(BENCH_CHECK_INSERT_SQL, (
+        (
+            bench_scan_id,
+            check['check_id'],
+            check['status'],
+            check['title'],
+            check['description']
+        )
+        for check in checks
+    ))
+
+def _refresh_cve_exposure(cursor, container_name):
+    """Point a container's cve_exposure rows at its latest scan (caller's transaction)"""
+    cursor.execute('DELETE FROM cve_exposure WHERE container_name = ?', (container_name,))
+    cursor.execute('''
+        INSERT OR IGNORE INTO cve_exposure (catalog_id, container_name, scan_id)
+        SELECT catalog_id, ?, scan_id FROM vulnerabilities
+        WHERE scan_id = (
+            SELECT id FROM scans
+            WHERE container_name = ?
+            ORDER BY scan_date DESC, id DESC
+            LIMIT 1
+        )
+    ''', (container_name, container_name))
+
+@timed_db('find_cached_scan')
+def find_cached_scan(image_digest, db_version, max_age_seconds, container_name=None):
+    """Find the newest scan of an image digest made with the given Trivy DB version
+    
+    Scans saved under container_name are preferred over scans of the same
+    digest under another name.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    try:
-        # Insert scan summary
+    oldest_date = (datetime.now() - timedelta(seconds=max_age_seconds)).isoformat()
+    cursor.execute('''
+        SELECT id FROM scans
+        WHERE image_digest = ? AND db_version = ? AND scan_date >= ?
+        ORDER BY container_name IS ? DESC, scan_date DESC
+        LIMIT 1
+    ''', (image_digest, db_version, oldest_date, container_name))
+    
+    row = cursor.fetchone()
+    release_db_connection(conn)
+    return row['id'] if row else None
+
+@timed_db('copy_scan')
+def copy_scan(scan_id, container_name):
+    """Save a copy of a stored scan under another container name, returning the new scan_id
+    
+    Used when a name is served from the scan cache of the same digest under
+    another name, so every requested name has its own scan. The copy keeps
+    the scan date of the Trivy run it comes from. Returns None if the scan
+    no longer exists.
+    """
+    def copy(cursor):
         cursor.execute('''
-            INSERT INTO scans (container_name, scan_date, total_critical, total_high, 
-                             total_medium, total_low, total_negligible, scan_status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            scan_result['container_name'],
-            scan_result['scan_date'],
-            scan_result['vulnerability_counts']['critical'],
-            scan_result['vulnerability_counts']['high'],
-            scan_result['vulnerability_counts']['medium'],
-            scan_result['vulnerability_counts']['low'],
-            scan_result['vulnerability_counts']['negligible'],
-            'completed'
-        ))
+            INSERT INTO scans (container_name, scan_date, total_critical, total_high, total_medium,
+                               total_low, total_negligible, scan_status, image_digest, db_version)
+            SELECT ?, scan_date, total_critical, total_high, total_medium,
+                   total_low, total_negligible, scan_status, image_digest, db_version
+            FROM scans WHERE id = ?
+        ''', (container_name, scan_id))
+        if not cursor.rowcount:
+            return None
+        new_scan_id = cursor.lastrowid
         
-        scan_id = cursor.lastrowid
-        
-        # Insert individual vulnerabilities
-        for vuln in scan_result['vulnerabilities']:
-            cursor.execute('''
-                INSERT INTO vulnerabilities (scan_id, cve_id, severity, package_name,
-                                           installed_version, fixed_version, title, description)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                scan_id,
-                vuln['cve_id'],
-                vuln['severity'],
-                vuln['package_name'],
-                vuln['installed_version'],
-                vuln['fixed_version'],
-                vuln['title'],
-                vuln['description']
-            ))
+        cursor.execute('''
+            INSERT INTO vulnerabilities (scan_id, catalog_id, severity, package_name,
+                                         installed_version, fixed_version)
+            SELECT ?, catalog_id, severity, package_name, installed_version, fixed_version
+            FROM vulnerabilities WHERE scan_id = ?
+            ORDER BY id
+        ''', (new_scan_id, scan_id))
         
-        # Insert Docker Bench results if available
-        if 'bench_results' in scan_result and scan_result['bench_results']:
-            bench_data = scan_result['bench_results']
-            summary = bench_data['summary']
-            
+        cursor.execute('''
+            INSERT INTO bench_scans (scan_id, total_checks, pass_count, warn_count, fail_count,
+                                     info_count, note_count, score)
+            SELECT ?, total_checks, pass_count, warn_count, fail_count, info_count, note_count, score
+            FROM bench_scans WHERE scan_id = ?
+        ''', (new_scan_id, scan_id))
+        if cursor.rowcount:
             cursor.execute('''
-                INSERT INTO bench_scans (scan_id, total_checks, pass_count, warn_count,
-                                       fail_count, info_count, note_count, score)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                scan_id,
-                summary['total_checks'],
-                summary['pass_count'],
-                summary['warn_count'],
-                summary['fail_count'],
-                summary['info_count'],
-                summary['note_count'],
-                summary['score']
-            ))
-            
-            bench_scan_id = cursor.lastrowid
-            
-            # Insert individual bench checks
-            for check in bench_data['checks']:
-                cursor.execute('''
-                    INSERT INTO bench_checks (bench_scan_id, check_id, status, title, description)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    bench_scan_id,
-                    check['check_id'],
-                    check['status'],
-                    check['title'],
-                    check['description']
-                ))
+                INSERT INTO bench_checks (bench_scan_id, check_id, status, title, description)
+                SELECT ?, bc.check_id, bc.status, bc.title, bc.description
+                FROM bench_checks bc
+                JOIN bench_scans bs ON bs.id = bc.bench_scan_id
+                WHERE bs.scan_id = ?
+                ORDER BY bc.id
+            ''', (cursor.lastrowid, scan_id))
         
-        conn.commit()
-        return scan_id
+        cursor.execute('''
+            INSERT INTO scan_reports (scan_id, format, source, report, raw_size)
+            SELECT ?, format, source, report, raw_size FROM scan_reports WHERE scan_id = ?
+        ''', (new_scan_id, scan_id))
         
+        _refresh_cve_exposure(cursor, container_name)
+        return new_scan_id
+    
+    return run_write(copy)
+
+@timed_db('store_sbom')
+def store_sbom(image_digest, container_name, sbom):
+    """Store the CycloneDX SBOM (bytes) of an image digest, replacing any older copy"""
+    compressed = zlib.compress(sbom, SBOM_COMPRESSION_LEVEL)
+    
+    def store(cursor):
+        cursor.execute('''
+            INSERT OR REPLACE INTO sboms (image_digest, container_name, sbom, raw_size, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (image_digest, container_name, compressed, len(sbom), datetime.now().isoformat()))
+        return True
+    
+    try:
+        return run_write(store)
     except Exception as e:
-        conn.rollback()
-        print(f"Database error: {e}")
+        print(f"Error storing SBOM: {e}")
         return False
-    finally:
-        conn.close()
 
+@timed_db('get_sbom')
+def get_sbom(image_digest):
+    """Get the stored SBOM (bytes) of an image digest, or None"""
+    if not image_digest:
+        return None
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT sbom FROM sboms WHERE image_digest = ?', (image_digest,))
+    row = cursor.fetchone()
+    release_db_connection(conn)
+    return zlib.decompress(row['sbom']) if row else None
+
+def get_archived_scan_ids(scan_ids=None):
+    """Get the ids of scans with an archived Trivy report, oldest first, optionally only of scan_ids"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if scan_ids:
+        placeholders = ', '.join('?' for _ in scan_ids)
+        cursor.execute(f'SELECT scan_id FROM scan_reports WHERE scan_id IN ({placeholders}) ORDER BY scan_id',
+                       list(scan_ids))
+    else:
+        cursor.execute('SELECT scan_id FROM scan_reports ORDER BY scan_id')
+    archived = [row['scan_id'] for row in cursor.fetchall()]
+    release_db_connection(conn)
+    return archived
+
+@timed_db('get_archived_report')
+def get_archived_report(scan_id):
+    """Get (format, source, output bytes) of a scan's archived Trivy report, or None"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT format, source, report FROM scan_reports WHERE scan_id = ?', (scan_id,))
+    row = cursor.fetchone()
+    release_db_connection(conn)
+    if not row:
+        return None
+    return row['format'], row['source'], zlib.decompress(row['report'])
+
+@timed_db('replace_scan_findings')
+def replace_scan_findings(scan_id, vuln_counts, vulnerabilities, secret_results=None):
+    """Replace a saved scan's vulnerabilities, and secrets unless secret_results is None
+    
+    Returns False if the scan no longer exists, and raises on database errors.
+    """
+    def replace(cursor):
+        cursor.execute('SELECT container_name FROM scans WHERE id = ?', (scan_id,))
+        scan = cursor.fetchone()
+        if not scan:
+            return False
+        
+        cursor.execute('DELETE FROM vulnerabilities WHERE scan_id = ?', (scan_id,))
+        seen = (set(), set())
+        for batch in _batched(vulnerabilities):
+            _insert_vulnerability_batch(cursor, scan_id, batch, seen, CVE_CATALOG_UPSERT_SQL)
+        
+        cursor.execute('''
+            UPDATE scans SET total_critical = ?, total_high = ?, total_medium = ?,
+                             total_low = ?, total_negligible = ?, reprocessed_at = ?
+            WHERE id = ?
+        ''', (
+            vuln_counts['critical'],
+            vuln_counts['high'],
+            vuln_counts['medium'],
+            vuln_counts['low'],
+            vuln_counts['negligible'],
+            datetime.now().isoformat(),
+            scan_id
+        ))
+        
+        if secret_results is not None:
+            # The summary row is recreated along with its checks (ON DELETE CASCADE)
+            cursor.execute('DELETE FROM bench_scans WHERE scan_id = ?', (scan_id,))
+            _insert_bench_scan(cursor, scan_id, secret_results['summary'])
+            bench_scan_id = cursor.lastrowid
+            for batch in _batched(secret_results['checks']):
+                _insert_bench_check_batch(cursor, bench_scan_id, batch)
+        
+        _refresh_cve_exposure(cursor, scan['container_name'])
+        return True
+    
+    return run_write(replace)
+
+@timed_db('get_digest_secret_results')
+def get_digest_secret_results(image_digest):
+    """Get the secret results (summary and checks) of the newest scan of an image digest, or None
+    
+    SBOMs list packages, not file contents, so rescans from an SBOM carry the
+    secrets found in the image over from its last full scan.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT b.id, b.total_checks, b.pass_count, b.warn_count, b.fail_count,
+               b.info_count, b.note_count, b.score
+        FROM scans s
+        JOIN bench_scans b ON b.scan_id = s.id
+        WHERE s.image_digest = ?
+        ORDER BY s.scan_date DESC, s.id DESC
+        LIMIT 1
+    ''', (image_digest,))
+    bench = cursor.fetchone()
+    
+    if not bench:
+        release_db_connection(conn)
+        return None
+    
+    cursor.execute('''
+        SELECT check_id, status, title, description FROM bench_checks
+        WHERE bench_scan_id = ?
+        ORDER BY id
+    ''', (bench['id'],))
+    checks = [dict(row) for row in cursor.fetchall()]
+    release_db_connection(conn)
+    
+    summary = {key: bench[key] for key in ('total_checks', 'pass_count', 'warn_count', 'fail_count',
+                                           'info_count', 'note_count', 'score')}
+    return {'summary': summary, 'checks': checks}
+
+def get_rescan_targets(scanned_before=None, limit=None):
+    """Get (container_name, image_digest) of the newest scan of every container, most urgent first
+    
+    Containers with critical, then high findings come first, then the ones
+    scanned longest ago. scanned_before leaves out containers scanned since.
+    image_digest is None for containers whose newest scan has no stored SBOM,
+    so they are rescanned from the registry instead. Otherwise it is only the
+    expected digest: the rescan job resolves the tag again and scans the image
+    if it points elsewhere.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    conditions = ['''s.id = (
+            SELECT s2.id FROM scans s2
+            WHERE s2.container_name = s.container_name
+            ORDER BY s2.scan_date DESC, s2.id DESC
+            LIMIT 1
+        )''']
+    params = []
+    if scanned_before:
+        conditions.append('s.scan_date < ?')
+        params.append(scanned_before)
+    
+    cursor.execute(f'''
+        SELECT s.container_name, sb.image_digest
+        FROM scans s
+        LEFT JOIN sboms sb ON sb.image_digest = s.image_digest
+        WHERE {' AND '.join(conditions)}
+        ORDER BY s.total_critical > 0 DESC, s.total_high > 0 DESC, s.scan_date
+        LIMIT ?
+    ''', params + [limit if limit is not None else -1])
+    targets = [(row['container_name'], row['image_digest']) for row in cursor.fetchall()]
+    release_db_connection(conn)
+    return targets
+
+def prune_sboms(limit=100):
+    """Delete up to limit stored SBOMs whose digest no scan refers to any more"""
+    def prune(cursor):
+        cursor.execute('''
+            DELETE FROM sboms WHERE image_digest IN (
+                SELECT sb.image_digest FROM sboms sb
+                WHERE NOT EXISTS (SELECT 1 FROM scans s WHERE s.image_digest = sb.image_digest)
+                LIMIT ?
+            )
+        ''', (limit,))
+        return cursor.rowcount
+    
+    try:
+        return run_write(prune)
+    except Exception as e:
+        print(f"Error pruning SBOMs: {e}")
+        return 0
+
+@timed_db('get_scan_result')
+def get_scan_result(scan_id):
+    """Rebuild a scan result summary (counts and secret summary) from a stored scan"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT s.*, b.total_checks, b.pass_count, b.warn_count, b.fail_count,
+               b.info_count, b.note_count, b.score
+        FROM scans s
+        LEFT JOIN bench_scans b ON s.id = b.scan_id
+        WHERE s.id = ?
+    ''', (scan_id,))
+    scan = cursor.fetchone()
+    
+    if not scan:
+        release_db_connection(conn)
+        return None
+    
+    cursor.execute('SELECT COUNT(*) as total FROM vulnerabilities WHERE scan_id = ?', (scan_id,))
+    total_vulnerabilities = cursor.fetchone()['total']
+    release_db_connection(conn)
+    
+    bench_results = None
+    if scan['total_checks'] is not None:
+        bench_results = {
+            'summary': {
+                'total_checks': scan['total_checks'],
+                'pass_count': scan['pass_count'],
+                'warn_count': scan['warn_count'],
+                'fail_count': scan['fail_count'],
+                'info_count': scan['info_count'],
+                'note_count': scan['note_count'],
+                'score': scan['score']
+            }
+        }
+    
+    return {
+        'success': True,
+        'container_name': scan['container_name'],
+        'scan_date': scan['scan_date'],
+        'image_digest': scan['image_digest'],
+        'db_version': scan['db_version'],
+        'vulnerability_counts': {
+            'critical': scan['total_critical'],
+            'high': scan['total_high'],
+            'medium': scan['total_medium'],
+            'low': scan['total_low'],
+            'negligible': scan['total_negligible']
+        },
+        'total_vulnerabilities': total_vulnerabilities,
+        'bench_results': bench_results
+    }
+
+@timed_db('get_all_scans')
 def get_all_scans(limit=20):
     """Get all scans summary with Docker Bench data - limited to prevent VM overload"""
     conn = get_db_connection()
@@ -121,9 +1391,139 @@ def get_all_scans(limit=20):
         scan_dict['config_issues'] = (scan_dict['fail_count'] or 0) + (scan_dict['warn_count'] or 0)
         scans.append(scan_dict)
     
-    conn.close()
+    release_db_connection(conn)
     return scans
 
+# Scan total column for each severity filter value
+SEVERITY_TOTAL_COLUMNS = {
+    'CRITICAL': 'total_critical',
+    'HIGH': 'total_high',
+    'MEDIUM': 'total_medium',
+    'LOW': 'total_low',
+    'NEGLIGIBLE': 'total_negligible'
+}
+
+def encode_cursor(values):
+    """Encode keyset pagination values as an opaque URL-safe cursor"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, size):
+    """Decode a cursor made by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    # Values are bound as query parameters, which only take scalars
+    if not all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in values):
+        raise ValueError('Invalid cursor')
+    return values
+
+@timed_db('list_scans')
+def list_scans(container_name=None, severity=None, since=None, until=None, cursor=None, limit=50):
+    """Get one page of scans, newest first, using keyset pagination on (scan_date, id)
+    
+    severity keeps scans with at least one finding of that severity; since and
+    until bound scan_date (until is exclusive). Returns (scans, next_cursor).
+    """
+    conditions = []
+    params = []
+    
+    if container_name:
+        conditions.append('s.container_name = ?')
+        params.append(container_name)
+    if severity:
+        conditions.append(f's.{SEVERITY_TOTAL_COLUMNS[severity]} > 0')
+    if since:
+        conditions.append('s.scan_date >= ?')
+        params.append(since)
+    if until:
+        conditions.append('s.scan_date < ?')
+        params.append(until)
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, 2)
+        conditions.append('(s.scan_date < ? OR (s.scan_date = ? AND s.id < ?))')
+        params += [last_date, last_date, last_id]
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    conn = get_db_connection()
+    db_cursor = conn.cursor()
+    
+    try:
+        # One extra row tells us whether there is a next page
+        db_cursor.execute(f'''
+            SELECT s.id, s.container_name, s.scan_date, 
+                   s.total_critical, s.total_high, s.total_medium, s.total_low, s.total_negligible,
+                   b.total_checks, b.pass_count, b.warn_count, b.fail_count, b.info_count, b.note_count, b.score
+            FROM scans s
+            LEFT JOIN bench_scans b ON s.id = b.scan_id
+            {where}
+            ORDER BY s.scan_date DESC, s.id DESC
+            LIMIT ?
+        ''', params + [limit + 1])
+        rows = db_cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    
+    scans = []
+    for row in rows[:limit]:
+        scan_dict = dict(row)
+        # Add computed fields
+        scan_dict['total_issues'] = scan_dict['total_critical'] + scan_dict['total_high'] + scan_dict['total_medium'] + scan_dict['total_low']
+        scan_dict['config_issues'] = (scan_dict['fail_count'] or 0) + (scan_dict['warn_count'] or 0)
+        scans.append(scan_dict)
+    
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor([scans[-1]['scan_date'], scans[-1]['id']])
+    
+    return scans, next_cursor
+
+@timed_db('list_scan_vulnerabilities')
+def list_scan_vulnerabilities(scan_id, severity=None, cursor=None, limit=100):
+    """Get one page of a scan's vulnerabilities in id order
+    
+    Returns (vulnerabilities, next_cursor), or None if the scan does not exist.
+    """
+    conditions = ['v.scan_id = ?']
+    params = [scan_id]
+    
+    if severity:
+        conditions.append('v.severity = ?')
+        params.append(severity)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        conditions.append('v.id > ?')
+        params.append(last_id)
+    
+    conn = get_db_connection()
+    db_cursor = conn.cursor()
+    
+    try:
+        db_cursor.execute('SELECT 1 FROM scans WHERE id = ?', (scan_id,))
+        if not db_cursor.fetchone():
+            return None
+        
+        db_cursor.execute(VULNERABILITY_SELECT_SQL + f'''
+            WHERE {' AND '.join(conditions)}
+            ORDER BY v.id
+            LIMIT ?
+        ''', params + [limit + 1])
+        rows = db_cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    
+    vulnerabilities = [dict(row) for row in rows[:limit]]
+    
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor([vulnerabilities[-1]['id']])
+    
+    return vulnerabilities, next_cursor
+
+@timed_db('get_scan_details')
 def get_scan_details(scan_id):
     """Get detailed scan results including vulnerabilities and bench checks"""
     conn = get_db_connection()
@@ -140,20 +1540,21 @@ def get_scan_details(scan_id):
     
     scan = cursor.fetchone()
     if not scan:
-        conn.close()
+        release_db_connection(conn)
         return None
     
     # Get vulnerabilities for this scan
-    cursor.execute('''
-        SELECT * FROM vulnerabilities WHERE scan_id = ?
+    cursor.execute(VULNERABILITY_SELECT_SQL + '''
+        WHERE v.scan_id = ?
         ORDER BY 
-            CASE severity 
+            CASE v.severity 
                 WHEN 'CRITICAL' THEN 1 
                 WHEN 'HIGH' THEN 2 
                 WHEN 'MEDIUM' THEN 3 
                 WHEN 'LOW' THEN 4 
                 ELSE 5 
-            END
+            END,
+            v.id
     ''', (scan_id,))
     
     vulnerabilities = [dict(row) for row in cursor.fetchall()]
@@ -176,7 +1577,7 @@ def get_scan_details(scan_id):
     
     bench_checks = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
+    release_db_connection(conn)
     
     return {
         'scan': dict(scan),
@@ -184,37 +1585,553 @@ def get_scan_details(scan_id):
         'bench_checks': bench_checks
     }
 
-def get_dashboard_summary():
-    """Get dashboard summary statistics - limited to most recent 20 scans"""
+# Rows fetched from the export cursor at a time
+EXPORT_FETCH_SIZE = 1000
+
+EXPORT_COLUMNS = {
+    'vulnerabilities': ['scan_id', 'container_name', 'scan_date', 'image_digest', 'cve_id', 'severity',
+                        'package_name', 'installed_version', 'fixed_version', 'title', 'description'],
+    'secrets': ['scan_id', 'container_name', 'scan_date', 'image_digest', 'check_id', 'status',
+                'title', 'description']
+}
+
+def iter_export_findings(kind, container_name=None, severity=None, since=None, until=None):
+    """Yield batches of finding rows (tuples in EXPORT_COLUMNS order) across scans, oldest scan first
+    
+    Rows are read from one cursor a batch at a time. CROSS JOIN keeps scans as
+    the outer loop, so the query walks the scan date indexes and SQLite never
+    sorts, keeping memory flat however many rows match. The since and until
+    arguments bound scan_date (until is exclusive). Severity only applies to
+    vulnerabilities.
+    """
+    conditions = []
+    params = []
+
+    if container_name:
+        conditions.append('s.container_name = ?')
+        params.append(container_name)
+    if since:
+        conditions.append('s.scan_date >= ?')
+        params.append(since)
+    if until:
+        conditions.append('s.scan_date < ?')
+        params.append(until)
+
+    if kind == 'vulnerabilities':
+        if severity:
+            conditions.append('v.severity = ?')
+            params.append(severity)
+        query = '''
+            SELECT s.id, s.container_name, s.scan_date, s.image_digest, c.cve_id, v.severity,
+                   v.package_name, v.installed_version, v.fixed_version, c.title, c.description
+            FROM scans s
+            CROSS JOIN vulnerabilities v ON v.scan_id = s.id
+            JOIN cve_catalog c ON c.id = v.catalog_id
+        '''
+    else:
+        query = '''
+            SELECT s.id, s.container_name, s.scan_date, s.image_digest, bc.check_id, bc.status,
+                   bc.title, bc.description
+            FROM scans s
+            CROSS JOIN bench_scans bs ON bs.scan_id = s.id
+            CROSS JOIN bench_checks bc ON bc.bench_scan_id = bs.id
+        '''
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'{query} {where} ORDER BY s.scan_date, s.id', params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+    finally:
+        # Also runs when the client disconnects and the generator is closed
+        release_db_connection(conn)
+
+# bm25 column weights: a match in the CVE id or title counts more than one in the description
+CVE_SEARCH_WEIGHTS = (10.0, 5.0, 1.0)
+SECRET_SEARCH_WEIGHTS = (5.0, 1.0)
+
+# Newest scan of each container; searches only cover what containers expose now
+LATEST_SCANS_CTE = '''
+    latest AS (
+        SELECT container_name, id AS scan_id, scan_date, MAX(scan_date)
+        FROM scans
+        {where}
+        GROUP BY container_name
+    )
+'''
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query matching every word, raising ValueError if there is none
     
-    # Total scanned containers (all time)
-    cursor.execute('SELECT COUNT(*) as total_scans FROM scans')
-    total_scans = cursor.fetchone()['total_scans']
+    Each word is quoted, so punctuation in package names and CVE ids is taken
+    literally instead of as query syntax.
+    """
+    terms = [term.replace('"', '""') for term in text.split()]
+    if not terms:
+        raise ValueError('q must contain at least one word')
+    return ' '.join(f'"{term}"' for term in terms)
+
+@timed_db('search_findings')
+def search_findings(kind, text, container_name=None, severity=None, cursor=None, limit=50):
+    """Full-text search over the findings in each container's newest scan, best matches first
     
-    # Total critical issues across recent scans only (prevents VM overload)
-    cursor.execute('''
-        SELECT SUM(total_critical) as total_critical 
+    kind is 'vulnerabilities' (CVE id, title, description and package name)
+    or 'secrets' (title and description). Pages use keyset pagination on
+    (rank, id). Returns (findings, next_cursor).
+    """
+    match = build_match_query(text)
+    latest_where = 'WHERE container_name = ?' if container_name else ''
+    latest_params = [container_name] if container_name else []
+    
+    page_where = ''
+    page_params = []
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor, 2)
+        page_where = 'WHERE rank > ? OR (rank = ? AND id > ?)'
+        page_params = [last_rank, last_rank, last_id]
+    
+    conn = get_db_connection()
+    db_cursor = conn.cursor()
+    
+    try:
+        if kind == 'vulnerabilities':
+            # Catalog matches go through cve_exposure straight to the affected scans;
+            # package matches check the rows of the newest scans, only if any package
+            # matched. A finding matching both ways gets both scores. Findings are
+            # ranked on ids alone and only the page is joined to its details.
+            exposure_filter = 'AND e.container_name = ?' if container_name else ''
+            severity_filter = 'AND v.severity = ?' if severity else ''
+            severity_params = [severity] if severity else []
+            db_cursor.execute(f'''
+                WITH {LATEST_SCANS_CTE.format(where=latest_where)},
+                cve_hits AS MATERIALIZED (
+                    SELECT rowid AS catalog_id, bm25(cve_catalog_fts, ?, ?, ?) AS rank
+                    FROM cve_catalog_fts WHERE cve_catalog_fts MATCH ?
+                ),
+                package_hits AS MATERIALIZED (
+                    SELECT p.name, bm25(package_names_fts) AS rank
+                    FROM package_names_fts
+                    JOIN package_names p ON p.id = package_names_fts.rowid
+                    WHERE package_names_fts MATCH ?
+                ),
+                matches AS (
+                    SELECT v.id, h.rank
+                    FROM cve_hits h
+                    JOIN cve_exposure e ON e.catalog_id = h.catalog_id {exposure_filter}
+                    JOIN vulnerabilities v ON v.scan_id = e.scan_id AND v.catalog_id = h.catalog_id
+                    WHERE 1 {severity_filter}
+                    UNION ALL
+                    SELECT v.id, h.rank
+                    FROM latest l
+                    JOIN vulnerabilities v ON v.scan_id = l.scan_id
+                    JOIN package_hits h ON h.name = v.package_name
+                    WHERE EXISTS (SELECT 1 FROM package_hits) {severity_filter}
+                ),
+                page AS (
+                    SELECT id, rank FROM (SELECT id, SUM(rank) AS rank FROM matches GROUP BY id)
+                    {page_where}
+                    ORDER BY rank, id
+                    LIMIT ?
+                )
+                SELECT r.rank, v.id, s.container_name, v.scan_id, s.scan_date, c.cve_id, v.severity,
+                       v.package_name, v.installed_version, v.fixed_version, c.title, c.description
+                FROM page r
+                JOIN vulnerabilities v ON v.id = r.id
+                JOIN cve_catalog c ON c.id = v.catalog_id
+                JOIN scans s ON s.id = v.scan_id
+                ORDER BY r.rank, r.id
+            ''', latest_params + list(CVE_SEARCH_WEIGHTS) + [match, match]
+                 + ([container_name] if container_name else []) + severity_params + severity_params
+                 + page_params + [limit + 1])
+        else:
+            db_cursor.execute(f'''
+                WITH {LATEST_SCANS_CTE.format(where=latest_where)},
+                hits AS (
+                    SELECT bm25(bench_checks_fts, ?, ?) AS rank, bc.id, l.container_name, l.scan_id, l.scan_date,
+                           bc.check_id, bc.status, bc.title, bc.description
+                    FROM bench_checks_fts
+                    JOIN bench_checks bc ON bc.id = bench_checks_fts.rowid
+                    JOIN bench_scans b ON b.id = bc.bench_scan_id
+                    JOIN latest l ON l.scan_id = b.scan_id
+                    WHERE bench_checks_fts MATCH ?
+                )
+                SELECT * FROM hits
+                {page_where}
+                ORDER BY rank, id
+                LIMIT ?
+            ''', latest_params + list(SECRET_SEARCH_WEIGHTS) + [match] + page_params + [limit + 1])
+        
+        rows = db_cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    
+    findings = [dict(row) for row in rows[:limit]]
+    
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor([findings[-1]['rank'], findings[-1]['id']])
+    
+    return findings, next_cursor
+
+# Findings of one scan keyed by (CVE, package); duplicates from several targets collapse
+# to their most severe row, so severity and versions always come from the same finding
+SCAN_FINDINGS_CTE = '''
+    {name} AS (
+        SELECT catalog_id, package_name, severity, installed_version, fixed_version
         FROM (
-            SELECT total_critical FROM scans 
-            ORDER BY scan_date DESC 
-            LIMIT 20
+            SELECT catalog_id, package_name, severity, installed_version, fixed_version,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY catalog_id, package_name
+                       ORDER BY
+                           CASE severity
+                               WHEN 'CRITICAL' THEN 1
+                               WHEN 'HIGH' THEN 2
+                               WHEN 'MEDIUM' THEN 3
+                               WHEN 'LOW' THEN 4
+                               ELSE 5
+                           END,
+                           id
+                   ) AS finding_rank
+            FROM vulnerabilities
+            WHERE scan_id = ?
         )
-    ''')
-    total_critical = cursor.fetchone()['total_critical'] or 0
-    
-    # Containers with high/critical issues (recent scans only)
+        WHERE finding_rank = 1
+    )
+'''
+
+def get_latest_scan_ids(container_name, count=2):
+    """Get the ids of a container's most recent scans, newest first"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
     cursor.execute('''
-        SELECT COUNT(*) as containers_with_issues 
-        FROM (
-            SELECT id FROM scans 
-            WHERE total_critical > 0 OR total_high > 0
-            ORDER BY scan_date DESC 
-            LIMIT 20
+        SELECT id FROM scans
+        WHERE container_name = ?
+        ORDER BY scan_date DESC, id DESC
+        LIMIT ?
+    ''', (container_name, count))
+    scan_ids = [row['id'] for row in cursor.fetchall()]
+    release_db_connection(conn)
+    return scan_ids
+
+@timed_db('diff_scans')
+def diff_scans(base_scan_id, scan_id):
+    """Compare two scans: findings added in scan_id, resolved since base_scan_id, and severity changes
+    
+    Findings are matched on (CVE, package). Returns None if either scan does not exist.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            SELECT id, container_name, scan_date FROM scans WHERE id IN (?, ?)
+        ''', (base_scan_id, scan_id))
+        scans = {row['id']: dict(row) for row in cursor.fetchall()}
+        if base_scan_id not in scans or scan_id not in scans:
+            return None
+        
+        ctes = 'WITH ' + SCAN_FINDINGS_CTE.format(name='base') + ', ' + SCAN_FINDINGS_CTE.format(name='target')
+        
+        # New in the target scan
+        cursor.execute(ctes + '''
+            SELECT c.cve_id, t.package_name, t.severity, t.installed_version, t.fixed_version, c.title
+            FROM target t
+            JOIN cve_catalog c ON c.id = t.catalog_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM base b
+                WHERE b.catalog_id = t.catalog_id AND b.package_name IS t.package_name
+            )
+            ORDER BY c.cve_id, t.package_name
+        ''', (base_scan_id, scan_id))
+        added = [dict(row) for row in cursor.fetchall()]
+        
+        # Gone from the target scan
+        cursor.execute(ctes + '''
+            SELECT c.cve_id, b.package_name, b.severity, b.installed_version, b.fixed_version, c.title
+            FROM base b
+            JOIN cve_catalog c ON c.id = b.catalog_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM target t
+                WHERE t.catalog_id = b.catalog_id AND t.package_name IS b.package_name
+            )
+            ORDER BY c.cve_id, b.package_name
+        ''', (base_scan_id, scan_id))
+        resolved = [dict(row) for row in cursor.fetchall()]
+        
+        # In both scans with a different severity
+        cursor.execute(ctes + '''
+            SELECT c.cve_id, t.package_name, b.severity AS old_severity, t.severity AS new_severity,
+                   t.installed_version, t.fixed_version, c.title
+            FROM target t
+            JOIN base b ON b.catalog_id = t.catalog_id AND b.package_name IS t.package_name
+            JOIN cve_catalog c ON c.id = t.catalog_id
+            WHERE b.severity IS NOT t.severity
+            ORDER BY c.cve_id, t.package_name
+        ''', (base_scan_id, scan_id))
+        severity_changed = [dict(row) for row in cursor.fetchall()]
+        
+        return {
+            'base_scan': scans[base_scan_id],
+            'scan': scans[scan_id],
+            'counts': {
+                'added': len(added),
+                'resolved': len(resolved),
+                'severity_changed': len(severity_changed)
+            },
+            'added': added,
+            'resolved': resolved,
+            'severity_changed': severity_changed
+        }
+    finally:
+        release_db_connection(conn)
+
+def find_expired_scan_ids(keep_scans=0, max_age_days=0):
+    """Get every scan outside the retention policy, oldest first
+    
+    A scan is kept while it is one of the keep_scans newest scans of its
+    container or is younger than max_age_days; 0 disables either rule.
+    Ranking the scans reads the whole table, so a retention pass calls this
+    once and purges the result in batches.
+    """
+    conditions = []
+    params = []
+    if keep_scans > 0:
+        conditions.append('scan_rank > ?')
+        params.append(keep_scans)
+    if max_age_days > 0:
+        conditions.append('scan_date < ?')
+        params.append((datetime.now() - timedelta(days=max_age_days)).isoformat())
+    if not conditions:
+        return []
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT id FROM (
+            SELECT id, scan_date,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY container_name ORDER BY scan_date DESC, id DESC
+                   ) AS scan_rank
+            FROM scans
         )
-    ''')
-    containers_with_issues = cursor.fetchone()['containers_with_issues']
+        WHERE {' AND '.join(conditions)}
+        ORDER BY scan_date
+    ''', params)
+    scan_ids = [row['id'] for row in cursor.fetchall()]
+    release_db_connection(conn)
+    return scan_ids
+
+@timed_db('purge_scans')
+def purge_scans(scan_ids):
+    """Delete a batch of scans in one short transaction, returning how many were removed"""
+    if not scan_ids:
+        return 0
+    
+    placeholders = ', '.join('?' * len(scan_ids))
+    
+    def purge(cursor):
+        cursor.execute(f'SELECT DISTINCT container_name FROM scans WHERE id IN ({placeholders})', scan_ids)
+        container_names = [row['container_name'] for row in cursor.fetchall()]
+        
+        # Findings and secret checks go with their scans (ON DELETE CASCADE)
+        cursor.execute(f'DELETE FROM scans WHERE id IN ({placeholders})', scan_ids)
+        deleted = cursor.rowcount
+        
+        for container_name in container_names:
+            _refresh_cve_exposure(cursor, container_name)
+        return deleted
+    
+    try:
+        return run_write(purge)
+    except Exception as e:
+        print(f"Error purging scans: {e}")
+        return 0
+
+def prune_cve_catalog(limit=1000):
+    """Delete up to limit catalog entries no finding refers to any more"""
+    def prune(cursor):
+        cursor.execute('''
+            DELETE FROM cve_catalog WHERE id IN (
+                SELECT c.id FROM cve_catalog c
+                WHERE NOT EXISTS (SELECT 1 FROM vulnerabilities v WHERE v.catalog_id = c.id)
+                LIMIT ?
+            )
+        ''', (limit,))
+        return cursor.rowcount
+    
+    try:
+        return run_write(prune)
+    except Exception as e:
+        print(f"Error pruning CVE catalog: {e}")
+        return 0
+
+def incremental_vacuum(pages):
+    """Return up to pages free pages to the filesystem, returning how many free pages remain"""
+    def vacuum(cursor):
+        cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+        cursor.fetchall()
+        cursor.execute('PRAGMA freelist_count')
+        return cursor.fetchone()[0]
+    
+    return run_write(vacuum)
+
+@timed_db('get_cve_affected')
+def get_cve_affected(cve_id, package_name=None):
+    """Get the containers whose latest scan reports a CVE, optionally for one package"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT id, cve_id, title FROM cve_catalog WHERE cve_id = ?', (cve_id,))
+    cve = cursor.fetchone()
+    if not cve:
+        release_db_connection(conn)
+        return {
+            'cve_id': cve_id,
+            'title': None,
+            'container_count': 0,
+            'affected': []
+        }
+    
+    query = '''
+        SELECT e.container_name, e.scan_id, s.scan_date, v.package_name,
+               v.installed_version, v.fixed_version, v.severity
+        FROM cve_exposure e
+        JOIN scans s ON s.id = e.scan_id
+        JOIN vulnerabilities v ON v.scan_id = e.scan_id AND v.catalog_id = e.catalog_id
+        WHERE e.catalog_id = ?
+    '''
+    params = [cve['id']]
+    if package_name:
+        query += ' AND v.package_name = ?'
+        params.append(package_name)
+    query += ' ORDER BY e.container_name, v.package_name'
+    
+    cursor.execute(query, params)
+    affected = [dict(row) for row in cursor.fetchall()]
+    release_db_connection(conn)
+    
+    return {
+        'cve_id': cve['cve_id'],
+        'title': cve['title'],
+        'container_count': len({row['container_name'] for row in affected}),
+        'affected': affected
+    }
+
+@timed_db('get_trends')
+def get_trends(container_name=None, since=None, until=None):
+    """Get daily severity and secret counts for one container, or for all containers
+    
+    since and until are ISO 8601 dates, both inclusive (default the last
+    TRENDS_DEFAULT_DAYS days). A container's counts for a day are those of its
+    newest scan that day, and days it was not scanned are left out. Without a
+    container each day adds up every container's newest counts on or before that
+    day, so containers scanned less often than daily still count between scans.
+    """
+    since_day = since[:10] if since else (datetime.now() - timedelta(days=TRENDS_DEFAULT_DAYS)).date().isoformat()
+    until_day = until[:10] if until else '9999-12-31'
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    if container_name:
+        cursor.execute('''
+            SELECT day, scan_id, critical, high, medium, low, secrets
+            FROM scan_trends
+            WHERE container_name = ? AND day >= ? AND day <= ?
+            ORDER BY day
+        ''', (container_name, since_day, until_day))
+        points = [dict(row) for row in cursor.fetchall()]
+        release_db_connection(conn)
+        return points
+    
+    # Each container's standing as of the first day, from its last scanned day before it
+    cursor.execute('''
+        SELECT container_name, critical, high, medium, low, secrets, MAX(day)
+        FROM scan_trends
+        WHERE day < ?
+        GROUP BY container_name
+    ''', (since_day,))
+    latest = {row['container_name']: row for row in cursor.fetchall()}
+    
+    cursor.execute('''
+        SELECT container_name, day, critical, high, medium, low, secrets
+        FROM scan_trends
+        WHERE day >= ? AND day <= ?
+        ORDER BY day
+    ''', (since_day, until_day))
+    
+    points = []
+    day = None
+    for row in cursor:
+        if row['day'] != day and day is not None:
+            points.append(_sum_trend_day(day, latest))
+        day = row['day']
+        latest[row['container_name']] = row
+    if day is not None:
+        points.append(_sum_trend_day(day, latest))
+    
+    release_db_connection(conn)
+    return points
+
+def _sum_trend_day(day, latest):
+    point = {'day': day, 'containers': len(latest)}
+    for column in ['critical', 'high', 'medium', 'low', 'secrets']:
+        point[column] = sum(row[column] for row in latest.values())
+    return point
+
+def get_scan_revision(scan_id):
+    """Get (scan_date, reprocessed_at, catalog_revision) of a scan, or None if it does not exist
+    
+    Scan ids are reused after the data is cleared. A scan's findings change
+    when they are rebuilt from its archived report, and their CVE text also
+    changes when reprocessing any scan rewrites the shared catalog, so these
+    together with the id identify one version of a scan's responses.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT s.scan_date, s.reprocessed_at, d.catalog_revision
+            FROM scans s, dashboard_stats d
+            WHERE s.id = ? AND d.id = 1
+        ''', (scan_id,))
+        row = cursor.fetchone()
+    finally:
+        release_db_connection(conn)
+    return (row['scan_date'], row['reprocessed_at'], row['catalog_revision']) if row else None
+
+def get_dashboard_generation():
+    """Get the counter that changes whenever dashboard data is written"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT generation FROM dashboard_stats WHERE id = 1')
+    row = cursor.fetchone()
+    release_db_connection(conn)
+    return row['generation'] if row else 0
+
+@timed_db('get_dashboard_summary')
+def get_dashboard_summary():
+    """Get dashboard summary statistics - limited to most recent 20 scans
+    
+    Totals come from the trigger-maintained dashboard_stats row, and the whole
+    summary is reused until its generation changes.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT total_scans, scans_with_issues, generation FROM dashboard_stats WHERE id = 1')
+    stats = cursor.fetchone()
+    
+    with _summary_cache_lock:
+        if _summary_cache['generation'] == stats['generation']:
+            release_db_connection(conn)
+            return _summary_cache['summary']
     
     # Recent scans (last 20) with bench data
     cursor.execute('''
@@ -224,47 +2141,103 @@ def get_dashboard_summary():
         FROM scans s
         LEFT JOIN bench_scans b ON s.id = b.scan_id
         ORDER BY s.scan_date DESC 
-        LIMIT 20
-    ''')
+        LIMIT ?
+    ''', (DASHBOARD_RECENT_LIMIT,))
     recent_scans = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
+    release_db_connection(conn)
     
-    return {
-        'total_scans': total_scans,
-        'total_critical': total_critical,
-        'containers_with_issues': containers_with_issues,
+    summary = {
+        # Total scanned containers (all time)
+        'total_scans': stats['total_scans'],
+        # Total critical issues across recent scans only (prevents VM overload)
+        'total_critical': sum(scan['total_critical'] or 0 for scan in recent_scans),
+        # Containers with high/critical issues (up to the 20 most recent)
+        'containers_with_issues': min(stats['scans_with_issues'], DASHBOARD_RECENT_LIMIT),
         'recent_scans': recent_scans
     }
+    
+    with _summary_cache_lock:
+        _summary_cache['generation'] = stats['generation']
+        _summary_cache['summary'] = summary
+    
+    return summary
 
-def delete_scan(scan_id):
-    """Delete a scan and its vulnerabilities and bench checks"""
+def get_dashboard_delta(scan_id):
+    """Get a saved scan as a dashboard row plus the updated totals, or None if it is gone
+
+    Lets open dashboards add the scan to their summary without refetching it.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    try:
-        # Delete bench checks first
-        cursor.execute('''
-            DELETE FROM bench_checks 
-            WHERE bench_scan_id IN (
-                SELECT id FROM bench_scans WHERE scan_id = ?
-            )
-        ''', (scan_id,))
-        
-        # Delete bench scans
-        cursor.execute('DELETE FROM bench_scans WHERE scan_id = ?', (scan_id,))
-        
-        # Delete vulnerabilities
-        cursor.execute('DELETE FROM vulnerabilities WHERE scan_id = ?', (scan_id,))
+
+    cursor.execute('''
+        SELECT s.container_name, s.scan_date,
+               s.total_critical, s.total_high, s.total_medium, s.total_low,
+               b.fail_count, b.warn_count, b.score
+        FROM scans s
+        LEFT JOIN bench_scans b ON s.id = b.scan_id
+        WHERE s.id = ?
+    ''', (scan_id,))
+    scan = cursor.fetchone()
+
+    cursor.execute('SELECT total_scans, scans_with_issues FROM dashboard_stats WHERE id = 1')
+    stats = cursor.fetchone()
+
+    release_db_connection(conn)
+
+    if not scan:
+        return None
+
+    return {
+        'scan': dict(scan),
+        'total_scans': stats['total_scans'],
+        'containers_with_issues': min(stats['scans_with_issues'], DASHBOARD_RECENT_LIMIT),
+        'recent_limit': DASHBOARD_RECENT_LIMIT
+    }
+
+@timed_db('delete_scan')
+def delete_scan(scan_id):
+    """Delete a scan and its vulnerabilities and bench checks"""
+    def delete(cursor):
+        cursor.execute('SELECT container_name, image_digest FROM scans WHERE id = ?', (scan_id,))
+        scan = cursor.fetchone()
         
-        # Delete scan
+        # Vulnerabilities, bench scans and bench checks go with it (ON DELETE CASCADE)
         cursor.execute('DELETE FROM scans WHERE id = ?', (scan_id,))
         
-        conn.commit()
+        # The container's previous scan may now be its latest
+        if scan:
+            _refresh_cve_exposure(cursor, scan['container_name'])
+        
+        # Drop the digest's SBOM along with its last scan
+        if scan and scan['image_digest']:
+            cursor.execute('''
+                DELETE FROM sboms WHERE image_digest = ?
+                AND NOT EXISTS (SELECT 1 FROM scans WHERE image_digest = ?)
+            ''', (scan['image_digest'], scan['image_digest']))
         return True
+    
+    try:
+        return run_write(delete)
     except Exception as e:
-        conn.rollback()
         print(f"Error deleting scan: {e}")
         return False
-    finally:
-        conn.close()
+
+@timed_db('clear_scan_data')
+def clear_scan_data():
+    """Delete every scan, finding, secret and SBOM, raising on failure"""
+    def clear(cursor):
+        cursor.execute('DELETE FROM bench_checks')
+        cursor.execute('DELETE FROM bench_scans')
+        cursor.execute('DELETE FROM cve_exposure')
+        cursor.execute('DELETE FROM vulnerabilities')
+        cursor.execute('DELETE FROM cve_catalog')
+        cursor.execute('DELETE FROM scans')
+        cursor.execute('DELETE FROM sboms')
+        cursor.execute('DELETE FROM package_names')
+        cursor.execute('DELETE FROM scan_trends')
+        cursor.execute('DELETE FROM scan_reports')
+        cursor.execute('DELETE FROM sqlite_sequence WHERE name IN ("scans", "vulnerabilities", "cve_catalog", "bench_scans", "bench_checks")')
+    
+    run_write(clear)
@@ -0,0 +1,79 @@
+"""Rebuild scan findings from archived Trivy reports, without running Trivy
+
+Extracts the vulnerabilities and secrets of saved scans again from the
+report archived with each one, e.g. after scanner.py starts keeping another
+field. Reports are decompressed and parsed in parallel worker processes and
+the rebuilt findings are written by this process's database writer.
+
+    python reprocess.py                       # every scan with an archived report
+    python reprocess.py 12 15 --workers 4     # only scans 12 and 15
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+from models import get_archived_scan_ids, get_archived_report, replace_scan_findings
+from scanner import parse_archived_report
+
+# Archived reports sent to a worker process per task
+REPROCESS_CHUNK_SIZE = 4
+
+def _parse_archived_scan(scan_id):
+    """Parse one scan's archived report in a worker, returning (scan_id, source, findings or error)"""
+    try:
+        archived = get_archived_report(scan_id)
+        if archived is None:
+            return scan_id, None, 'no archived report'
+        report_format, source, output = archived
+        return scan_id, source, parse_archived_report(report_format, output)
+    except Exception as e:
+        return scan_id, None, str(e)
+
+def reprocess_scans(scan_ids=None, workers=None):
+    """Rebuild the findings of scans from their archived reports, returning how many were rebuilt"""
+    archived = get_archived_scan_ids(scan_ids)
+    if not archived:
+        print("No archived reports to reprocess")
+        return 0
+
+    started = time.perf_counter()
+    rebuilt = 0
+    workers = workers or os.cpu_count()
+    slice_size = workers * REPROCESS_CHUNK_SIZE
+    slices = [archived[start:start + slice_size] for start in range(0, len(archived), slice_size)]
+    with multiprocessing.Pool(workers) as pool:
+        # Workers parse the next slice while this one is written, so at most two
+        # slices of parsed findings are held however large the archive is. Oldest
+        # first, so the newest report's CVE text is the one left in the shared catalog.
+        pending = pool.imap(_parse_archived_scan, slices[0], chunksize=REPROCESS_CHUNK_SIZE)
+        for next_slice in slices[1:] + [None]:
+            upcoming = pool.imap(_parse_archived_scan, next_slice, chunksize=REPROCESS_CHUNK_SIZE) if next_slice else None
+            for scan_id, source, parsed in pending:
+                if source is None:
+                    print(f"Skipping scan {scan_id}: {parsed}")
+                    continue
+
+                vuln_counts, vulnerabilities, secrets, secret_summary = parsed
+                # Reports of SBOM rescans hold no secrets, the ones carried over from the image scan stay
+                secret_results = {'summary': secret_summary, 'checks': secrets} if source == 'image' else None
+                try:
+                    if replace_scan_findings(scan_id, vuln_counts, vulnerabilities, secret_results):
+                        rebuilt += 1
+                except Exception as e:
+                    print(f"Error reprocessing scan {scan_id}: {e}")
+            pending = upcoming
+
+    print(f"Reprocessed {rebuilt} of {len(archived)} scans in {time.perf_counter() - started:.1f}s")
+    return rebuilt
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('scan_ids', nargs='*', type=int, help='scans to reprocess (default all archived)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='processes parsing reports in parallel')
+    args = parser.parse_args()
+    reprocess_scans(args.scan_ids, args.workers)
+
+if __name__ == '__main__':
+    main()
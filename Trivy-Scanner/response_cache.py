@@ -0,0 +1,43 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Memory for cached per-scan API responses, in MB (least recently used are dropped first)
+RESPONSE_CACHE_MB = int(os.environ.get('RESPONSE_CACHE_MB', '64'))
+
+# Largest single response worth caching, so one huge scan cannot flush everything else
+MAX_CACHED_RESPONSE_BYTES = RESPONSE_CACHE_MB * 1024 * 1024 // 4
+
+# key -> serialized JSON body
+_cache = OrderedDict()
+_cache_state = {'bytes': 0}
+_cache_lock = threading.Lock()
+
+def get_cached_response(key):
+    """Get a cached response body, or None on a miss"""
+    with _cache_lock:
+        body = _cache.get(key)
+        if body is not None:
+            _cache.move_to_end(key)
+        return body
+
+def store_cached_response(key, body):
+    """Cache the body of a response that never changes for key"""
+    if len(body) > MAX_CACHED_RESPONSE_BYTES:
+        return
+
+    with _cache_lock:
+        previous = _cache.pop(key, None)
+        if previous is not None:
+            _cache_state['bytes'] -= len(previous)
+        _cache[key] = body
+        _cache_state['bytes'] += len(body)
+        while _cache_state['bytes'] > RESPONSE_CACHE_MB * 1024 * 1024:
+            _, dropped = _cache.popitem(last=False)
+            _cache_state['bytes'] -= len(dropped)
+
+def clear_response_cache():
+    """Forget all cached responses"""
+    with _cache_lock:
+        _cache.clear()
+        _cache_state['bytes'] = 0
@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from models import (find_expired_scan_ids, purge_scans, prune_cve_catalog, prune_sboms, incremental_vacuum,
+                    DATABASE_PATH, AUTO_VACUUM_INCREMENTAL)
+from events import publish_event
+
+# Newest scans always kept per container (0 keeps every scan)
+RETENTION_KEEP_SCANS = int(os.environ.get('RETENTION_KEEP_SCANS', '0'))
+
+# Scans younger than this many days are always kept (0 keeps every scan)
+RETENTION_MAX_AGE_DAYS = int(os.environ.get('RETENTION_MAX_AGE_DAYS', '0'))
+
+# Seconds between background retention passes
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', '3600'))
+
+# Scans deleted per transaction; small batches keep the write lock short
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '10'))
+
+# Free pages returned to the filesystem per incremental vacuum step
+VACUUM_PAGES_PER_STEP = 500
+
+# Seconds to pause between batches so scans and dashboard reads get the database
+BATCH_PAUSE = 0.05
+
+_worker = []
+_worker_lock = threading.Lock()
+
+def retention_enabled():
+    return RETENTION_KEEP_SCANS > 0 or RETENTION_MAX_AGE_DAYS > 0
+
+def run_retention():
+    """Purge scans outside the retention policy and reclaim the freed space
+
+    The expired scans are found once per pass, then deleted a batch at a time,
+    each batch in its own short transaction.
+    """
+    purged = 0
+    expired = find_expired_scan_ids(RETENTION_KEEP_SCANS, RETENTION_MAX_AGE_DAYS)
+    batch_size = max(1, RETENTION_BATCH_SIZE)
+    for start in range(0, len(expired), batch_size):
+        deleted = purge_scans(expired[start:start + batch_size])
+        if not deleted:
+            break
+        purged += deleted
+        time.sleep(BATCH_PAUSE)
+
+    pruned = 0
+    while True:
+        deleted = prune_cve_catalog()
+        pruned += deleted
+        if not deleted:
+            break
+        time.sleep(BATCH_PAUSE)
+
+    # SBOMs of digests no remaining scan refers to
+    while prune_sboms():
+        time.sleep(BATCH_PAUSE)
+
+    # No-op unless the database was created with auto_vacuum=INCREMENTAL
+    free_pages = incremental_vacuum(VACUUM_PAGES_PER_STEP)
+    while free_pages > 0:
+        time.sleep(BATCH_PAUSE)
+        remaining = incremental_vacuum(VACUUM_PAGES_PER_STEP)
+        if remaining >= free_pages:
+            break
+        free_pages = remaining
+
+    if purged:
+        # Purged scans may be on open dashboards
+        publish_event('resync', {})
+    if purged or pruned:
+        print(f"Retention purged {purged} scans and {pruned} unused CVE entries")
+    return purged
+
+def _retention_loop():
+    while True:
+        try:
+            run_retention()
+        except Exception as e:
+            print(f"Retention pass failed: {e}")
+        time.sleep(RETENTION_INTERVAL)
+
+def start_retention_worker():
+    """Start the background retention thread once per process, if a policy is configured"""
+    if not retention_enabled():
+        return
+    with _worker_lock:
+        if _worker:
+            return
+        worker = threading.Thread(target=_retention_loop, name='retention-worker', daemon=True)
+        worker.start()
+        _worker.append(worker)
+
+def enable_incremental_vacuum():
+    """Switch an existing database to auto_vacuum=INCREMENTAL
+
+    Needs a full VACUUM to take effect, which rewrites the file and blocks
+    writers while it runs, so this is a one-off maintenance step.
+    """
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if mode == AUTO_VACUUM_INCREMENTAL:
+            print("Incremental vacuum is already enabled")
+            return
+        print("Rewriting database with auto_vacuum=INCREMENTAL...")
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        print("Incremental vacuum enabled")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    if '--enable-incremental-vacuum' in sys.argv[1:]:
+        enable_incremental_vacuum()
+    elif not retention_enabled():
+        print("No retention policy set (RETENTION_KEEP_SCANS / RETENTION_MAX_AGE_DAYS)")
+    else:
+        run_retention()
@@ -0,0 +1,69 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from models import find_cached_scan, get_scan_result
+
+# Seconds a scan stays reusable for the same image digest and Trivy DB version
+SCAN_CACHE_TTL = int(os.environ.get('SCAN_CACHE_TTL', '86400'))
+
+# Number of name/digest entries kept in memory (least recently used are dropped first)
+SCAN_CACHE_SIZE = int(os.environ.get('SCAN_CACHE_SIZE', '1000'))
+
+# (container_name, image_digest, db_version) -> scan_id
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def lookup_cached_scan(container_name, image_digest, db_version):
+    """Get the stored scan result for a digest/DB version pair, or None on a miss
+
+    A scan saved under container_name is preferred; otherwise the result may
+    be a scan of the same digest under another name, which the caller copies.
+    """
+    if not image_digest or not db_version or SCAN_CACHE_TTL <= 0:
+        return None
+
+    key = (container_name, image_digest, db_version)
+
+    with _cache_lock:
+        scan_id = _cache.get(key)
+        if scan_id is not None:
+            _cache.move_to_end(key)
+
+    # Fall back to the scans table so the cache survives restarts
+    if scan_id is None:
+        scan_id = find_cached_scan(image_digest, db_version, SCAN_CACHE_TTL, container_name)
+        if scan_id is None:
+            return None
+
+    scan_result = get_scan_result(scan_id)
+    scan_age = None
+    if scan_result:
+        scan_age = (datetime.now() - datetime.fromisoformat(scan_result['scan_date'])).total_seconds()
+
+    if scan_age is None or scan_age >= SCAN_CACHE_TTL:
+        # Scan was deleted or has expired since it was cached
+        with _cache_lock:
+            _cache.pop(key, None)
+        return None
+
+    scan_result['scan_id'] = scan_id
+    return scan_result
+
+def store_cached_scan(container_name, image_digest, db_version, scan_id):
+    """Remember the scan saved under container_name for a digest/DB version pair"""
+    if not image_digest or not db_version:
+        return
+
+    key = (container_name, image_digest, db_version)
+    with _cache_lock:
+        _cache[key] = scan_id
+        _cache.move_to_end(key)
+        while len(_cache) > SCAN_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def clear_scan_cache():
+    """Forget all cached scans"""
+    with _cache_lock:
+        _cache.clear()
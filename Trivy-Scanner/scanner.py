@@ -2,98 +2,302 @@ import subprocess
 import json
 import re
 import os
+import tempfile
+import threading
+import time
+import zlib
 from datetime import datetime
 
-def run_trivy_combined_scan(container_name):
-    """Run Trivy scan with both vulnerability and secret scanning"""
+from metrics import inc, phase_span, record_phase
+
+# Cache directory shared by every Trivy process (vulnerability DB and image layer cache)
+TRIVY_CACHE_DIR = os.environ.get('TRIVY_CACHE_DIR', os.path.expanduser('~/.cache/trivy'))
+
+# Never download the vulnerability DB during scans (offline hosts keep it current out of band)
+TRIVY_SKIP_DB_UPDATE = os.environ.get('TRIVY_SKIP_DB_UPDATE', 'false').lower() in ('1', 'true', 'yes')
+
+# Keep each scan's Trivy output, compressed, so findings can be extracted again without rescanning
+TRIVY_ARCHIVE_REPORTS = os.environ.get('TRIVY_ARCHIVE_REPORTS', 'true').lower() not in ('0', 'false', 'no')
+
+# zlib level for archived reports; written on every scan and rarely read, so favour
+# speed (level 1 is about three times faster than 6 and still shrinks reports ~5:1)
+REPORT_COMPRESSION_LEVEL = 1
+
+def _trivy_image_cmd(container_name, output_args, server_url=None):
+    """Build a `trivy image` command, as a client of server_url when given"""
+    cmd = ['trivy', 'image', '--scanners', 'vuln,secret'] + output_args + ['--insecure']
+    if server_url:
+        # The server owns the vulnerability DB, the client only analyzes the image
+        cmd += ['--server', server_url]
+    elif TRIVY_SKIP_DB_UPDATE:
+        cmd.append('--skip-db-update')
+    return cmd + [container_name]
+
+def _trivy_sbom_cmd(sbom_path, output_args, server_url=None):
+    """Build a `trivy sbom` command for a stored SBOM, as a client of server_url when given"""
+    # An SBOM lists packages only, there are no file contents to search for secrets
+    cmd = ['trivy', 'sbom', '--scanners', 'vuln'] + output_args
+    if server_url:
+        cmd += ['--server', server_url]
+    elif TRIVY_SKIP_DB_UPDATE:
+        cmd.append('--skip-db-update')
+    return cmd + [sbom_path]
+
+def _pinned_reference(container_name, image_digest):
+    """Point an image reference at a digest, so a moved tag cannot change what is read"""
+    repository = container_name.split('@', 1)[0]
+    # A ':' after the last '/' is a tag, one before it belongs to a registry port
+    if ':' in repository.rsplit('/', 1)[-1]:
+        repository = repository.rsplit(':', 1)[0]
+    return f'{repository}@{image_digest}'
+
+def generate_sbom(container_name, image_digest=None, server_url=None):
+    """Generate a CycloneDX SBOM (bytes) for an image, or None if Trivy fails
+    
+    Runs after the image was scanned, so Trivy's layer cache already holds
+    the analyzed layers and nothing is pulled twice. With server_url it runs
+    as a client of the Trivy server like the scans, so it never loads the
+    vulnerability DB itself.
+    """
+    reference = _pinned_reference(container_name, image_digest) if image_digest else container_name
+    cmd = ['trivy', 'image', '--format', 'cyclonedx', '--insecure']
+    if server_url:
+        cmd += ['--server', server_url]
+    elif TRIVY_SKIP_DB_UPDATE:
+        cmd.append('--skip-db-update')
+    
     try:
-        # Run trivy command with both scanners
-        cmd = ['trivy', 'image', '--scanners', 'vuln,secret', '--format', 'json', '--insecure', container_name]
+        result = subprocess.run(cmd + [reference], capture_output=True, timeout=300, env=get_trivy_env())
+        if result.returncode != 0:
+            print(f"SBOM generation failed for {reference}: {result.stderr.decode(errors='replace')}")
+            return None
+        return result.stdout
+    except (subprocess.TimeoutExpired, OSError) as e:
+        print(f"SBOM generation failed for {reference}: {e}")
+        return None
+
+def get_trivy_env():
+    """Environment for Trivy subprocesses"""
+    env = os.environ.copy()
+    # Set environment variables for insecure registries
+    env['TRIVY_INSECURE'] = 'true'
+    env['TRIVY_CACHE_DIR'] = TRIVY_CACHE_DIR
+    return env
+
+# How long the Trivy vulnerability DB version is reused before asking Trivy again
+DB_VERSION_CHECK_INTERVAL = 300
+
+_db_version_cache = {'version': None, 'checked_at': 0}
+_db_version_lock = threading.Lock()
+
+def get_trivy_db_version():
+    """Get the installed Trivy vulnerability DB version (UpdatedAt timestamp), or None"""
+    with _db_version_lock:
+        if _db_version_cache['version'] and time.time() - _db_version_cache['checked_at'] < DB_VERSION_CHECK_INTERVAL:
+            return _db_version_cache['version']
         
-        # Set environment variables for insecure registries
-        env = os.environ.copy()
-        env['TRIVY_INSECURE'] = 'true'
+        try:
+            result = subprocess.run(['trivy', 'version', '--format', 'json'],
+                                    capture_output=True, text=True, timeout=30, env=get_trivy_env())
+            if result.returncode != 0:
+                return None
+            
+            version_info = json.loads(result.stdout)
+            db_info = version_info.get('VulnerabilityDB') or {}
+            version = db_info.get('UpdatedAt')
+            if not version:
+                return None
+            
+            _db_version_cache['version'] = version
+            _db_version_cache['checked_at'] = time.time()
+            return version
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300, env=env)
+        except (subprocess.TimeoutExpired, json.JSONDecodeError, OSError) as e:
+            print(f"Could not read Trivy DB version: {e}")
+            return None
+
+def resolve_image_digest(container_name):
+    """Resolve an image reference to its registry digest without pulling it, or None"""
+    # Already pinned to a digest
+    match = re.search(r'@(sha256:[0-9a-f]{64})$', container_name)
+    if match:
+        return match.group(1)
+    
+    try:
+        cmd = ['skopeo', 'inspect', '--tls-verify=false', '--format', '{{.Digest}}',
+               f'docker://{container_name}']
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        
+        digest = result.stdout.strip()
+        if result.returncode != 0 or not digest.startswith('sha256:'):
+            return None
+        return digest
+    
+    except (subprocess.TimeoutExpired, OSError):
+        # skopeo missing or registry unreachable: scan without caching
+        return None
+
+def _digest_from_metadata(scan_data):
+    """Pull the image digest out of Trivy report metadata"""
+    metadata = scan_data.get('Metadata') or {}
+    for repo_digest in metadata.get('RepoDigests') or []:
+        if '@' in repo_digest:
+            return repo_digest.split('@', 1)[1]
+    return None
+
+def _vulnerability_record(vuln):
+    """Convert a Trivy vulnerability entry into a vulnerabilities table row"""
+    return {
+        'cve_id': vuln.get('VulnerabilityID', 'N/A'),
+        'severity': vuln.get('Severity', 'UNKNOWN').upper(),
+        'package_name': vuln.get('PkgName', 'N/A'),
+        'installed_version': vuln.get('InstalledVersion', 'N/A'),
+        'fixed_version': vuln.get('FixedVersion', 'N/A'),
+        'title': vuln.get('Title', 'N/A'),
+        'description': vuln.get('Description', 'N/A')[:500]  # Limit description length
+    }
+
+def _secret_record(secret, target):
+    """Convert a Trivy secret entry into a bench_checks table row"""
+    return {
+        'check_id': secret.get('RuleID', 'N/A'),
+        'status': 'FAIL',  # Trivy only reports exposed secrets
+        'title': secret.get('Title', 'N/A'),
+        'description': f"Secret found in {target or 'unknown location'}: {secret.get('Match', 'N/A')[:100]}",
+        'severity': secret.get('Severity', 'HIGH').upper()
+    }
+
+def _new_secret_summary():
+    return {
+        'total_checks': 0,
+        'pass_count': 0,  # Trivy doesn't report passed checks
+        'warn_count': 0,
+        'fail_count': 0,
+        'info_count': 0,
+        'note_count': 0,
+        'score': 100
+    }
+
+def _count_secret(secret_summary, secret):
+    """Add one secret to a running secret summary"""
+    secret_summary['total_checks'] += 1
+    if secret['severity'] in ['MEDIUM', 'LOW']:
+        secret_summary['warn_count'] += 1
+    elif secret['severity'] in ['CRITICAL', 'HIGH']:
+        secret_summary['fail_count'] += 1
+    elif secret['severity'] == 'INFO':
+        secret_summary['info_count'] += 1
+    secret_summary['score'] = max(0, 100 - secret_summary['total_checks'])  # Simple scoring: 100 - number of secrets
+
+def _report_phase(on_phase, phase):
+    if on_phase is not None:
+        on_phase(phase)
+
+def parse_report(scan_data):
+    """Extract (vulnerability counts, vulnerabilities, secrets, secret summary) from a Trivy JSON report"""
+    vuln_counts = {
+        'critical': 0,
+        'high': 0,
+        'medium': 0,
+        'low': 0,
+        'negligible': 0
+    }
+    
+    vulnerabilities = []
+    secrets = []
+    
+    # Process results
+    for result_item in scan_data.get('Results') or []:
+        # Process vulnerabilities
+        for vuln in result_item.get('Vulnerabilities') or []:
+            severity = vuln.get('Severity', 'UNKNOWN').lower()
+            
+            # Count by severity
+            if severity in vuln_counts:
+                vuln_counts[severity] += 1
+            
+            # Store individual vulnerability
+            vulnerabilities.append(_vulnerability_record(vuln))
+        
+        # Process secrets
+        for secret in result_item.get('Secrets') or []:
+            secrets.append(_secret_record(secret, result_item.get('Target')))
+    
+    # Create summary for secrets
+    secret_summary = _new_secret_summary()
+    for secret in secrets:
+        _count_secret(secret_summary, secret)
+    
+    return vuln_counts, vulnerabilities, secrets, secret_summary
+
+def _archive_report(report_format, source, output):
+    """Compress Trivy output for the report archive, or None when archiving is off
+    
+    source is 'image' or 'sbom'; reports of SBOM scans hold no secrets.
+    """
+    if not TRIVY_ARCHIVE_REPORTS:
+        return None
+    return {
+        'format': report_format,
+        'source': source,
+        'data': zlib.compress(output, REPORT_COMPRESSION_LEVEL),
+        'raw_size': len(output)
+    }
+
+def run_trivy_combined_scan(container_name, server_url=None, on_phase=None, sbom_path=None):
+    """Run Trivy scan with both vulnerability and secret scanning
+    
+    on_phase is called with 'scanning' and 'parsing' as the scan progresses.
+    The result's timings hold the seconds spent in Trivy (image pull and
+    analysis) and parsing its report. With sbom_path, the stored SBOM is
+    scanned for vulnerabilities instead of the image.
+    """
+    timings = {}
+    try:
+        # Run trivy command with both scanners
+        if sbom_path:
+            cmd = _trivy_sbom_cmd(sbom_path, ['--format', 'json'], server_url)
+        else:
+            cmd = _trivy_image_cmd(container_name, ['--format', 'json'], server_url)
+        
+        _report_phase(on_phase, 'scanning')
+        with phase_span('trivy', timings):
+            result = subprocess.run(cmd, capture_output=True, timeout=300, env=get_trivy_env())
         
         if result.returncode != 0:
             return {
                 'success': False,
-                'error': f"Trivy scan failed: {result.stderr}",
+                'error': f"Trivy scan failed: {result.stderr.decode(errors='replace')}",
                 'container_name': container_name
             }
         
-        # Parse JSON output
+        inc('trivy_output_bytes_total', len(result.stdout))
+        
+        # Parse JSON output (json.loads reads the raw bytes without a decoded copy)
+        _report_phase(on_phase, 'parsing')
+        parse_start = time.perf_counter()
         scan_data = json.loads(result.stdout)
         
-        # Extract vulnerability counts
-        vuln_counts = {
-            'critical': 0,
-            'high': 0,
-            'medium': 0,
-            'low': 0,
-            'negligible': 0
-        }
+        vuln_counts, vulnerabilities, secrets, secret_summary = parse_report(scan_data)
         
-        vulnerabilities = []
-        secrets = []
-        
-        # Process results
-        if 'Results' in scan_data:
-            for result_item in scan_data['Results']:
-                # Process vulnerabilities
-                if 'Vulnerabilities' in result_item:
-                    for vuln in result_item['Vulnerabilities']:
-                        severity = vuln.get('Severity', 'UNKNOWN').lower()
-                        
-                        # Count by severity
-                        if severity in vuln_counts:
-                            vuln_counts[severity] += 1
-                        
-                        # Store individual vulnerability
-                        vulnerabilities.append({
-                            'cve_id': vuln.get('VulnerabilityID', 'N/A'),
-                            'severity': severity.upper(),
-                            'package_name': vuln.get('PkgName', 'N/A'),
-                            'installed_version': vuln.get('InstalledVersion', 'N/A'),
-                            'fixed_version': vuln.get('FixedVersion', 'N/A'),
-                            'title': vuln.get('Title', 'N/A'),
-                            'description': vuln.get('Description', 'N/A')[:500]  # Limit description length
-                        })
-                
-                # Process secrets
-                if 'Secrets' in result_item:
-                    for secret in result_item['Secrets']:
-                        secrets.append({
-                            'check_id': secret.get('RuleID', 'N/A'),
-                            'status': 'FAIL',  # Trivy only reports exposed secrets
-                            'title': secret.get('Title', 'N/A'),
-                            'description': f"Secret found in {result_item.get('Target', 'unknown location')}: {secret.get('Match', 'N/A')[:100]}",
-                            'severity': secret.get('Severity', 'HIGH').upper()
-                        })
-        
-        # Create summary for secrets
-        secret_summary = {
-            'total_checks': len(secrets),
-            'pass_count': 0,  # Trivy doesn't report passed checks
-            'warn_count': len([s for s in secrets if s['severity'] in ['MEDIUM', 'LOW']]),
-            'fail_count': len([s for s in secrets if s['severity'] in ['CRITICAL', 'HIGH']]),
-            'info_count': len([s for s in secrets if s['severity'] == 'INFO']),
-            'note_count': 0,
-            'score': max(0, 100 - len(secrets))  # Simple scoring: 100 - number of secrets
-        }
+        record_phase('parse', time.perf_counter() - parse_start, timings)
+        inc('scan_findings_total', len(vulnerabilities), kind='vulnerability')
+        inc('scan_findings_total', len(secrets), kind='secret')
         
         return {
             'success': True,
             'container_name': container_name,
             'scan_date': datetime.now().isoformat(),
+            'image_digest': _digest_from_metadata(scan_data),
             'vulnerability_counts': vuln_counts,
             'vulnerabilities': vulnerabilities,
             'total_vulnerabilities': len(vulnerabilities),
             'secret_results': {
                 'summary': secret_summary,
                 'checks': secrets
-            }
+            },
+            'report': _archive_report('json', 'sbom' if sbom_path else 'image', result.stdout),
+            'timings': timings
         }
         
     except subprocess.TimeoutExpired:
@@ -115,12 +319,228 @@ def run_trivy_combined_scan(container_name):
             'container_name': container_name
         }
 
-def run_combined_scan(container_name):
+# Go template that makes Trivy print one JSON object per finding, so the report
+# can be read line by line instead of as one large document. Whole findings are
+# printed so the archived output keeps every field of the JSON report.
+STREAM_TEMPLATE = (
+    '{{- range . }}{{- $target := .Target }}'
+    '{{- range .Vulnerabilities }}\n'
+    '{"Kind":"vulnerability","Target":{{ $target | toJson }},"Finding":{{ . | toJson }}}'
+    '{{- end }}'
+    '{{- range .Secrets }}\n'
+    '{"Kind":"secret","Target":{{ $target | toJson }},"Finding":{{ . | toJson }}}'
+    '{{- end }}'
+    '{{- end }}\n'
+)
+
+def _stream_record(line):
+    """Decode one line of STREAM_TEMPLATE output into (kind, record), kind None for anything else"""
+    entry = json.loads(line)
+    kind = entry.get('Kind')
+    finding = entry.get('Finding') or {}
+    if kind == 'vulnerability':
+        return kind, _vulnerability_record(finding)
+    if kind == 'secret':
+        return kind, _secret_record(finding, entry.get('Target'))
+    return None, None
+
+def parse_stream_output(lines):
+    """Extract (vulnerability counts, vulnerabilities, secrets, secret summary) from STREAM_TEMPLATE output"""
+    vuln_counts = {
+        'critical': 0,
+        'high': 0,
+        'medium': 0,
+        'low': 0,
+        'negligible': 0
+    }
+    vulnerabilities = []
+    secrets = []
+    secret_summary = _new_secret_summary()
+    
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        kind, record = _stream_record(line)
+        if kind == 'vulnerability':
+            severity = record['severity'].lower()
+            if severity in vuln_counts:
+                vuln_counts[severity] += 1
+            vulnerabilities.append(record)
+        elif kind == 'secret':
+            _count_secret(secret_summary, record)
+            secrets.append(record)
+    
+    return vuln_counts, vulnerabilities, secrets, secret_summary
+
+def parse_archived_report(report_format, output):
+    """Extract findings again from archived Trivy output ('json' report or 'ndjson' stream lines)"""
+    if report_format == 'json':
+        return parse_report(json.loads(output))
+    return parse_stream_output(output.splitlines())
+
+# Read Trivy findings as a stream instead of buffering the whole JSON report
+TRIVY_STREAMING = os.environ.get('TRIVY_STREAMING', 'true').lower() not in ('0', 'false', 'no')
+
+class TrivyScanError(Exception):
+    """Raised while reading a streamed scan when Trivy fails or times out"""
+
+def _iter_stream_findings(process, scan_stream, stderr_file, timer, on_phase=None, archive_source=None):
+    """Yield ('vulnerability' | 'secret', record) from Trivy output, updating the counts as it goes
+    
+    Time waiting on Trivy's output counts as the trivy phase and time spent
+    decoding lines as the parse phase; time the consumer spends between
+    findings is not counted. With archive_source ('image' or 'sbom') the
+    output is compressed as it is read and left in scan_stream['report'].
+    """
+    vuln_counts = scan_stream['vulnerability_counts']
+    secret_summary = scan_stream['bench_results']['summary']
+    timings = scan_stream['timings']
+    total_vulnerabilities = 0
+    total_secrets = 0
+    output_bytes = 0
+    parse_seconds = 0
+    output_wait = 0
+    resumed_at = scan_stream['trivy_started_at']
+    first_line = True
+    archive = zlib.compressobj(REPORT_COMPRESSION_LEVEL) if archive_source else None
+    archive_chunks = []
+    
+    try:
+        for line in process.stdout:
+            line_start = time.perf_counter()
+            output_wait += line_start - resumed_at
+            # Trivy only writes the report once the image has been analyzed
+            if first_line:
+                _report_phase(on_phase, 'parsing')
+                first_line = False
+            output_bytes += len(line)
+            if archive is not None:
+                archive_chunks.append(archive.compress(line))
+            line = line.strip()
+            if not line:
+                resumed_at = line_start
+                continue
+            
+            kind, record = _stream_record(line)
+            if kind == 'vulnerability':
+                severity = record['severity'].lower()
+                if severity in vuln_counts:
+                    vuln_counts[severity] += 1
+                total_vulnerabilities += 1
+                scan_stream['total_vulnerabilities'] = total_vulnerabilities
+            
+            elif kind == 'secret':
+                _count_secret(secret_summary, record)
+                total_secrets += 1
+            
+            parse_seconds += time.perf_counter() - line_start
+            if record is not None:
+                yield kind, record
+            resumed_at = time.perf_counter()
+        
+        process.wait()
+        output_wait += time.perf_counter() - resumed_at
+        if timer.finished.is_set() and process.returncode != 0:
+            raise TrivyScanError(f"Trivy scan timed out for {scan_stream['container_name']}")
+        if process.returncode != 0:
+            stderr_file.seek(0)
+            raise TrivyScanError(f"Trivy scan failed: {stderr_file.read()}")
+        
+        scan_stream['db_version'] = get_trivy_db_version()
+        if archive is not None:
+            archive_chunks.append(archive.flush())
+            scan_stream['report'] = {
+                'format': 'ndjson',
+                'source': archive_source,
+                'data': b''.join(archive_chunks),
+                'raw_size': output_bytes
+            }
+        
+        record_phase('trivy', output_wait, timings)
+        record_phase('parse', parse_seconds, timings)
+        scan_stream['stream_seconds'] = output_wait + parse_seconds
+        inc('trivy_output_bytes_total', output_bytes)
+        inc('scan_findings_total', total_vulnerabilities, kind='vulnerability')
+        inc('scan_findings_total', total_secrets, kind='secret')
+    
+    except json.JSONDecodeError as e:
+        raise TrivyScanError(f"Failed to parse Trivy output: {str(e)}")
+    finally:
+        timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        stderr_file.close()
+
+def stream_trivy_combined_scan(container_name, image_digest=None, server_url=None, on_phase=None,
+                               sbom_path=None):
+    """Start a Trivy scan whose findings are read incrementally
+    
+    Returns a scan result without the vulnerability list: findings are yielded
+    by scan_stream['findings'] and the counts are filled in as it is consumed.
+    The generator raises TrivyScanError if Trivy fails. With sbom_path, the
+    stored SBOM is scanned for vulnerabilities instead of the image.
+    """
+    output_args = ['--format', 'template', '--template', STREAM_TEMPLATE]
+    if sbom_path:
+        cmd = _trivy_sbom_cmd(sbom_path, output_args, server_url)
+    else:
+        cmd = _trivy_image_cmd(container_name, output_args, server_url)
+    
+    stderr_file = tempfile.TemporaryFile(mode='w+')
+    _report_phase(on_phase, 'scanning')
+    started_at = time.perf_counter()
+    try:
+        # Binary output: json.loads takes the raw lines and their length is the byte count
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, env=get_trivy_env())
+    except OSError as e:
+        stderr_file.close()
+        return {
+            'success': False,
+            'error': f"Unexpected error: {str(e)}",
+            'container_name': container_name
+        }
+    
+    # Same 300 second limit as the buffered scan
+    timer = threading.Timer(300, process.kill)
+    timer.daemon = True
+    timer.start()
+    
+    scan_stream = {
+        'success': True,
+        'container_name': container_name,
+        'scan_date': datetime.now().isoformat(),
+        'image_digest': image_digest,
+        'db_version': None,
+        'vulnerability_counts': {
+            'critical': 0,
+            'high': 0,
+            'medium': 0,
+            'low': 0,
+            'negligible': 0
+        },
+        'total_vulnerabilities': 0,
+        'bench_results': {
+            'summary': _new_secret_summary()
+        },
+        'report': None,
+        'trivy_started_at': started_at,
+        'stream_seconds': 0,
+        'timings': {}
+    }
+    archive_source = ('sbom' if sbom_path else 'image') if TRIVY_ARCHIVE_REPORTS else None
+    scan_stream['findings'] = _iter_stream_findings(process, scan_stream, stderr_file, timer, on_phase,
+                                                    archive_source)
+    return scan_stream
+
+def run_combined_scan(container_name, server_url=None, on_phase=None, sbom_path=None):
     """Run Trivy combined scan (replaces separate Trivy + Docker Bench)"""
     print(f"Starting Trivy combined scan for: {container_name}")
     
     # Run Trivy with both vulnerability and secret scanning
-    trivy_result = run_trivy_combined_scan(container_name)
+    trivy_result = run_trivy_combined_scan(container_name, server_url, on_phase, sbom_path)
     
     if not trivy_result['success']:
         return trivy_result
@@ -130,9 +550,13 @@ def run_combined_scan(container_name):
         'success': True,
         'container_name': trivy_result['container_name'],
         'scan_date': trivy_result['scan_date'],
+        'image_digest': trivy_result['image_digest'],
+        'db_version': get_trivy_db_version(),
         'vulnerability_counts': trivy_result['vulnerability_counts'],
         'vulnerabilities': trivy_result['vulnerabilities'],
-        'total_vulnerabilities': trivy_result['total_vulnerabilities']
+        'total_vulnerabilities': trivy_result['total_vulnerabilities'],
+        'report': trivy_result['report'],
+        'timings': trivy_result['timings']
     }
     
     # Add secret results as "bench_results" for database compatibility
@@ -0,0 +1,104 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from jobs import submit_scan_job, get_job, get_active_container_names, JOB_DONE, JOB_FAILED
+from metrics import inc
+from models import get_rescan_targets
+
+# Seconds after its newest scan that a container is rescanned (0 disables the scheduler)
+RESCAN_INTERVAL = int(os.environ.get('RESCAN_INTERVAL', '0'))
+
+# Most scheduled rescans queued or running at once, leaving the other workers to requested scans
+RESCAN_CONCURRENCY = int(os.environ.get('RESCAN_CONCURRENCY', '1'))
+
+# Most seconds of random delay before each scheduled rescan, so they do not arrive in bursts
+RESCAN_JITTER = int(os.environ.get('RESCAN_JITTER', '30'))
+
+# Seconds between checks for containers due a rescan
+SCHEDULER_POLL_INTERVAL = 60
+
+# Scheduled rescans that are queued or running, by job id
+_in_flight = set()
+
+# container_name -> time.time() of its last scheduled rescan, so a container whose
+# rescan was served from the scan cache (and saved no new scan) is not picked again
+_last_attempt = {}
+
+_worker = []
+_worker_lock = threading.Lock()
+
+def scheduler_enabled():
+    return RESCAN_INTERVAL > 0
+
+def _free_slots():
+    """Forget finished rescans and return how many more may start"""
+    for job_id in list(_in_flight):
+        job = get_job(job_id)
+        if job is None or job['status'] in (JOB_DONE, JOB_FAILED):
+            _in_flight.discard(job_id)
+    return max(1, RESCAN_CONCURRENCY) - len(_in_flight)
+
+def run_scheduler_pass():
+    """Queue rescans of the most urgent containers due one, returning how many were queued
+
+    Containers whose newest scan is younger than RESCAN_INTERVAL, that already
+    have a scan queued or running, or that were rescanned within the interval
+    are skipped.
+    """
+    slots = _free_slots()
+    if slots <= 0:
+        return 0
+
+    now = time.time()
+    for container_name, attempted_at in list(_last_attempt.items()):
+        if now - attempted_at >= RESCAN_INTERVAL:
+            del _last_attempt[container_name]
+
+    scanned_before = (datetime.now() - timedelta(seconds=RESCAN_INTERVAL)).isoformat()
+    skipped = get_active_container_names() | set(_last_attempt)
+    targets = get_rescan_targets(scanned_before, limit=slots + len(skipped))
+
+    queued = 0
+    for container_name, image_digest in targets:
+        if queued >= slots:
+            break
+        if container_name in skipped:
+            continue
+
+        time.sleep(random.uniform(0, RESCAN_JITTER))
+        job = submit_scan_job(container_name, image_digest=image_digest)
+        if job is None:
+            # Scan queue is full, try again on the next pass
+            break
+
+        _in_flight.add(job['job_id'])
+        _last_attempt[container_name] = time.time()
+        queued += 1
+        inc('scheduled_rescans_total')
+        print(f"Scheduled rescan of {container_name}" + (' from its SBOM unless the tag has moved' if image_digest else ''))
+
+    return queued
+
+def _scheduler_loop():
+    # Instances restarted together do not all start rescanning at once
+    time.sleep(random.uniform(0, RESCAN_JITTER))
+    while True:
+        try:
+            run_scheduler_pass()
+        except Exception as e:
+            print(f"Rescan scheduler pass failed: {e}")
+        time.sleep(SCHEDULER_POLL_INTERVAL + random.uniform(0, RESCAN_JITTER))
+
+def start_rescan_scheduler():
+    """Start the background rescan scheduler once per process, if a rescan interval is configured"""
+    if not scheduler_enabled():
+        return
+    with _worker_lock:
+        if _worker:
+            return
+        worker = threading.Thread(target=_scheduler_loop, name='rescan-scheduler', daemon=True)
+        worker.start()
+        _worker.append(worker)
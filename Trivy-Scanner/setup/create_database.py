@@ -6,9 +6,12 @@ Creates all necessary tables for vulnerability and secret scanning
 
 import sqlite3
 import os
+import sys
 from datetime import datetime
 
-DATABASE_PATH = 'security_dashboard.db'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import migrate_database, DATABASE_PATH
 
 def create_database():
     """Create the security dashboard database with all required tables"""
@@ -19,97 +22,34 @@ def create_database():
         os.rename(DATABASE_PATH, backup_name)
         print(f"Existing database backed up as: {backup_name}")
     
-    # Create new database
+    # Free pages can be handed back to the filesystem after retention purges,
+    # which must be set before the first table is created
     conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
     try:
-        # Create scans table (main scan results)
-        cursor.execute('''
-            CREATE TABLE scans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                container_name TEXT NOT NULL,
-                scan_date TEXT NOT NULL,
-                total_critical INTEGER DEFAULT 0,
-                total_high INTEGER DEFAULT 0,
-                total_medium INTEGER DEFAULT 0,
-                total_low INTEGER DEFAULT 0,
-                total_negligible INTEGER DEFAULT 0,
-                scan_status TEXT DEFAULT 'completed',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create vulnerabilities table (individual CVEs)
-        cursor.execute('''
-            CREATE TABLE vulnerabilities (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                scan_id INTEGER NOT NULL,
-                cve_id TEXT,
-                severity TEXT,
-                package_name TEXT,
-                installed_version TEXT,
-                fixed_version TEXT,
-                title TEXT,
-                description TEXT,
-                FOREIGN KEY (scan_id) REFERENCES scans (id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Create bench_scans table (for secret detection summary - reusing old structure)
-        cursor.execute('''
-            CREATE TABLE bench_scans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                scan_id INTEGER NOT NULL,
-                total_checks INTEGER DEFAULT 0,
-                pass_count INTEGER DEFAULT 0,
-                warn_count INTEGER DEFAULT 0,
-                fail_count INTEGER DEFAULT 0,
-                info_count INTEGER DEFAULT 0,
-                note_count INTEGER DEFAULT 0,
-                score INTEGER DEFAULT 0,
-                FOREIGN KEY (scan_id) REFERENCES scans (id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Create bench_checks table (for individual secrets - reusing old structure)
-        cursor.execute('''
-            CREATE TABLE bench_checks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                bench_scan_id INTEGER NOT NULL,
-                check_id TEXT,
-                status TEXT,
-                title TEXT,
-                description TEXT,
-                FOREIGN KEY (bench_scan_id) REFERENCES bench_scans (id) ON DELETE CASCADE
-            )
-        ''')
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
         
-        # Create indexes for better performance
-        cursor.execute('CREATE INDEX idx_scans_container ON scans(container_name)')
-        cursor.execute('CREATE INDEX idx_scans_date ON scans(scan_date)')
-        cursor.execute('CREATE INDEX idx_vulns_scan_id ON vulnerabilities(scan_id)')
-        cursor.execute('CREATE INDEX idx_vulns_severity ON vulnerabilities(severity)')
-        cursor.execute('CREATE INDEX idx_bench_scans_scan_id ON bench_scans(scan_id)')
-        cursor.execute('CREATE INDEX idx_bench_checks_bench_scan_id ON bench_checks(bench_scan_id)')
-        
-        conn.commit()
-        print("Database created successfully!")
-        print(f"Database file: {DATABASE_PATH}")
-        
-        # Display table info
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
-        print(f"Created {len(tables)} tables: {', '.join([t[0] for t in tables])}")
-        
-        return True
-        
-    except Exception as e:
-        conn.rollback()
-        print(f"Error creating database: {e}")
+        # WAL journaling lets the dashboard read while scans are being written
+        conn.execute('PRAGMA journal_mode = WAL')
+    finally:
+        conn.close()
+    
+    # The tables, indexes and triggers are the ones models.py migrates to
+    if not migrate_database():
+        print("Error creating database")
         return False
+    
+    print("Database created successfully!")
+    print(f"Database file: {DATABASE_PATH}")
+    
+    # Display table info
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        print(f"Created {len(tables)} tables: {', '.join([t[0] for t in tables])}")
     finally:
         conn.close()
+    
+    return True
 
 def verify_database():
     """Verify that the database was created correctly"""
@@ -122,7 +62,7 @@ def verify_database():
     
     try:
         # Check all tables exist
-        required_tables = ['scans', 'vulnerabilities', 'bench_scans', 'bench_checks']
+        required_tables = ['scans', 'cve_catalog', 'vulnerabilities', 'cve_exposure', 'bench_scans', 'bench_checks', 'sboms', 'scan_reports', 'package_names', 'cve_catalog_fts', 'package_names_fts', 'bench_checks_fts', 'dashboard_stats', 'scan_trends']
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         existing_tables = [row[0] for row in cursor.fetchall()]
         
@@ -55,6 +55,7 @@ sudo dnf install -y \
     wget \
     git \
     unzip \
+    skopeo \
     firewalld
 
 # Install Trivy
@@ -111,6 +112,15 @@ print_status "Downloading application files from GitHub..."
 curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/app.py -o app.py
 curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/models.py -o models.py
 curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/scanner.py -o scanner.py
+curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/jobs.py -o jobs.py
+curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/trivy_server.py -o trivy_server.py
+curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/scan_cache.py -o scan_cache.py
+curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/retention.py -o retention.py
+curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/events.py -o events.py
+curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/metrics.py -o metrics.py
+curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/response_cache.py -o response_cache.py
+curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/scheduler.py -o scheduler.py
+curl -sSL https://raw.githubusercontent.com/skiptosecure/security-toolkits/main/Trivy-Scanner/reprocess.py -o reprocess.py
 
 # Create static directory and download HTML
 print_status "Creating static directory and downloading dashboard..."
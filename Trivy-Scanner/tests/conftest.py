@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.join(APP_DIR, 'setup'))
+
+import models
+from create_database import create_database
+
+@pytest.fixture(scope='session', autouse=True)
+def database(tmp_path_factory):
+    """One database for the whole run, since the writer thread keeps its connection open"""
+    work_dir = tmp_path_factory.mktemp('db')
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    create_database()
+    models.migrate_database()
+    yield os.path.join(work_dir, models.DATABASE_PATH)
+    os.chdir(previous_dir)
+
+@pytest.fixture(autouse=True)
+def empty_database(database):
+    models.clear_scan_data()
+    yield
+
+def make_scan_result(container_name='app:1', scan_date='2026-01-01T00:00:00', vulns=3):
+    """A scan result as returned by scanner.run_combined_scan, with vulns findings"""
+    vulnerabilities = [{
+        'cve_id': f'CVE-2026-{i:04d}',
+        'severity': 'HIGH',
+        'package_name': f'pkg{i}',
+        'installed_version': '1.0',
+        'fixed_version': '1.1',
+        'title': f'Issue {i}',
+        'description': f'Description of issue {i}'
+    } for i in range(vulns)]
+    return {
+        'success': True,
+        'container_name': container_name,
+        'scan_date': scan_date,
+        'vulnerability_counts': {'critical': 0, 'high': vulns, 'medium': 0, 'low': 0, 'negligible': 0},
+        'vulnerabilities': vulnerabilities,
+        'total_vulnerabilities': vulns,
+        'bench_results': None
+    }
@@ -0,0 +1,75 @@
+import queue
+
+import pytest
+
+import jobs
+
+@pytest.fixture
+def scan_queue(monkeypatch):
+    """A scan queue no worker takes jobs from, so the test decides when each one finishes"""
+    job_queue = queue.Queue(maxsize=jobs.SCAN_QUEUE_SIZE)
+    monkeypatch.setattr(jobs, '_job_queue', job_queue)
+    monkeypatch.setattr(jobs, '_start_workers', lambda: None)
+    return job_queue
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+def _finish(job_id):
+    with jobs._jobs_lock:
+        jobs._jobs[job_id]['status'] = jobs.JOB_DONE
+    jobs._finish_batch_job(job_id)
+
+def test_batch_queues_at_most_max_parallel_jobs(scan_queue):
+    batch = jobs.submit_scan_batch(['app:1', 'app:2', 'app:3'], max_parallel=2)
+    first, second, third = [job['job_id'] for job in batch['jobs']]
+
+    assert list(scan_queue.queue) == [first, second]
+    assert batch['counts'][jobs.JOB_QUEUED] == 3
+
+    _finish(first)
+    assert list(scan_queue.queue) == [first, second, third]
+
+    _finish(second)
+    _finish(third)
+    batch = jobs.get_batch(batch['batch_id'])
+    assert batch['finished'] is True
+    assert batch['counts'][jobs.JOB_DONE] == 3
+
+def test_batch_endpoint_drops_blanks_and_repeats(client, scan_queue):
+    response = client.post('/api/scan/batch', json={
+        'container_names': ['app:1', ' app:1 ', '', 'app:2', 7], 'max_parallel': 1})
+
+    assert response.status_code == 202
+    data = response.get_json()
+    assert [job['container_name'] for job in data['jobs']] == ['app:1', 'app:2']
+    assert data['max_parallel'] == 1
+    assert len(scan_queue.queue) == 1
+
+@pytest.mark.parametrize('body, error', [
+    ({}, 'Missing container_names list in JSON body'),
+    ({'container_names': 'app:1'}, 'Missing container_names list in JSON body'),
+    ({'container_names': [' ', None]}, 'No valid container names in container_names'),
+    ({'container_names': ['app:1'], 'max_parallel': 0}, 'max_parallel must be a positive integer'),
+    ({'container_names': ['app:1'], 'max_parallel': '2'}, 'max_parallel must be a positive integer'),
+])
+def test_batch_endpoint_rejects_bad_bodies(client, scan_queue, body, error):
+    response = client.post('/api/scan/batch', json=body)
+
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'error': error}
+    assert scan_queue.empty()
+
+def test_batch_endpoint_enforces_the_size_limit(client, scan_queue, monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, 'SCAN_BATCH_LIMIT', 2)
+
+    response = client.post('/api/scan/batch', json={'container_names': ['app:1', 'app:2', 'app:3']})
+
+    assert response.status_code == 400
+    assert scan_queue.empty()
+
+def test_unknown_batch_is_not_found(client):
+    assert client.get('/api/scan/batch/missing').status_code == 404
@@ -0,0 +1,31 @@
+import models
+from conftest import make_scan_result
+
+def test_summary_totals_follow_saves_and_deletes():
+    models.save_scan_results(make_scan_result('app:1', '2026-01-01T00:00:00', vulns=2))
+    clean_id = models.save_scan_results(make_scan_result('app:2', '2026-01-02T00:00:00', vulns=0))
+    issue_id = models.save_scan_results(make_scan_result('app:3', '2026-01-03T00:00:00', vulns=1))
+
+    summary = models.get_dashboard_summary()
+    assert summary['total_scans'] == 3
+    assert summary['containers_with_issues'] == 2
+    assert [scan['container_name'] for scan in summary['recent_scans']] == ['app:3', 'app:2', 'app:1']
+
+    models.delete_scan(clean_id)
+    models.delete_scan(issue_id)
+
+    summary = models.get_dashboard_summary()
+    assert summary['total_scans'] == 1
+    assert summary['containers_with_issues'] == 1
+    assert [scan['container_name'] for scan in summary['recent_scans']] == ['app:1']
+
+def test_summary_lists_only_the_most_recent_scans(monkeypatch):
+    monkeypatch.setattr(models, 'DASHBOARD_RECENT_LIMIT', 2)
+    for day in range(1, 4):
+        models.save_scan_results(make_scan_result(f'app:{day}', f'2026-01-0{day}T00:00:00'))
+
+    summary = models.get_dashboard_summary()
+
+    assert summary['total_scans'] == 3
+    assert summary['containers_with_issues'] == 2
+    assert [scan['container_name'] for scan in summary['recent_scans']] == ['app:3', 'app:2']
@@ -0,0 +1,65 @@
+import pytest
+
+import models
+from conftest import make_scan_result
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+def _finding(severity, installed_version='1.0', fixed_version='1.1'):
+    return {
+        'cve_id': 'CVE-1',
+        'severity': severity,
+        'package_name': 'openssl',
+        'installed_version': installed_version,
+        'fixed_version': fixed_version,
+        'title': 'OpenSSL issue',
+        'description': 'OpenSSL issue'
+    }
+
+def _scan_with(findings, scan_date):
+    scan = make_scan_result(scan_date=scan_date, vulns=0)
+    scan['vulnerabilities'] = findings
+    return models.save_scan_results(scan)
+
+def test_diff_reports_added_resolved_and_changed():
+    base = make_scan_result(scan_date='2026-01-01T00:00:00', vulns=3)
+    target = make_scan_result(scan_date='2026-01-02T00:00:00', vulns=4)
+    target['vulnerabilities'] = target['vulnerabilities'][1:]
+    target['vulnerabilities'][0]['severity'] = 'CRITICAL'
+    base_id = models.save_scan_results(base)
+    scan_id = models.save_scan_results(target)
+
+    diff = models.diff_scans(base_id, scan_id)
+
+    assert [f['cve_id'] for f in diff['added']] == ['CVE-2026-0003']
+    assert [f['cve_id'] for f in diff['resolved']] == ['CVE-2026-0000']
+    assert [(f['cve_id'], f['old_severity'], f['new_severity']) for f in diff['severity_changed']] == [
+        ('CVE-2026-0001', 'HIGH', 'CRITICAL')]
+    assert diff['counts'] == {'added': 1, 'resolved': 1, 'severity_changed': 1}
+
+def test_duplicate_findings_collapse_to_their_most_severe_row():
+    base_id = _scan_with([_finding('LOW', '0.9', '2.0'), _finding('MEDIUM', '1.0', '1.1')], '2026-01-01T00:00:00')
+    scan_id = _scan_with([_finding('MEDIUM', '1.0', '1.1')], '2026-01-02T00:00:00')
+
+    assert models.diff_scans(base_id, scan_id)['counts'] == {'added': 0, 'resolved': 0, 'severity_changed': 0}
+
+def test_collapsed_finding_keeps_its_own_versions():
+    base_id = _scan_with([_finding('LOW')], '2026-01-01T00:00:00')
+    scan_id = _scan_with([_finding('LOW', '0.9', '2.0'), _finding('HIGH', '1.0', '1.1')], '2026-01-02T00:00:00')
+
+    changed = models.diff_scans(base_id, scan_id)['severity_changed']
+
+    assert [(f['new_severity'], f['installed_version'], f['fixed_version']) for f in changed] == [('HIGH', '1.0', '1.1')]
+
+def test_diff_endpoint_compares_a_containers_latest_scans(client):
+    models.save_scan_results(make_scan_result(scan_date='2026-01-01T00:00:00', vulns=1))
+    models.save_scan_results(make_scan_result(scan_date='2026-01-02T00:00:00', vulns=2))
+
+    response = client.get('/api/diff?container_name=app:1')
+
+    assert response.status_code == 200
+    assert [f['cve_id'] for f in response.get_json()['data']['added']] == ['CVE-2026-0001']
+    assert client.get('/api/diff?container_name=app:2').status_code == 404
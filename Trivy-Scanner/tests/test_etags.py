@@ -0,0 +1,63 @@
+import pytest
+
+import models
+from response_cache import clear_response_cache
+from conftest import make_scan_result
+
+@pytest.fixture
+def client():
+    from app import app
+    # Scan ids restart after clear_scan_data, so tags from earlier tests can repeat
+    clear_response_cache()
+    return app.test_client()
+
+def test_catalog_rewrite_changes_other_scans_tags(client):
+    scan_id = models.save_scan_results(make_scan_result('app:1'))
+    other = make_scan_result('app:2')
+    other_id = models.save_scan_results(other)
+    first = client.get(f'/api/scans/{scan_id}')
+
+    vulnerabilities = [dict(vuln, title=f"Reworded {vuln['title']}") for vuln in other['vulnerabilities']]
+    models.replace_scan_findings(other_id, other['vulnerability_counts'], vulnerabilities)
+    second = client.get(f'/api/scans/{scan_id}', headers={'If-None-Match': first.headers['ETag']})
+
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    titles = {vuln['title'] for vuln in second.get_json()['data']['vulnerabilities']}
+    assert titles == {'Reworded Issue 0', 'Reworded Issue 1', 'Reworded Issue 2'}
+
+def test_dashboard_answers_304_until_a_scan_is_saved(client):
+    models.save_scan_results(make_scan_result('app:1'))
+    first = client.get('/api/dashboard')
+    etag = first.headers['ETag']
+
+    repeat = client.get('/api/dashboard', headers={'If-None-Match': etag})
+    assert repeat.status_code == 304
+    assert repeat.headers['ETag'] == etag
+
+    models.save_scan_results(make_scan_result('app:2'))
+    changed = client.get('/api/dashboard', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+def test_scan_answers_304_and_serves_cached_body(client, monkeypatch):
+    scan_id = models.save_scan_results(make_scan_result('app:1'))
+    first = client.get(f'/api/scans/{scan_id}')
+    etag = first.headers['ETag']
+
+    repeat = client.get(f'/api/scans/{scan_id}', headers={'If-None-Match': etag})
+    assert repeat.status_code == 304
+
+    # A second full request comes from the response cache without querying the scan
+    import app as app_module
+    monkeypatch.setattr(app_module, 'get_scan_details', lambda scan_id: pytest.fail('cache miss'))
+    cached = client.get(f'/api/scans/{scan_id}')
+    assert cached.status_code == 200
+    assert cached.headers['ETag'] == etag
+    assert cached.get_data() == first.get_data()
+
+def test_unknown_scan_is_not_tagged(client):
+    response = client.get('/api/scans/999999')
+
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
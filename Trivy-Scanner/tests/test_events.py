@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+import events
+
+@pytest.fixture(autouse=True)
+def short_keepalive(monkeypatch):
+    monkeypatch.setattr(events, 'EVENT_KEEPALIVE', 0.01)
+
+def _parse(message):
+    fields = dict(line.split(': ', 1) for line in message.strip().split('\n'))
+    return int(fields['id']), fields['event'], json.loads(fields['data'])
+
+def test_new_stream_gets_only_later_events():
+    events.publish_event('scan', {'job_id': 'before'})
+    stream = events.iter_event_stream()
+
+    assert next(stream) == f'retry: {events.EVENT_RETRY_MS}\n\n'
+    assert next(stream) == ': keep-alive\n\n'
+    events.publish_event('scan', {'job_id': 'after'})
+
+    _, event_type, data = _parse(next(stream))
+    assert (event_type, data) == ('scan', {'job_id': 'after'})
+
+def test_reconnect_replays_missed_events():
+    events.publish_event('scan', {'job_id': 'seen'})
+    last_event_id = events._events[-1][0]
+    events.publish_event('scan', {'job_id': 'missed-1'})
+    events.publish_event('summary', {'total_scans': 2})
+
+    stream = events.iter_event_stream(last_event_id)
+    next(stream)
+
+    replayed = [_parse(next(stream)) for _ in range(2)]
+    assert [event_id for event_id, _, _ in replayed] == [last_event_id + 1, last_event_id + 2]
+    assert [(event_type, data) for _, event_type, data in replayed] == [
+        ('scan', {'job_id': 'missed-1'}), ('summary', {'total_scans': 2})]
+
+def test_reconnect_past_the_history_resyncs(monkeypatch):
+    monkeypatch.setattr(events, '_events', events.deque(maxlen=2))
+    events.publish_event('scan', {'job_id': 'dropped'})
+    dropped_id = events._events[-1][0]
+    for _ in range(3):
+        events.publish_event('scan', {'job_id': 'kept'})
+
+    stream = events.iter_event_stream(dropped_id - 1)
+    next(stream)
+
+    event_id, event_type, _ = _parse(next(stream))
+    assert event_type == 'resync'
+    assert event_id == events._events[-1][0]
+    assert next(stream) == ': keep-alive\n\n'
+
+def test_reconnect_after_a_restart_resyncs():
+    events.publish_event('scan', {'job_id': 'current'})
+    newest_id = events._events[-1][0]
+
+    stream = events.iter_event_stream(newest_id + 100)
+    next(stream)
+
+    assert _parse(next(stream))[:2] == (newest_id, 'resync')
+
+def test_events_endpoint_streams_without_buffering():
+    from app import app
+
+    response = app.test_client().get('/api/events')
+    try:
+        assert response.mimetype == 'text/event-stream'
+        assert response.headers['Cache-Control'] == 'no-cache'
+        assert response.headers['X-Accel-Buffering'] == 'no'
+    finally:
+        response.close()
@@ -0,0 +1,49 @@
+import csv
+import io
+import json
+
+import pytest
+
+import models
+from conftest import make_scan_result
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+@pytest.fixture
+def scans():
+    models.save_scan_results(make_scan_result('app:1', '2026-01-01T00:00:00', vulns=2))
+    models.save_scan_results(make_scan_result('app:2', '2026-02-01T00:00:00', vulns=1))
+
+def test_ndjson_export_streams_every_finding(client, scans):
+    response = client.get('/api/export/vulnerabilities')
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted((row['container_name'], row['cve_id']) for row in rows) == [
+        ('app:1', 'CVE-2026-0000'), ('app:1', 'CVE-2026-0001'), ('app:2', 'CVE-2026-0000')]
+    assert list(rows[0]) == models.EXPORT_COLUMNS['vulnerabilities']
+
+def test_csv_export_is_filtered(client, scans):
+    response = client.get('/api/export/vulnerabilities?format=csv&container_name=app:1&severity=high&since=2026-01-01')
+
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == models.EXPORT_COLUMNS['vulnerabilities']
+    assert [row[4] for row in rows[1:]] == ['CVE-2026-0000', 'CVE-2026-0001']
+
+def test_export_ignores_pagination_arguments(client, scans):
+    response = client.get('/api/export/vulnerabilities?limit=500&cursor=anything')
+
+    assert response.status_code == 200
+    assert len(response.get_data(as_text=True).splitlines()) == 3
+
+@pytest.mark.parametrize('path', [
+    '/api/export/secrets?severity=HIGH',
+    '/api/export/vulnerabilities?format=xml',
+    '/api/export/vulnerabilities?since=yesterday',
+])
+def test_export_rejects_bad_filters(client, path):
+    assert client.get(path).status_code == 400
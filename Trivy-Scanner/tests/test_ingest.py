@@ -0,0 +1,24 @@
+import models
+from conftest import make_scan_result
+
+def _count(table):
+    conn = models.get_db_connection()
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        models.release_db_connection(conn)
+
+def test_repeated_cves_span_several_insert_batches():
+    scan = make_scan_result(vulns=models.INSERT_BATCH_SIZE * 2 + 500)
+    for i, vuln in enumerate(scan['vulnerabilities']):
+        vuln['cve_id'] = f'CVE-2026-{i % 7:04d}'
+        vuln['package_name'] = f'pkg{i % 11}'
+
+    scan_id = models.save_scan_results(scan)
+
+    assert _count('vulnerabilities') == len(scan['vulnerabilities'])
+    assert _count('cve_catalog') == 7
+    assert _count('package_names') == 11
+    findings, _ = models.search_findings('vulnerabilities', 'pkg3', limit=1000)
+    assert {row['scan_id'] for row in findings} == {scan_id}
+    assert len(findings) == sum(1 for vuln in scan['vulnerabilities'] if vuln['package_name'] == 'pkg3')
@@ -0,0 +1,116 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+import jobs
+import models
+import scan_cache
+from conftest import make_scan_result
+
+DIGEST = 'sha256:' + 'c' * 64
+
+@pytest.fixture
+def no_trivy(monkeypatch):
+    """Run jobs for DIGEST with Trivy DB db-1, failing the test if Trivy would run"""
+    def scan_and_save(*args, **kwargs):
+        raise AssertionError('Trivy should not run')
+
+    monkeypatch.setattr(jobs, 'resolve_image_digest', lambda container_name: DIGEST)
+    monkeypatch.setattr(jobs, 'get_trivy_db_version', lambda: 'db-1')
+    monkeypatch.setattr(jobs, '_scan_and_save', scan_and_save)
+    scan_cache.clear_scan_cache()
+
+def run_job(container_name):
+    job = jobs._new_job(container_name, False)
+    with jobs._jobs_lock:
+        jobs._jobs[job['job_id']] = job
+    jobs._run_job(job['job_id'])
+    return jobs.get_job(job['job_id'])
+
+def save_digest_scan(container_name):
+    scan = make_scan_result(container_name, datetime.now().isoformat())
+    scan.update(image_digest=DIGEST, db_version='db-1')
+    return models.save_scan_results(scan)
+
+def test_cache_hit_under_another_name_saves_a_scan_for_this_name(no_trivy):
+    original_id = save_digest_scan('app:1')
+
+    job = run_job('app:latest')
+
+    assert job['phase'] == jobs.PHASE_CACHED
+    copied_id = job['result']['scan_id']
+    assert copied_id != original_id
+    assert job['result']['container_name'] == 'app:latest'
+    assert models.get_scan_details(copied_id)['scan']['container_name'] == 'app:latest'
+    assert len(models.get_scan_details(copied_id)['vulnerabilities']) == 3
+    assert models.get_cve_affected('CVE-2026-0000')['container_count'] == 2
+
+    assert run_job('app:latest')['result']['scan_id'] == copied_id
+    assert run_job('app:1')['result']['scan_id'] == original_id
+
+def test_coalesced_job_is_parked_and_completed_by_its_leader(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+    runs = []
+
+    def scan_and_save(job_id, container_name, *args, **kwargs):
+        runs.append(container_name)
+        started.set()
+        release.wait(5)
+        scan_result = make_scan_result(container_name)
+        return models.save_scan_results(scan_result), scan_result
+
+    monkeypatch.setattr(jobs, 'resolve_image_digest', lambda container_name: DIGEST)
+    monkeypatch.setattr(jobs, 'get_scan_server', lambda: None)
+    monkeypatch.setattr(jobs, 'TRIVY_SBOM', False)
+    monkeypatch.setattr(jobs, '_scan_and_save', scan_and_save)
+    leader = jobs._new_job('app:1', True)
+    follower = jobs._new_job('app:latest', True)
+    with jobs._jobs_lock:
+        jobs._jobs[leader['job_id']] = leader
+        jobs._jobs[follower['job_id']] = follower
+
+    leader_thread = threading.Thread(target=jobs._run_job, args=(leader['job_id'],))
+    leader_thread.start()
+    started.wait(5)
+
+    # Returns straight away instead of holding a worker until the leader is done
+    assert jobs._run_job(follower['job_id']) is True
+    assert jobs.get_job(follower['job_id'])['phase'] == jobs.PHASE_WAITING
+
+    release.set()
+    leader_thread.join(5)
+
+    leader_result = jobs.get_job(leader['job_id'])['result']
+    follower_job = jobs.get_job(follower['job_id'])
+    assert runs == ['app:1']
+    assert follower_job['phase'] == jobs.PHASE_COALESCED
+    assert follower_job['result']['scan_id'] == leader_result['scan_id']
+    assert follower_job['result']['coalesced'] is True
+
+def test_sbom_is_generated_off_the_scan_worker_through_the_server(monkeypatch):
+    calls = []
+
+    def generate_sbom(container_name, image_digest, server_url):
+        calls.append((container_name, image_digest, server_url))
+        return b'{"bomFormat": "CycloneDX"}'
+
+    monkeypatch.setattr(jobs, 'TRIVY_SBOM', True)
+    monkeypatch.setattr(jobs, 'generate_sbom', generate_sbom)
+    monkeypatch.setattr(jobs, 'get_scan_server', lambda: 'http://127.0.0.1:4954')
+    monkeypatch.setattr(jobs, 'resolve_image_digest', lambda container_name: DIGEST)
+    def scan_and_save(job_id, container_name, *args):
+        scan_result = dict(make_scan_result(container_name), image_digest=DIGEST)
+        return models.save_scan_results(scan_result), scan_result
+
+    monkeypatch.setattr(jobs, 'get_trivy_db_version', lambda: None)
+    monkeypatch.setattr(jobs, '_scan_and_save', scan_and_save)
+    jobs._start_workers()
+
+    job = run_job('app:1')
+    jobs._sbom_queue.join()
+
+    assert job['phase'] == jobs.PHASE_SAVED
+    assert calls == [('app:1', DIGEST, 'http://127.0.0.1:4954')]
+    assert models.get_sbom(DIGEST) == b'{"bomFormat": "CycloneDX"}'
@@ -0,0 +1,41 @@
+import sqlite3
+
+import models
+
+def test_database_is_at_the_latest_migration(database):
+    assert models.migrate_database()
+    conn = sqlite3.connect(database)
+    try:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(models.MIGRATION_STEPS)
+    finally:
+        conn.close()
+
+def test_failed_step_leaves_nothing_behind(tmp_path, monkeypatch):
+    def applied(cursor):
+        cursor.execute('CREATE TABLE first_step (id INTEGER)')
+
+    def fails_halfway(cursor):
+        cursor.execute('CREATE TABLE second_step (id INTEGER)')
+        raise sqlite3.OperationalError('disk I/O error')
+
+    path = str(tmp_path / 'migrate.db')
+    monkeypatch.setattr(models, 'DATABASE_PATH', path)
+    monkeypatch.setattr(models, 'MIGRATION_STEPS', [applied, fails_halfway])
+
+    assert models.migrate_database() is False
+
+    conn = sqlite3.connect(path)
+    try:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        assert tables == ['first_step']
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == 1
+    finally:
+        conn.close()
+
+def test_refreshing_a_containers_exposure_uses_an_index():
+    conn = models.get_db_connection()
+    try:
+        plan = conn.execute('EXPLAIN QUERY PLAN DELETE FROM cve_exposure WHERE container_name = ?', ('app:1',)).fetchall()
+    finally:
+        models.release_db_connection(conn)
+    assert 'idx_cve_exposure_container' in plan[0]['detail']
@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+
+import models
+from conftest import make_scan_result
+
+# ["a", {"x": 1}]: a list of the right length holding a value SQLite cannot bind
+NESTED_CURSOR = 'WyJhIiwgeyJ4IjoxfV0'
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+def test_cursor_round_trip():
+    cursor = models.encode_cursor(['2026-01-01T00:00:00', 7])
+    assert models.decode_cursor(cursor, 2) == ['2026-01-01T00:00:00', 7]
+
+@pytest.mark.parametrize('values', [
+    ['a', {'x': 1}],
+    [['2026-01-01'], 1],
+    [None, 1],
+    ['2026-01-01', True],
+])
+def test_decode_cursor_rejects_non_scalar_values(values):
+    with pytest.raises(ValueError):
+        models.decode_cursor(models.encode_cursor(values), 2)
+
+@pytest.mark.parametrize('cursor', ['not base64!', 'bm90IGpzb24', models.encode_cursor([1, 2, 3])])
+def test_decode_cursor_rejects_malformed(cursor):
+    with pytest.raises(ValueError):
+        models.decode_cursor(cursor, 2)
+
+def test_list_scans_pages_with_cursor():
+    for day in range(1, 4):
+        models.save_scan_results(make_scan_result(scan_date=f'2026-01-0{day}T00:00:00'))
+
+    first, cursor = models.list_scans(limit=2)
+    second, last_cursor = models.list_scans(cursor=cursor, limit=2)
+
+    assert [scan['scan_date'][:10] for scan in first + second] == ['2026-01-03', '2026-01-02', '2026-01-01']
+    assert last_cursor is None
+
+@pytest.mark.parametrize('path', ['/api/scans', '/api/scans/{scan_id}/vulnerabilities', '/api/search?q=issue'])
+def test_nested_cursor_is_a_bad_request(client, path):
+    scan_id = models.save_scan_results(make_scan_result())
+    separator = '&' if '?' in path else '?'
+    response = client.get(f'{path.format(scan_id=scan_id)}{separator}cursor={NESTED_CURSOR}')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'error': 'Invalid cursor'}
+
+def test_list_scans_releases_connection_on_error(monkeypatch):
+    models.list_scans()
+    pooled = models._pool.qsize()
+    monkeypatch.setitem(models.SEVERITY_TOTAL_COLUMNS, 'CRITICAL', 'no_such_column')
+
+    with pytest.raises(sqlite3.OperationalError):
+        models.list_scans(severity='CRITICAL')
+
+    assert models._pool.qsize() == pooled
+
+def test_list_scan_vulnerabilities_releases_connection_on_error(monkeypatch):
+    scan_id = models.save_scan_results(make_scan_result())
+    models.list_scan_vulnerabilities(scan_id)
+    pooled = models._pool.qsize()
+    monkeypatch.setattr(models, 'VULNERABILITY_SELECT_SQL', 'SELECT * FROM no_such_table v')
+
+    with pytest.raises(sqlite3.OperationalError):
+        models.list_scan_vulnerabilities(scan_id)
+
+    assert models._pool.qsize() == pooled
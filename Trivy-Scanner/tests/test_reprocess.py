@@ -0,0 +1,31 @@
+import json
+
+import models
+import reprocess
+import scanner
+from conftest import make_scan_result
+
+def _archived_scan(container_name, title):
+    report = {'Results': [{'Target': container_name, 'Vulnerabilities': [{
+        'VulnerabilityID': 'CVE-2026-0000',
+        'PkgName': 'pkg0',
+        'InstalledVersion': '1.0',
+        'FixedVersion': '1.1',
+        'Severity': 'CRITICAL',
+        'Title': title,
+        'Description': 'Description of issue 0'
+    }]}]}
+    scan = make_scan_result(container_name, vulns=1)
+    scan['report'] = scanner._archive_report('json', 'image', json.dumps(report).encode())
+    return models.save_scan_results(scan)
+
+def test_reprocess_rebuilds_every_slice(monkeypatch):
+    monkeypatch.setattr(reprocess, 'REPROCESS_CHUNK_SIZE', 2)
+    scan_ids = [_archived_scan(f'app:{i}', f'Reworded {i}') for i in range(7)]
+
+    assert reprocess.reprocess_scans(workers=2) == 7
+
+    details = models.get_scan_details(scan_ids[0])
+    assert details['scan']['total_critical'] == 1
+    # Oldest first, so the newest report's text is left in the catalog
+    assert details['vulnerabilities'][0]['title'] == 'Reworded 6'
@@ -0,0 +1,44 @@
+import pytest
+
+import jobs
+
+STORED_DIGEST = 'sha256:' + 'a' * 64
+MOVED_DIGEST = 'sha256:' + 'b' * 64
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Run jobs against a stored SBOM for STORED_DIGEST, recording (digest, from_sbom) per scan"""
+    calls = []
+
+    def scan_and_save(job_id, container_name, image_digest, server_url, timings, on_phase,
+                      sbom_path=None, secret_results=None):
+        calls.append((image_digest, sbom_path is not None))
+        return None, {}
+
+    monkeypatch.setattr(jobs, 'TRIVY_SBOM', True)
+    monkeypatch.setattr(jobs, 'lookup_cached_scan', lambda container_name, image_digest, db_version: None)
+    monkeypatch.setattr(jobs, 'get_trivy_db_version', lambda: 'db-1')
+    monkeypatch.setattr(jobs, 'get_scan_server', lambda: None)
+    monkeypatch.setattr(jobs, 'get_sbom', lambda image_digest: b'{}' if image_digest == STORED_DIGEST else None)
+    monkeypatch.setattr(jobs, 'get_digest_secret_results', lambda image_digest: {'summary': {}, 'checks': []})
+    monkeypatch.setattr(jobs, '_scan_and_save', scan_and_save)
+    return calls
+
+def run_rescan(monkeypatch, current_digest):
+    monkeypatch.setattr(jobs, 'resolve_image_digest', lambda container_name: current_digest)
+    job = jobs._new_job('app:latest', False, image_digest=STORED_DIGEST)
+    with jobs._jobs_lock:
+        jobs._jobs[job['job_id']] = job
+    jobs._run_job(job['job_id'])
+
+def test_rescan_uses_sbom_while_tag_is_unchanged(scans, monkeypatch):
+    run_rescan(monkeypatch, STORED_DIGEST)
+    assert scans == [(STORED_DIGEST, True)]
+
+def test_rescan_of_moved_tag_scans_the_image(scans, monkeypatch):
+    run_rescan(monkeypatch, MOVED_DIGEST)
+    assert scans == [(MOVED_DIGEST, False)]
+
+def test_rescan_scans_the_image_when_digest_is_unknown(scans, monkeypatch):
+    run_rescan(monkeypatch, None)
+    assert scans == [(None, False)]
@@ -0,0 +1,38 @@
+import models
+import retention
+from conftest import make_scan_result
+
+def test_retention_purges_old_scans_in_batches(monkeypatch):
+    monkeypatch.setattr(retention, 'RETENTION_KEEP_SCANS', 2)
+    monkeypatch.setattr(retention, 'RETENTION_BATCH_SIZE', 2)
+    monkeypatch.setattr(retention, 'BATCH_PAUSE', 0)
+    lookups = []
+
+    def find_expired_scan_ids(*args):
+        lookups.append(args)
+        return models.find_expired_scan_ids(*args)
+
+    monkeypatch.setattr(retention, 'find_expired_scan_ids', find_expired_scan_ids)
+    monkeypatch.setattr(retention, 'publish_event', lambda *args: None)
+    for day in range(1, 6):
+        models.save_scan_results(make_scan_result('app:1', f'2026-01-0{day}T00:00:00', vulns=day))
+    kept = models.save_scan_results(make_scan_result('app:2', '2026-01-01T00:00:00', vulns=1))
+
+    assert retention.run_retention() == 3
+
+    scans, _ = models.list_scans()
+    assert sorted(scan['scan_date'][:10] for scan in scans if scan['container_name'] == 'app:1') == [
+        '2026-01-04', '2026-01-05']
+    assert kept in [scan['id'] for scan in scans]
+    assert len(lookups) == 1
+    assert models.get_cve_affected('CVE-2026-0004')['container_count'] == 1
+    assert models.get_trends('app:1', since='2026-01-01')[0]['day'] == '2026-01-04'
+
+def test_purged_catalog_entries_are_pruned(monkeypatch):
+    monkeypatch.setattr(retention, 'RETENTION_MAX_AGE_DAYS', 1)
+    monkeypatch.setattr(retention, 'BATCH_PAUSE', 0)
+    monkeypatch.setattr(retention, 'publish_event', lambda *args: None)
+    models.save_scan_results(make_scan_result('app:1', '2020-01-01T00:00:00', vulns=3))
+
+    assert retention.run_retention() == 1
+    assert models.get_cve_affected('CVE-2026-0000')['title'] is None
@@ -0,0 +1,30 @@
+import sqlite3
+
+import pytest
+
+import models
+from conftest import make_scan_result
+
+def test_search_pages_with_cursor():
+    models.save_scan_results(make_scan_result(vulns=5))
+
+    first, cursor = models.search_findings('vulnerabilities', 'issue', limit=3)
+    second, last_cursor = models.search_findings('vulnerabilities', 'issue', cursor=cursor, limit=3)
+
+    assert len(first) == 3 and len(second) == 2
+    assert {row['cve_id'] for row in first}.isdisjoint(row['cve_id'] for row in second)
+    assert last_cursor is None
+
+def test_search_rejects_nested_cursor():
+    with pytest.raises(ValueError):
+        models.search_findings('vulnerabilities', 'issue', cursor=models.encode_cursor(['a', {'x': 1}]))
+
+def test_search_releases_connection_on_error(monkeypatch):
+    models.search_findings('secrets', 'issue')
+    pooled = models._pool.qsize()
+    monkeypatch.setattr(models, 'LATEST_SCANS_CTE', 'latest AS (SELECT * FROM no_such_table {where})')
+
+    with pytest.raises(sqlite3.OperationalError):
+        models.search_findings('secrets', 'issue')
+
+    assert models._pool.qsize() == pooled
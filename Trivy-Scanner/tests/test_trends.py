@@ -0,0 +1,33 @@
+import models
+from conftest import make_scan_result
+
+def _highs(points):
+    return [(point['day'], point['high']) for point in points]
+
+def test_container_trend_keeps_each_days_newest_scan():
+    models.save_scan_results(make_scan_result('app:1', '2026-01-01T12:00:00', vulns=5))
+    models.save_scan_results(make_scan_result('app:1', '2026-01-01T08:00:00', vulns=1))
+    models.save_scan_results(make_scan_result('app:1', '2026-01-03T00:00:00', vulns=2))
+    models.save_scan_results(make_scan_result('app:2', '2026-01-02T00:00:00', vulns=4))
+
+    points = models.get_trends('app:1', '2026-01-01', '2026-01-31')
+
+    assert _highs(points) == [('2026-01-01', 5), ('2026-01-03', 2)]
+
+def test_fleet_trend_carries_containers_between_scans():
+    models.save_scan_results(make_scan_result('app:1', '2026-01-01T00:00:00', vulns=3))
+    models.save_scan_results(make_scan_result('app:2', '2026-01-02T00:00:00', vulns=4))
+    models.save_scan_results(make_scan_result('app:1', '2026-01-03T00:00:00', vulns=1))
+
+    points = models.get_trends(None, '2026-01-02', '2026-01-31')
+
+    assert _highs(points) == [('2026-01-02', 7), ('2026-01-03', 5)]
+    assert [point['containers'] for point in points] == [2, 2]
+
+def test_deleting_a_days_newest_scan_falls_back_to_the_next():
+    models.save_scan_results(make_scan_result('app:1', '2026-01-01T08:00:00', vulns=1))
+    newest_id = models.save_scan_results(make_scan_result('app:1', '2026-01-01T12:00:00', vulns=5))
+
+    models.delete_scan(newest_id)
+
+    assert _highs(models.get_trends('app:1', '2026-01-01', '2026-01-31')) == [('2026-01-01', 1)]
@@ -0,0 +1,101 @@
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+
+import models
+from conftest import make_scan_result
+
+def _request(func, *args):
+    return models._WriteRequest(func, args)
+
+def _fail(cursor):
+    cursor.execute("INSERT INTO sboms (image_digest, container_name, sbom, raw_size, created_at) "
+                   "VALUES ('sha256:x', 'app:1', x'00', 1, '2026-01-01')")
+    raise RuntimeError('request failed')
+
+def _count(table):
+    conn = models.get_db_connection()
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        models.release_db_connection(conn)
+
+@pytest.fixture
+def writer_conn():
+    conn = models._open_db_connection()
+    conn.isolation_level = None
+    yield conn
+    conn.close()
+
+def test_failing_request_does_not_undo_its_group(writer_conn):
+    requests = [
+        _request(models._write_scan_results, make_scan_result('app:1')),
+        _request(_fail),
+        _request(models._write_scan_results, make_scan_result('app:2'))
+    ]
+
+    models._run_write_group(writer_conn, requests)
+
+    assert requests[0].error is None and requests[2].error is None
+    assert isinstance(requests[1].error, RuntimeError)
+    assert _count('scans') == 2
+    assert _count('vulnerabilities') == 6
+    assert _count('sboms') == 0
+
+def test_streamed_scan_is_written_once_when_its_group_runs_again(writer_conn):
+    scan = make_scan_result()
+    scan_stream = dict(scan, bench_results={'summary': {
+        'total_checks': 0, 'pass_count': 0, 'warn_count': 0, 'fail_count': 0,
+        'info_count': 0, 'note_count': 0, 'score': 100}})
+    with tempfile.SpooledTemporaryFile() as spool:
+        batch_count = models._spool_findings((('vulnerability', vuln) for vuln in scan['vulnerabilities']), spool)
+        requests = [_request(models._write_scan_stream, scan_stream, spool, batch_count), _request(_fail)]
+
+        models._run_write_group(writer_conn, requests)
+
+    assert requests[0].error is None
+    assert _count('vulnerabilities') == 3
+
+def test_writer_that_cannot_open_the_database_fails_the_caller(monkeypatch):
+    def cannot_open():
+        raise sqlite3.OperationalError('unable to open database file')
+
+    monkeypatch.setattr(models, '_open_db_connection', cannot_open)
+    monkeypatch.setitem(models._writer, 'pid', None)
+    monkeypatch.setattr(models, 'DB_WRITE_TIMEOUT', 5)
+
+    with pytest.raises(sqlite3.OperationalError):
+        models.run_write(lambda cursor: None)
+    assert models._writer['pid'] is None
+    assert models.save_scan_results(make_scan_result()) is False
+
+def test_write_times_out_and_is_skipped_if_not_started(monkeypatch):
+    monkeypatch.setattr(models, 'DB_WRITE_TIMEOUT', 0.2)
+    models.run_write(lambda cursor: None)
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def block(cursor):
+        started.set()
+        release.wait(5)
+
+    def run_blocking_write():
+        try:
+            models.run_write(block)
+        except TimeoutError:
+            pass
+
+    blocker = threading.Thread(target=run_blocking_write)
+    blocker.start()
+    started.wait(5)
+
+    with pytest.raises(TimeoutError):
+        models.run_write(lambda cursor: ran.append(True))
+
+    release.set()
+    blocker.join(5)
+    models.run_write(lambda cursor: None)
+    assert ran == []
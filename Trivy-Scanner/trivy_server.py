@@ -0,0 +1,155 @@
+import atexit
+import os
+import subprocess
+import threading
+import time
+import urllib.request
+
+from scanner import get_trivy_env, TRIVY_SKIP_DB_UPDATE
+
+# Run scans as clients of one long-lived local `trivy server` instead of standalone processes
+TRIVY_SERVER_MODE = os.environ.get('TRIVY_SERVER_MODE', 'false').lower() in ('1', 'true', 'yes')
+
+# Address the managed Trivy server listens on
+TRIVY_SERVER_ADDR = os.environ.get('TRIVY_SERVER_ADDR', '127.0.0.1:4954')
+
+# Seconds to wait for a new server to become healthy (first start downloads the DB)
+TRIVY_SERVER_START_TIMEOUT = int(os.environ.get('TRIVY_SERVER_START_TIMEOUT', '180'))
+
+# Seconds between supervisor health checks
+HEALTH_CHECK_INTERVAL = 10
+
+# Failed health checks in a row before a running server is restarted
+HEALTH_CHECK_FAILURES = 3
+
+_server = {'process': None, 'healthy': False}
+_server_lock = threading.Lock()
+_supervisor = []
+_initial_start = threading.Event()
+
+def get_trivy_server_url():
+    return f'http://{TRIVY_SERVER_ADDR}'
+
+def is_trivy_server_healthy():
+    """Check the server's /healthz endpoint"""
+    try:
+        with urllib.request.urlopen(f'{get_trivy_server_url()}/healthz', timeout=2) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+def _start_process():
+    """Start the Trivy server process (caller holds the lock)"""
+    cmd = ['trivy', 'server', '--listen', TRIVY_SERVER_ADDR]
+    if TRIVY_SKIP_DB_UPDATE:
+        cmd.append('--skip-db-update')
+
+    print(f"Starting Trivy server on {TRIVY_SERVER_ADDR}")
+    try:
+        _server['process'] = subprocess.Popen(cmd, env=get_trivy_env())
+    except OSError as e:
+        print(f"Could not start Trivy server: {e}")
+        _server['process'] = None
+    _server['healthy'] = False
+
+def _stop_process():
+    """Stop the Trivy server process if it is running (caller holds the lock)"""
+    process = _server['process']
+    if process is not None and process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    _server['process'] = None
+    _server['healthy'] = False
+
+def _wait_until_healthy(timeout):
+    """Wait for the server to answer health checks, returning False on timeout or exit"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with _server_lock:
+            process = _server['process']
+        if process is None or process.poll() is not None:
+            return False
+        if is_trivy_server_healthy():
+            with _server_lock:
+                _server['healthy'] = True
+            return True
+        time.sleep(1)
+    return False
+
+def _supervise():
+    """Restart the server when it exits or stops answering health checks"""
+    failures = 0
+    while True:
+        time.sleep(HEALTH_CHECK_INTERVAL)
+
+        with _server_lock:
+            process = _server['process']
+            crashed = process is None or process.poll() is not None
+            if crashed:
+                print("Trivy server is not running, restarting it")
+                _start_process()
+                failures = 0
+
+        if crashed:
+            _wait_until_healthy(TRIVY_SERVER_START_TIMEOUT)
+            continue
+
+        if is_trivy_server_healthy():
+            failures = 0
+            with _server_lock:
+                _server['healthy'] = True
+            continue
+
+        failures += 1
+        if failures >= HEALTH_CHECK_FAILURES:
+            print(f"Trivy server failed {failures} health checks, restarting it")
+            with _server_lock:
+                _stop_process()
+                _start_process()
+            failures = 0
+            _wait_until_healthy(TRIVY_SERVER_START_TIMEOUT)
+
+def start_trivy_server():
+    """Start the managed server and its supervisor once per process"""
+    with _server_lock:
+        first_start = not _supervisor
+        if first_start:
+            _start_process()
+            supervisor = threading.Thread(target=_supervise, name='trivy-server-supervisor', daemon=True)
+            supervisor.start()
+            _supervisor.append(supervisor)
+            atexit.register(stop_trivy_server)
+
+    if first_start:
+        _wait_until_healthy(TRIVY_SERVER_START_TIMEOUT)
+        _initial_start.set()
+    else:
+        # Scans submitted during the first start wait for it rather than running standalone
+        _initial_start.wait(TRIVY_SERVER_START_TIMEOUT)
+
+def stop_trivy_server():
+    with _server_lock:
+        _stop_process()
+
+def get_scan_server():
+    """Get the server URL scans should use, or None to run Trivy standalone
+
+    Starts the server on first use. Falls back to standalone scans while the
+    server is down so scanning keeps working during a restart.
+    """
+    if not TRIVY_SERVER_MODE:
+        return None
+
+    start_trivy_server()
+
+    with _server_lock:
+        healthy = _server['healthy']
+    if healthy and is_trivy_server_healthy():
+        return get_trivy_server_url()
+
+    print("Trivy server unavailable, running standalone scan")
+    return None